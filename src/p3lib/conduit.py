@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
+from threading import Condition, Lock
+
+from p3lib.uio import PRIORITY
 
 class Conduit(object):
 	"""@brief A generalised conduit implementation. A conduit is used for 
@@ -10,17 +13,35 @@ class Conduit(object):
 	"""
 	CONDUIT_TYPE_QUEUE 			= 1
 	CONDUIT_TYPE_TCP_CONNECTION = 2
+
+	A_END						= "A"
+	B_END						= "B"
+
+	# What happens when data is put into a full (maxSize reached) direction of the conduit.
+	OVERFLOW_RAISE				= 1		# Raise an exception (the default).
+	OVERFLOW_BLOCK				= 2		# Block until space is available, raise an exception if overflowTimeoutSeconds expires.
+	OVERFLOW_DROP_NEWEST		= 3		# Discard the data being put.
+	OVERFLOW_DROP_OLDEST		= 4		# Discard the oldest data in the queue to make room.
+	OVERFLOW_COALESCE			= 5		# Replace queued data with the same key (see coalesceKey), else drop the oldest.
+	OVERFLOW_POLICIES			= (OVERFLOW_RAISE, OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)
 	
-	def __init__(self, uio=None, cName="", conduitType=CONDUIT_TYPE_QUEUE, readBlock=True, readBlockTimeoutSeconds=None, maxSize = 0, ):
+	def __init__(self, uio=None, cName="", conduitType=CONDUIT_TYPE_QUEUE, readBlock=True, readBlockTimeoutSeconds=None, maxSize = 0,
+				 aToBOverflowPolicy=OVERFLOW_RAISE, bToAOverflowPolicy=OVERFLOW_RAISE, overflowTimeoutSeconds=None, coalesceKey=None):
 		"""@brief Responsible for providing a conduit for data between entities. 
 		   @param uio A User input/output object. If supplied then debug info for the conduit will be recorded.
 		   @param cName The conduit name. Only useful if a uio object has been passed for debugging purposes.
 		   @param readBlock If true then all getX() methods will block until data is available.
 		   @param readBlockTimeoutSeconds The time in seconds for a read (when readBlock=True) to timeout. The default = None (block indefinatley).
-		   @param maxSize Maximum number of elements in the queue. Only valid if conduitType = CONDUIT_TYPE_QUEUE."""
+		   @param maxSize Maximum number of elements in the queue. Only valid if conduitType = CONDUIT_TYPE_QUEUE.
+		   @param aToBOverflowPolicy The Conduit.OVERFLOW_* policy applied when the A -> B direction is full.
+		   @param bToAOverflowPolicy The Conduit.OVERFLOW_* policy applied when the B -> A direction is full.
+		   @param overflowTimeoutSeconds The time in seconds a put may block for when the policy is OVERFLOW_BLOCK (default = None, block indefinately).
+		   @param coalesceKey A method that is passed the data being put and returns its key. Required by OVERFLOW_COALESCE."""
 		
 		if conduitType == Conduit.CONDUIT_TYPE_QUEUE:
-			self._conduit = QueueConduit(uio=uio, cName=cName, maxQueueSize=maxSize, readBlock=readBlock, readBlockTimeoutSeconds=readBlockTimeoutSeconds)
+			self._conduit = QueueConduit(uio=uio, cName=cName, maxQueueSize=maxSize, readBlock=readBlock, readBlockTimeoutSeconds=readBlockTimeoutSeconds,
+										 aToBOverflowPolicy=aToBOverflowPolicy, bToAOverflowPolicy=bToAOverflowPolicy,
+										 overflowTimeoutSeconds=overflowTimeoutSeconds, coalesceKey=coalesceKey)
 			
 		elif conduitType == Conduit.CONDUIT_TYPE_TCP_CONNECTION:
 			raise Exception("TCP conduits not yet implemented.")
@@ -38,15 +59,31 @@ class Conduit(object):
     	   @param data The data object to be pushed into the conduit."""
 		self._conduit.putB(data)
     	
-	def getA(self):
+	def getA(self, block=None, timeoutSeconds=None):
 		"""@brief Get some data from the B -> A conduit.
+		   @param block If True then the call will block until data is available. If None (default) the readBlock constructor arg is used.
+		   @param timeoutSeconds The time in seconds to block for. If None (default) the readBlockTimeoutSeconds constructor arg is used.
 		   @return The data from the conduit or None of no data is available."""
-		return self._conduit.getA()
+		return self._conduit.getA(block=block, timeoutSeconds=timeoutSeconds)
 						
-	def getB(self):
+	def getB(self, block=None, timeoutSeconds=None):
 		"""@brief Get some data from the A -> B conduit.
+		   @param block If True then the call will block until data is available. If None (default) the readBlock constructor arg is used.
+		   @param timeoutSeconds The time in seconds to block for. If None (default) the readBlockTimeoutSeconds constructor arg is used.
 		   @return The data from the conduit or None of no data is available."""
-		return self._conduit.getB()
+		return self._conduit.getB(block=block, timeoutSeconds=timeoutSeconds)
+
+	def tryGetA(self, default=None):
+		"""@brief Get some data from the B -> A conduit without blocking.
+		   @param default The value returned if no data is available.
+		   @return The data from the conduit or default if no data is available."""
+		return self._conduit.tryGetA(default=default)
+
+	def tryGetB(self, default=None):
+		"""@brief Get some data from the A -> B conduit without blocking.
+		   @param default The value returned if no data is available.
+		   @return The data from the conduit or default if no data is available."""
+		return self._conduit.tryGetB(default=default)
 		
 	def aReadAvailable(self):
 		"""@return True if there is data available to be read from the A side of the conduit."""
@@ -56,6 +93,39 @@ class Conduit(object):
 		"""@return True if there is data available to be read from the B side of the conduit."""
 		return self._conduit.bReadAvailable()
 
+	def readAvailable(self, end):
+		"""@param end The conduit end (Conduit.A_END or Conduit.B_END).
+		   @return True if there is data available to be read from the given end of the conduit."""
+		if end == Conduit.A_END:
+			return self.aReadAvailable()
+
+		elif end == Conduit.B_END:
+			return self.bReadAvailable()
+
+		raise Exception("%s is an invalid conduit end." % (str(end)) )
+
+	def getAToBStats(self):
+		"""@return A ConduitStats instance holding a snapshot of the A -> B direction statistics."""
+		return self._conduit.getAToBStats()
+
+	def getBToAStats(self):
+		"""@return A ConduitStats instance holding a snapshot of the B -> A direction statistics."""
+		return self._conduit.getBToAStats()
+
+	def resetStats(self):
+		"""@brief Reset the statistics of both directions of the conduit."""
+		self._conduit.resetStats()
+
+	def addSelector(self, selector):
+		"""@brief Add a ConduitSelector to be notified when data is put into the conduit.
+		   @param selector The ConduitSelector instance."""
+		self._conduit.addSelector(selector)
+
+	def removeSelector(self, selector):
+		"""@brief Remove a ConduitSelector previously added with addSelector().
+		   @param selector The ConduitSelector instance."""
+		self._conduit.removeSelector(selector)
+
 class QueueConduit(Conduit):
 	"""@brief Responsible for providing the functionality required to communicate between
 	          threads (ITC= Inter Thread Communication).
@@ -63,12 +133,23 @@ class QueueConduit(Conduit):
 	          The ITC has an A side and a B side. data can be sent from the A and B sides
 	          and is forwarded to the other side."""
 
-	def __init__(self, uio=None, cName="", maxQueueSize = 0, readBlock=True, readBlockTimeoutSeconds=0):
+	def __init__(self, uio=None, cName="", maxQueueSize = 0, readBlock=True, readBlockTimeoutSeconds=0,
+				 aToBOverflowPolicy=Conduit.OVERFLOW_RAISE, bToAOverflowPolicy=Conduit.OVERFLOW_RAISE, overflowTimeoutSeconds=None, coalesceKey=None):
 		"""@brief Constructor
 		   @param uio A User input/output object. If supplied then debug info for the conduit will be recorded.
 		   @param cName The conduit name. Only useful if a uio object has been passed for debugging purposes.
 		   @param maxQueueSize The maximum queue size that we will allow (default = 0, no limit)
-		   @param readBlock If True then reads will block until data is available or a timeout (if > 0) occurs."""
+		   @param readBlock If True then reads will block until data is available or a timeout (if > 0) occurs.
+		   @param aToBOverflowPolicy The Conduit.OVERFLOW_* policy applied when the A -> B queue is full.
+		   @param bToAOverflowPolicy The Conduit.OVERFLOW_* policy applied when the B -> A queue is full.
+		   @param overflowTimeoutSeconds The time in seconds a put may block for when the policy is OVERFLOW_BLOCK (default = None, block indefinately).
+		   @param coalesceKey A method that is passed the data being put and returns its key. Required by OVERFLOW_COALESCE."""
+		for overflowPolicy in (aToBOverflowPolicy, bToAOverflowPolicy):
+			if overflowPolicy not in Conduit.OVERFLOW_POLICIES:
+				raise Exception("%s is an invalid overflow policy." % (str(overflowPolicy)) )
+
+			if overflowPolicy == Conduit.OVERFLOW_COALESCE and coalesceKey is None:
+				raise Exception("A coalesceKey method is required by the OVERFLOW_COALESCE policy.")
 		  
 		self._uio = uio
 		self._cName = cName
@@ -77,57 +158,194 @@ class QueueConduit(Conduit):
 		self._readBlockTimeoutSeconds 	= readBlockTimeoutSeconds
 		self._aToBQueue 				= Queue(maxQueueSize)
 		self._bToAQueue	 				= Queue(maxQueueSize)
+		self._aToBOverflowPolicy		= aToBOverflowPolicy
+		self._bToAOverflowPolicy		= bToAOverflowPolicy
+		self._overflowTimeoutSeconds	= overflowTimeoutSeconds
+		self._coalesceKey				= coalesceKey
+		self._aToBStats					= ConduitStats()
+		self._bToAStats					= ConduitStats()
+		self._selectorList				= []
+		self._selectorLock				= Lock()
+
+	def addSelector(self, selector):
+		"""@brief Add a ConduitSelector to be notified when data is put into either queue.
+		   @param selector The ConduitSelector instance."""
+		with self._selectorLock:
+			if selector not in self._selectorList:
+				self._selectorList.append(selector)
+
+	def removeSelector(self, selector):
+		"""@brief Remove a ConduitSelector previously added with addSelector().
+		   @param selector The ConduitSelector instance."""
+		with self._selectorLock:
+			if selector in self._selectorList:
+				self._selectorList.remove(selector)
+
+	def _notifySelectors(self):
+		"""@brief Wake any ConduitSelector instances waiting on this conduit."""
+		if self._selectorList:
+			with self._selectorLock:
+				selectorList = list(self._selectorList)
+			for selector in selectorList:
+				selector.notify()
 		
-	def _checkQueueSize(self):
-		"""@brief check that we have not reached the max queue size."""
-		if self._maxQueueSize > 0:
-			if self._aToBQueue.qsize() >= self._maxQueueSize:
-				raise Exception("%s: A -> B queue full." % (self.__class__.__name__) )
-				
-			if self._bToAQueue.qsize() >= self._maxQueueSize:
-				raise Exception("%s: B -> A queue full." % (self.__class__.__name__) )
+	def getAToBStats(self):
+		"""@return A ConduitStats instance holding a snapshot of the A -> B queue statistics."""
+		return self._aToBStats.copy()
+
+	def getBToAStats(self):
+		"""@return A ConduitStats instance holding a snapshot of the B -> A queue statistics."""
+		return self._bToAStats.copy()
+
+	def resetStats(self):
+		"""@brief Reset the statistics of both queues."""
+		self._aToBStats.reset()
+		self._bToAStats.reset()
+
+	def _coalesce(self, queue, data):
+		"""@brief Replace the data in the queue that has the same key as data.
+		   @param queue The queue to search.
+		   @param data The data to replace the queued data with.
+		   @return True if queued data was replaced, False if no queued data has the same key."""
+		key = self._coalesceKey(data)
+		with queue.mutex:
+			for index, queuedData in enumerate(queue.queue):
+				if self._coalesceKey(queuedData) == key:
+					queue.queue[index] = data
+					return True
+		return False
+
+	def _put(self, queue, stats, overflowPolicy, data, direction):
+		"""@brief Put data into a queue applying the overflow policy if the queue is full.
+		   @param queue The queue to put the data into.
+		   @param stats The ConduitStats instance for the queue.
+		   @param overflowPolicy The Conduit.OVERFLOW_* policy for the queue.
+		   @param data The data object to be pushed into the queue.
+		   @param direction The direction text (E.G A -> B) used in error messages.
+		   @return True if the data was queued, False if it was dropped."""
+		if self._maxQueueSize <= 0:
+			queue.put(data)
+
+		elif overflowPolicy == Conduit.OVERFLOW_BLOCK:
+			try:
+				queue.put(data, block=True, timeout=self._overflowTimeoutSeconds)
+			except Full:
+				raise Exception("%s: %s queue full." % (self.__class__.__name__, direction) )
+
+		else:
+			while True:
+				try:
+					queue.put_nowait(data)
+					break
+
+				except Full:
+					if overflowPolicy == Conduit.OVERFLOW_RAISE:
+						raise Exception("%s: %s queue full." % (self.__class__.__name__, direction) )
+
+					elif overflowPolicy == Conduit.OVERFLOW_DROP_NEWEST:
+						stats.dropped()
+						return False
+
+					elif overflowPolicy == Conduit.OVERFLOW_COALESCE and self._coalesce(queue, data):
+						stats.coalesced()
+						return True
+
+				# OVERFLOW_DROP_OLDEST or OVERFLOW_COALESCE with no queued data with the same key.
+				try:
+					queue.get_nowait()
+					stats.dropped()
+				except Empty:
+					pass
+
+		stats.put(queue.qsize())
+		return True
 	
 	def putA(self, data):
 		"""@brief put some data in the A -> B side queue.
     	   @param data The data object to be pushed into the queue."""
-		self._checkQueueSize()
+		if self._uio and self._uio.isEnabledFor(PRIORITY.DEBUG):
+			self._uio.debug("%s: A -> B queue size = %d", self._cName, self._aToBQueue.qsize())
 		
-		if self._uio:
-			qSize = self._aToBQueue.qsize()
-			self._uio.debug("%s: A -> B queue size = %d" % (self._cName, qSize) )
-		
-		self._aToBQueue.put(data)
+		if self._put(self._aToBQueue, self._aToBStats, self._aToBOverflowPolicy, data, "A -> B"):
+			self._notifySelectors()
     	
 	def putB(self, data):
 		"""@brief put some data in the B -> A side queue.
     	   @param data The data object to be pushed into the queue."""
-		self._checkQueueSize()
-		
-		if self._uio:
-			qSize = self._bToAQueue.qsize()
-			self._uio.debug("%s: B -> A queue size = %d" % (self._cName, qSize) )
+		if self._uio and self._uio.isEnabledFor(PRIORITY.DEBUG):
+			self._uio.debug("%s: B -> A queue size = %d", self._cName, self._bToAQueue.qsize())
 		
-		self._bToAQueue.put(data)
+		if self._put(self._bToAQueue, self._bToAStats, self._bToAOverflowPolicy, data, "B -> A"):
+			self._notifySelectors()
     	
-	def getA(self, block=True, timeoutSeconds=0.0):
-		"""@brief Get some data from the B -> A queue.
-		   @param block If true then the call will block
-		   @param timeoutSeconds The time in seconds before exiting (returning None) if no data can be read from the queue.
+	def _get(self, queue, stats, block, timeoutSeconds):
+		"""@brief Get some data from a queue.
+		   @param queue The queue to read from.
+		   @param stats The ConduitStats instance for the queue.
+		   @param block If True then the call will block. If None the readBlock constructor arg is used.
+		   @param timeoutSeconds The time in seconds to block for. If None the readBlockTimeoutSeconds constructor arg is used.
 		   @return The data from the queue or None of no data is available."""
+		if block is None:
+			block = self._readBlock
+
+		if not block:
+			return self._tryGet(queue, stats, None)
+
+		if timeoutSeconds is None:
+			timeoutSeconds = self._readBlockTimeoutSeconds
+
 		try:
-			return self._bToAQueue.get(block=self._readBlock, timeout=self._readBlockTimeoutSeconds)
+			data = queue.get(block=True, timeout=timeoutSeconds)
 		except Empty:
 			return None
+		stats.taken()
+		return data
+
+	def _tryGet(self, queue, stats, default):
+		"""@brief Get some data from a queue without blocking. Unlike Queue.get_nowait() no
+		          Empty exception is raised and caught when the queue is empty.
+		   @param queue The queue to read from.
+		   @param stats The ConduitStats instance for the queue.
+		   @param default The value returned if the queue is empty.
+		   @return The data from the queue or default if the queue is empty."""
+		if not queue.queue:
+			return default
+
+		with queue.mutex:
+			if not queue.queue:
+				return default
+			data = queue.queue.popleft()
+			queue.not_full.notify()
+		stats.taken()
+		return data
+
+	def getA(self, block=None, timeoutSeconds=None):
+		"""@brief Get some data from the B -> A queue.
+		   @param block If True then the call will block. If None (default) the readBlock constructor arg is used.
+		   @param timeoutSeconds The time in seconds before exiting (returning None) if no data can be read from the queue.
+		                         If None (default) the readBlockTimeoutSeconds constructor arg is used.
+		   @return The data from the queue or None of no data is available."""
+		return self._get(self._bToAQueue, self._bToAStats, block, timeoutSeconds)
 						
-	def getB(self, block=True, timeoutSeconds=0.0):
+	def getB(self, block=None, timeoutSeconds=None):
 		"""@brief Get some data from the A -> B queue.
-		   @param block If true then the call will block
+		   @param block If True then the call will block. If None (default) the readBlock constructor arg is used.
 		   @param timeoutSeconds The time in seconds before exiting (returning None) if no data can be read from the queue.
+		                         If None (default) the readBlockTimeoutSeconds constructor arg is used.
 		   @return The data from the queue or None of no data is available."""
-		try:
-			return self._aToBQueue.get(block=self._readBlock, timeout=self._readBlockTimeoutSeconds)
-		except Empty:
-			return None
+		return self._get(self._aToBQueue, self._aToBStats, block, timeoutSeconds)
+
+	def tryGetA(self, default=None):
+		"""@brief Get some data from the B -> A queue without blocking.
+		   @param default The value returned if no data is available.
+		   @return The data from the queue or default if no data is available."""
+		return self._tryGet(self._bToAQueue, self._bToAStats, default)
+
+	def tryGetB(self, default=None):
+		"""@brief Get some data from the A -> B queue without blocking.
+		   @param default The value returned if no data is available.
+		   @return The data from the queue or default if no data is available."""
+		return self._tryGet(self._aToBQueue, self._aToBStats, default)
 		
 	def aReadAvailable(self):
 		"""@return True if there is data available to be read from the A side of the queue."""
@@ -136,10 +354,114 @@ class QueueConduit(Conduit):
 	def bReadAvailable(self):
 		"""@return True if there is data available to be read from the B side of the queue."""
 		return not self._aToBQueue.empty()
-		   
-	
-	
 
+class ConduitStats(object):
+	"""@brief Holds the statistics for one direction of a conduit."""
 
-			
-    	
\ No newline at end of file
+	def __init__(self):
+		"""@brief Constructor"""
+		self._lock = Lock()
+		self.reset()
+
+	def reset(self):
+		"""@brief Reset all the statistics to 0."""
+		with self._lock:
+			self.putCount		= 0		# The number of data objects queued.
+			self.takenCount		= 0		# The number of data objects read from the queue.
+			self.droppedCount	= 0		# The number of data objects discarded by the overflow policy.
+			self.coalescedCount	= 0		# The number of data objects that replaced queued data with the same key.
+			self.highWaterMark	= 0		# The maximum number of data objects that have been in the queue.
+
+	def put(self, qSize):
+		"""@brief Record that a data object was queued.
+		   @param qSize The size of the queue after the data object was queued."""
+		with self._lock:
+			self.putCount += 1
+			if qSize > self.highWaterMark:
+				self.highWaterMark = qSize
+
+	def taken(self):
+		"""@brief Record that a data object was read from the queue."""
+		with self._lock:
+			self.takenCount += 1
+
+	def dropped(self):
+		"""@brief Record that a data object was discarded."""
+		with self._lock:
+			self.droppedCount += 1
+
+	def coalesced(self):
+		"""@brief Record that a data object replaced queued data."""
+		with self._lock:
+			self.coalescedCount += 1
+
+	def copy(self):
+		"""@return A new ConduitStats instance holding a copy of these statistics."""
+		statsCopy = ConduitStats()
+		with self._lock:
+			statsCopy.putCount			= self.putCount
+			statsCopy.takenCount		= self.takenCount
+			statsCopy.droppedCount		= self.droppedCount
+			statsCopy.coalescedCount	= self.coalescedCount
+			statsCopy.highWaterMark		= self.highWaterMark
+		return statsCopy
+
+	def __str__(self):
+		return "put=%d, taken=%d, dropped=%d, coalesced=%d, high water mark=%d" % (self.putCount, self.takenCount, self.droppedCount,
+																				   self.coalescedCount, self.highWaterMark)
+
+class ConduitSelector(object):
+	"""@brief Responsible for waiting on many Conduit ends at once. This is the Conduit
+	          equivalent of select() on a list of sockets. A thread that services several
+	          conduits can block in select() until any registered end has data (or a
+	          timeout occurs) rather than polling each conduit in a sleep loop."""
+
+	def __init__(self):
+		"""@brief Constructor"""
+		self._condition		= Condition()
+		self._endList		= []
+
+	def register(self, conduit, end):
+		"""@brief Register a conduit end to be waited on.
+		   @param conduit The Conduit instance.
+		   @param end The end of the conduit to wait for data on (Conduit.A_END or Conduit.B_END).
+		              Conduit.A_END is ready when getA() has data to return, Conduit.B_END when getB() has."""
+		if end not in (Conduit.A_END, Conduit.B_END):
+			raise Exception("%s is an invalid conduit end." % (str(end)) )
+
+		with self._condition:
+			if (conduit, end) not in self._endList:
+				self._endList.append( (conduit, end) )
+		conduit.addSelector(self)
+
+	def unregister(self, conduit, end=None):
+		"""@brief Unregister a conduit end previously registered.
+		   @param conduit The Conduit instance.
+		   @param end The end of the conduit (Conduit.A_END or Conduit.B_END). If None then both ends are unregistered."""
+		with self._condition:
+			self._endList = [(c, e) for c, e in self._endList if not (c is conduit and (end is None or e == end))]
+			stillRegistered = any(c is conduit for c, _ in self._endList)
+		if not stillRegistered:
+			conduit.removeSelector(self)
+
+	def notify(self):
+		"""@brief Called by a conduit when data has been put into it. Wakes any thread blocked in select()."""
+		with self._condition:
+			self._condition.notify_all()
+
+	def _getReadyList(self):
+		"""@return A list of (conduit, end) tuples for the registered ends that have data available."""
+		return [(conduit, end) for conduit, end in self._endList if conduit.readAvailable(end)]
+
+	def select(self, timeoutSeconds=None):
+		"""@brief Block until at least one registered conduit end has data available or the timeout expires.
+		   @param timeoutSeconds The maximum time in seconds to wait. None (default) = wait indefinitely, 0 = poll.
+		   @return A list of (conduit, end) tuples for the ends that have data available.
+		           An empty list is returned if the timeout expired before any data was available."""
+		with self._condition:
+			readyList = self._getReadyList()
+			if readyList or timeoutSeconds == 0:
+				return readyList
+
+			self._condition.wait_for(self._getReadyList, timeout=timeoutSeconds)
+			return self._getReadyList()
@@ -3,6 +3,8 @@
 import  MySQLdb as mysqldb
 from    datetime import datetime
 
+from    p3lib.uio import PRIORITY
+
 class DBConfig(object):
     """@brief responsible for holding the attributes if the database configuration."""
 
@@ -138,9 +140,9 @@ class DatabaseIF(object):
             self._dbConfig.uio.info(msg)
 
 
-    def _debug(self, msg):
-        if self._dbConfig.uio and self._dbConfig.uio.debug:
-            self._dbConfig.uio.debug(msg)
+    def _debug(self, msg, *args):
+        if self._dbConfig.uio and self._dbConfig.uio.isEnabledFor(PRIORITY.DEBUG):
+            self._dbConfig.uio.debug(msg, *args)
 
     def connect(self):
         """@brief connect to the database server."""
@@ -167,7 +169,7 @@ class DatabaseIF(object):
            @return True if the table exists, False if not."""
         cursor = self._dbCon.cursor()
         cmd="""SELECT COUNT(*) FROM information_schema.tables WHERE table_name = '{0}'""".format(tableName.replace('\'', '\'\''))
-        self._debug("EXECUTE SQL: {}".format(cmd))
+        self._debug("EXECUTE SQL: %s", cmd)
         #self.executeSQL(cmd)
         cursor.execute(cmd)
         tableExists = cursor.fetchone()[0] == 1
@@ -251,7 +253,7 @@ class DatabaseIF(object):
 
     def executeSQL(self, sqlCmd):
         """@brief execute an SQL cmd"""
-        self._debug("EXECUTE SQL: {}".format(sqlCmd))
+        self._debug("EXECUTE SQL: %s", sqlCmd)
         dictCursor = self._dbCon.cursor(mysqldb.cursors.DictCursor)
 
         dictCursor.execute(sqlCmd)
@@ -2,11 +2,8 @@
 
 import os
 import plotly
-import tarfile
-import tempfile
 import shutil
 
-from   pathlib import Path
 try:
     from   .ssh import SSH
     from   .helper import getHomePath
@@ -30,12 +27,6 @@ class NetPlotly(object):
     ASSETS_FOLDER           = "assets"
     PLOT_LIST_FILE          = "plot_list.txt"
 
-    @staticmethod
-    def GetTarBallFile():
-        """@brief Get the tarball file path
-           @return The abs file path"""
-        return os.path.join( tempfile.gettempdir(), "netplotly.tgz" )
-
     def __init__(self, localRoot=DEFAULT_LOCAL_ROOT, serverRoot=DEFAULT_LOCAL_ROOT, host=None, username=None, password=None, port=22, uio=None):
         """@brief Constructor
            @param localRoot The local folder to store the plots in.
@@ -141,11 +132,6 @@ class NetPlotly(object):
         plotly.offline.plot(fig, filename=fileToSave, auto_open = autoOpen)
         self.info("Saved {}".format(fileToSave))
 
-    def _createTarBall(self, opFile, srcFolder):
-        self.info("Creating {} from {}".format(opFile, srcFolder))
-        with tarfile.open(opFile, "w:gz") as tar:
-            tar.add(srcFolder, arcname=os.path.basename(srcFolder))
-
     def connect(self):
         """@brief connect to the server vis ssh"""
         if not self._host:
@@ -153,39 +139,30 @@ class NetPlotly(object):
 
         if not self._ssh:
             self.info("Connecting to {}:{} as {}".format(self._host, self._port, self._username))
-            self._ssh = SSH(self._host, username=self._username, password=self._password, port=self._port)
+            # Use a pooled connection so that repeated uploads reuse the same ssh connection.
+            self._ssh = SSH(self._host, username=self._username, password=self._password, port=self._port, usePool=True)
             self._ssh.connect(connectSFTPSession=True)
             self.info("Connected")
 
     def disconnect(self):
-        """@brief Close the connection to the server."""
+        """@brief Close the connection to the server. The ssh connection is returned to the
+                  SSHConnectionPool so that it can be reused by the next upload."""
         if self._ssh:
             self._ssh.close()
             self._ssh = None
             self.info("Closed server connection")
 
     def upload(self, purge=False):
-        """@brief Upload the plot to the server.
-           @param purge If True (default is False) then all html files are removed from the server before uploading
-                        from the local path. If True the caller must be careful to set serverRoot (in Constructor)
-                        as all files in this location are purged before files are uploaded."""
+        """@brief Upload the plots to the server folder (serverRoot). Only plots that are new or have changed are sent.
+           @param purge If True (default is False) then files and folders in serverRoot that are not in the
+                        local path are removed. If True the caller must be careful to set serverRoot (in Constructor)
+                        as all other files in this location are removed."""
         if self._host and self._username:
-            tarBallFile = NetPlotly.GetTarBallFile()
-            self._createTarBall(tarBallFile, self._localRoot)
             self.connect()
 
-            if purge:
-                #Remove all the files in the server folder
-                cmd = "rm -f {}/*".format(self._serverRoot)
-                self._ssh.runCmd(cmd)
-
-            self.info("Uploading {} to {}:{}".format(tarBallFile, self._host, self._port))
-            self._ssh.putFile(tarBallFile, tarBallFile)
-
-            self.info("Decompressing {} into {} on the server.".format(tarBallFile, self._serverRoot))
-            rPath = Path(self._serverRoot)
-            cmd = "tar zxvf {} -C {}".format(tarBallFile, rPath.parent)
-            self._ssh.runCmd(cmd)
+            self.info("Synchronising {} with {} on {}:{}".format(self._localRoot, self._serverRoot, self._host, self._port))
+            result = self._ssh.syncDir(self._localRoot, self._serverRoot, delete=purge)
+            self.info("Sent {} files ({} bytes), {} unchanged.".format(len(result["sent"]), result["bytes"], result["unchanged"]))
 
             self.disconnect()
 
@@ -15,6 +15,7 @@ from time import time, strftime, localtime
 from pathlib import Path
 
 from p3lib.helper import getProgramVersion
+from p3lib.uio import UIO
 
 from nicegui import ui
 
@@ -225,48 +226,11 @@ class TabbedNiceGui(object):
                         Each element in each row must be a string.
            @param rowSeparatorChar The character used for horizontal lines to separate table rows.
            @param colSeparatorChar The character used to separate table columns."""
-        columnWidths = []
-        # Check we have a table to display
-        if len(table) == 0:
-            raise Exception("No table rows to display")
-
-        # Check all rows have the same number of columns in the table
-        colCount = len(table[0])
-        for row in table:
-            if len(row) != colCount:
-                raise Exception(f"{str(row)} column count different from first row ({colCount})")
-
-        for row in table:
-            for col in row:
-                if not isinstance(col, str):
-                    raise Exception(f"Table column is not a string: {col} in {row}")
-
-        # Get the max width for each column
-        for col in range(0,colCount):
-            maxWidth=0
-            for row in table:
-                if len(row[col]) > maxWidth:
-                    maxWidth = len(row[col])
-            columnWidths.append(maxWidth)
-
-        tableWidth = 1
-        for columnWidth in columnWidths:
-            tableWidth += columnWidth + 3 # Space each side of the column + a column divider character
-
-        # Add the top line of the table
-        self.info(rowSeparatorChar*tableWidth)
-
-        # The starting row index
-        for rowIndex in range(0, len(table)):
-            rowText = colSeparatorChar
-            colIndex = 0
-            for col in table[rowIndex]:
-                colWidth = columnWidths[colIndex]
-                rowText = rowText + " " + f"{col:>{colWidth}s}" + " " + colSeparatorChar
-                colIndex += 1
-            self.info(rowText)
-            # Add the row separator line
-            self.info(rowSeparatorChar*tableWidth)
+        columnWidths = UIO.GetTableColumnWidths(table)
+        lines = UIO.GetTableLines(table, columnWidths, rowSeparatorChar=rowSeparatorChar, colSeparatorChar=colSeparatorChar)
+        # The table is sent to the GUI as a single message. It starts on the line after the
+        # message prefix so that all the table lines are aligned.
+        self.info("\n" + "\n".join(lines))
 
     def logAll(self, enabled):
         pass
@@ -2,23 +2,193 @@
 
 import  os
 import  socket
-from    paramiko import SSHClient, AutoAddPolicy, AuthenticationException, SFTPClient
+import  asyncio
+import  functools
+from    paramiko import SSHClient, AutoAddPolicy, AuthenticationException, SFTPClient, PKey
 import  logging
 import  threading
 import  socketserver
 import  select
+import  selectors
+import  atexit
+import  codecs
+import  stat
+import  contextlib
+import  json
+import  hashlib
+import  tempfile
+import  posixpath
+import  zlib
+import  hmac
 
 from    getpass import getuser, getpass
+from    time import time, perf_counter, sleep
+from    cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from    cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from    concurrent.futures import ThreadPoolExecutor, as_completed
+
+def _loadJSON(jsonFile):
+    """@return The dict loaded from a local JSON file or an empty dict if it cannot be read."""
+    try:
+        with open(jsonFile, 'r') as fd:
+            return json.load(fd)
+    except (IOError, ValueError):
+        return {}
+
+def _saveJSON(jsonFile, jsonDict):
+    """@brief Save a dict to a local JSON file that only the user can read or write. The dict is
+              written to a new temporary file (that cannot be a link planted by another user)
+              which then replaces the JSON file."""
+    fd, tmpJSONFile = tempfile.mkstemp(prefix=os.path.basename(jsonFile), suffix=".tmp", dir=os.path.dirname(jsonFile))
+    try:
+        with os.fdopen(fd, 'w') as jsonFd:
+            json.dump(jsonDict, jsonFd)
+        os.replace(tmpJSONFile, jsonFile)
+    except:
+        os.remove(tmpJSONFile)
+        raise
 
 class SSHError(Exception):
     pass
 
 # -------------------------------------------------------------------------------
 
+class SSHCmdStream(object):
+    """@brief Responsible for reading the output of a command executing in an ssh channel a line at a time.
+              Data is only read from the channel as the caller iterates so the ssh flow control window
+              holds up the command if the caller does not keep up, bounding the memory used."""
+
+    STDOUT                  = 1
+    STDERR                  = 2
+    READ_SIZE               = 32768
+    DEFAULT_MAX_LINE_LENGTH = 65536
+
+    def __init__(self, chan, cmd, throwError=True, timeout=None, encoding='utf-8', maxLineLength=DEFAULT_MAX_LINE_LENGTH):
+        """@brief Constructor
+           @param chan The channel in which the command is executing.
+           @param cmd The command that is executing.
+           @param throwError If True and the exit status of the command is not 0 then an SSHError is thrown
+                             once all the output has been read.
+           @param timeout The maximum time in seconds for the whole command or None if no timeout is required.
+           @param encoding The text encoding of the command output. Invalid bytes are replaced.
+           @param maxLineLength Lines longer than this are split."""
+        self._chan              = chan
+        self._cmd               = cmd
+        self._throwError        = throwError
+        self._deadline          = None if timeout is None else time() + timeout
+        self._maxLineLength     = maxLineLength
+        self._decoderDict       = {SSHCmdStream.STDOUT: codecs.getincrementaldecoder(encoding)(errors='replace'),
+                                   SSHCmdStream.STDERR: codecs.getincrementaldecoder(encoding)(errors='replace')}
+        self._partialLineDict   = {SSHCmdStream.STDOUT: "",
+                                   SSHCmdStream.STDERR: ""}
+        self.exitStatus         = None
+
+    def __iter__(self):
+        """@brief Read the output of the command.
+           @return A generator of (stream, line) tuples. Lines do not include the end of line characters."""
+        chan = self._chan
+        try:
+            while True:
+                if self._deadline is not None and time() > self._deadline:
+                    raise SSHError("The cmd '{}' did not complete before the timeout.".format(self._cmd))
+
+                readData = False
+                if chan.recv_ready():
+                    yield from self._getLines(SSHCmdStream.STDOUT, chan.recv(SSHCmdStream.READ_SIZE))
+                    readData = True
+                if chan.recv_stderr_ready():
+                    yield from self._getLines(SSHCmdStream.STDERR, chan.recv_stderr(SSHCmdStream.READ_SIZE))
+                    readData = True
+                if readData:
+                    continue
+
+                if chan.exit_status_ready() and (chan.eof_received or chan.closed):
+                    break
+
+                waitSeconds = ExtendedSSHClient.CMD_POLL_SECONDS
+                if self._deadline is not None:
+                    waitSeconds = max(0, min(waitSeconds, self._deadline - time()))
+                # Wakes as soon as stdout data arrives or the channel closes.
+                select.select([chan], [], [], waitSeconds)
+
+            for stream in (SSHCmdStream.STDOUT, SSHCmdStream.STDERR):
+                yield from self._getLines(stream, b'', final=True)
+            self.exitStatus = chan.recv_exit_status()
+
+        finally:
+            chan.close()
+
+        if self._throwError and self.exitStatus != 0:
+            raise SSHError("The cmd '%s' return the error code: %d" % (self._cmd, self.exitStatus))
+
+    def close(self):
+        """@brief Close the channel. This may be called to abandon the command before all its output has been read."""
+        self._chan.close()
+
+    def _getLines(self, stream, data, final=False):
+        """@brief Decode data received from the command and get the complete lines of text.
+           @param stream SSHCmdStream.STDOUT or SSHCmdStream.STDERR.
+           @param data The bytes received.
+           @param final If True the command has completed and any partial line is returned.
+           @return A list of (stream, line) tuples."""
+        text = self._partialLineDict[stream] + self._decoderDict[stream].decode(data, final)
+        lines = text.split("\n")
+        partialLine = lines.pop()
+        if final and partialLine:
+            lines.append(partialLine)
+            partialLine = ""
+        lineList = []
+        for line in lines:
+            while len(line) > self._maxLineLength:
+                lineList.append( (stream, line[:self._maxLineLength]) )
+                line = line[self._maxLineLength:]
+            lineList.append( (stream, line.rstrip("\r")) )
+        while len(partialLine) > self._maxLineLength:
+            lineList.append( (stream, partialLine[:self._maxLineLength]) )
+            partialLine = partialLine[self._maxLineLength:]
+        self._partialLineDict[stream] = partialLine
+        return lineList
+
 class ExtendedSSHClient(SSHClient):
     """@brief The ssh client class"""
 
     CMD_POLL_SECONDS = 0.1
+    READ_SIZE        = 65536
+    BATCH_SHELL      = "/bin/sh"
+
+    @staticmethod
+    def ReadChannel(chan, deadline, stdinBytes=None):
+        """@brief Read the output of a command until it exits.
+           @param chan The channel the command is executing in.
+           @param deadline The time at which the command is abandoned or None.
+           @param stdinBytes If not None these bytes are sent to the stdin of the command which is then closed.
+                             They are sent as the command reads them so that a command writing a lot of output
+                             before it has read all its input does not stall.
+           @return A tuple containing the exit status, stdout bytes and stderr bytes."""
+        stdoutBytes = bytearray()
+        stderrBytes = bytearray()
+        stdinOffset = 0
+        while True:
+            if stdinBytes is not None and stdinOffset < len(stdinBytes):
+                while stdinOffset < len(stdinBytes) and chan.send_ready():
+                    stdinOffset += chan.send(stdinBytes[stdinOffset:stdinOffset+ExtendedSSHClient.READ_SIZE])
+                if stdinOffset >= len(stdinBytes):
+                    chan.shutdown_write()
+            while chan.recv_ready():
+                stdoutBytes += chan.recv(ExtendedSSHClient.READ_SIZE)
+            while chan.recv_stderr_ready():
+                stderrBytes += chan.recv_stderr(ExtendedSSHClient.READ_SIZE)
+            if chan.exit_status_ready() and not chan.recv_ready() and not chan.recv_stderr_ready():
+                break
+            waitSeconds = ExtendedSSHClient.CMD_POLL_SECONDS
+            if deadline is not None:
+                remainingSeconds = deadline - time()
+                if remainingSeconds <= 0:
+                    raise SSHError("The command did not complete before the timeout.")
+                waitSeconds = min(waitSeconds, remainingSeconds)
+            # Wakes as soon as stdout data arrives or the channel closes.
+            select.select([chan], [], [], waitSeconds)
+        return chan.recv_exit_status(), bytes(stdoutBytes), bytes(stderrBytes)
 
     @staticmethod
     def GetLines(bytes):
@@ -114,7 +284,699 @@ class ExtendedSSHClient(SSHClient):
                 raise
         return None
 
+    def runCmdStream(self, cmd, throwError=True, timeout=None, encoding='utf-8', maxLineLength=SSHCmdStream.DEFAULT_MAX_LINE_LENGTH):
+        """@brief Run a command over an ssh session and read the lines of text it outputs as they arrive
+                  rather than holding all the output in memory until the command completes.
+           @param cmd The command to execute
+           @param throwError If True and the exit status of the command is not 0 then an SSHError is thrown
+                             once all the output has been read.
+           @param timeout The maximum time in seconds for the whole command or None (default) if no timeout is required.
+           @param encoding The text encoding of the command output.
+           @param maxLineLength Lines longer than this are split so that memory use is bounded.
+           @return An SSHCmdStream instance. Iterate over this to get (stream, line) tuples where stream is
+                   SSHCmdStream.STDOUT or SSHCmdStream.STDERR. The exitStatus attribute holds the exit status
+                   of the command once all the output has been read."""
+        return SSHCmdStream(self.startCmd(cmd), cmd, throwError=throwError, timeout=timeout, encoding=encoding, maxLineLength=maxLineLength)
+
+    def runBatch(self, cmdList, throwError=True, timeout=None):
+        """@brief Run a list of commands, one after the other, in a single remote shell session.
+                  This saves opening a channel and waiting for it to complete for each command.
+                  As the commands run in the same shell, changes they make to the shell (E.G cd or
+                  setting variables) are seen by the commands that follow. The stdin of each command
+                  is /dev/null.
+           @param cmdList A list of the commands to execute.
+           @param throwError If True and a command fails (non zero exit status) the commands after it are
+                             not run and an SSHError is thrown.
+           @param timeout The maximum time in seconds for all the commands or None (default) if no timeout is required.
+           @return A list with an element for each command run. Each element is a list containing
+                        0 - the return code/exit status of the command
+                        1 - Lines of text from stdout
+                        2 - lines of text from stderr"""
+        # The output of each command is followed by a line holding a sentinel that cannot appear
+        # in the output so that the output of each command can be separated.
+        sentinel = "P3LIB_BATCH_{}".format(os.urandom(16).hex())
+        scriptLines = []
+        for cmd in cmdList:
+            scriptLines.append("{{ {}\n}} </dev/null".format(cmd))
+            scriptLines.append("__p3lib_rc=$?")
+            scriptLines.append("printf '\\n%s %d\\n' {} $__p3lib_rc".format(sentinel))
+            scriptLines.append("printf '\\n%s\\n' {} >&2".format(sentinel))
+            if throwError:
+                # Don't run the commands that follow a failed command as separate runCmd() calls would not.
+                scriptLines.append("[ $__p3lib_rc -eq 0 ] || exit $__p3lib_rc")
+        script = "\n".join(scriptLines) + "\nexit 0\n"
+
+        deadline = None if timeout is None else time() + timeout
+        chan = self._transport.open_session(timeout=timeout)
+        try:
+            chan.exec_command(ExtendedSSHClient.BATCH_SHELL)
+            exitStatus, stdoutBytes, stderrBytes = ExtendedSSHClient.ReadChannel(chan, deadline, stdinBytes=script.encode('utf-8'))
+        finally:
+            chan.close()
+
+        stdoutList = stdoutBytes.split(b"\n" + sentinel.encode('utf-8') + b" ")
+        stderrList = stderrBytes.split(b"\n" + sentinel.encode('utf-8') + b"\n")
+        resultList = []
+        for index, cmd in enumerate(cmdList):
+            if index + 1 >= len(stdoutList):
+                raise SSHError("The shell exited before the cmd '{}' completed.".format(cmd))
+            cmdStdout = stdoutList[index]
+            cmdStderr = stderrList[index] if index < len(stderrList) else b""
+            # The text after each sentinel is the exit status of the previous command and the end of line.
+            if index > 0:
+                cmdStdout = cmdStdout.split(b"\n", 1)[1] if b"\n" in cmdStdout else b""
+            cmdExitStatus = int(stdoutList[index + 1].split(b"\n", 1)[0])
+            if throwError and cmdExitStatus != 0:
+                errorText = cmdStderr.decode('utf-8')
+                if len(errorText) > 0:
+                    raise SSHError(errorText)
+                raise SSHError("The cmd '%s' return the error code: %d" % (cmd, cmdExitStatus))
+            resultList.append([cmdExitStatus, ExtendedSSHClient.GetLines(cmdStdout), ExtendedSSHClient.GetLines(cmdStderr)])
+        return resultList
 
+class SFTPFileTransfer(object):
+    """@brief Holds the state of a file being transferred by SFTPTransfer. The file is split into
+              one or more byte ranges that may be transferred in parallel over separate SFTP channels."""
+
+    def __init__(self, srcPath, destPath, download, size, mtime, stateFile):
+        """@brief Constructor
+           @param srcPath The file being transferred.
+           @param destPath The file that is written once the transfer is complete.
+           @param download True if the file is being read from the ssh server, False if it is being written to it.
+           @param size The size of the file in bytes.
+           @param mtime The modification time of the source file.
+           @param stateFile The local file that the progress of each range is saved to so that
+                            an interrupted transfer can be resumed or None if not required."""
+        self.srcPath        = srcPath
+        self.destPath       = destPath
+        self.tmpPath        = destPath + SFTPTransfer.PART_SUFFIX
+        self.download       = download
+        self.size           = size
+        self.mtime          = mtime
+        self.stateFile      = stateFile
+        self.rangeList      = []    # Each element is a list [start offset, end offset, transferred up to offset]
+        self.progressList   = []    # The offset each range has been sent or received up to (including data not yet safely stored).
+        self.lock           = threading.Lock()
+        self._pendingCount  = 0
+
+    def setRanges(self, rangeCount, blockSize):
+        """@brief Split the file into ranges.
+           @param rangeCount The number of ranges.
+           @param blockSize Each range (apart from the last) is a multiple of this size."""
+        rangeSize = max(blockSize, (self.size // rangeCount // blockSize) * blockSize)
+        self.rangeList = []
+        start = 0
+        while start < self.size or not self.rangeList:
+            end = self.size if len(self.rangeList) == rangeCount-1 else min(self.size, start + rangeSize)
+            self.rangeList.append([start, end, start])
+            start = end
+
+    def loadState(self):
+        """@brief Load the progress of a previous transfer of the same source file.
+           @return True if the state was loaded."""
+        try:
+            with open(self.stateFile, 'r') as fd:
+                state = json.load(fd)
+            if state["src"] == self.srcPath and state["size"] == self.size and state["mtime"] == self.mtime:
+                self.rangeList = state["ranges"]
+                return True
+        except (IOError, ValueError, KeyError):
+            pass
+        return False
+
+    def saveState(self):
+        """@brief Save the progress of each range."""
+        with self.lock:
+            state = {"src":     self.srcPath,
+                     "size":    self.size,
+                     "mtime":   self.mtime,
+                     "ranges":  self.rangeList}
+            _saveJSON(self.stateFile, state)
+
+    def removeState(self):
+        """@brief Remove the state file once the transfer is complete."""
+        if self.stateFile and os.path.isfile(self.stateFile):
+            os.remove(self.stateFile)
+
+    def getPendingRangeIndexList(self):
+        """@return The index of each range that has not been transferred."""
+        pendingList = [index for index, (start, end, offset) in enumerate(self.rangeList) if offset < end]
+        self._pendingCount = len(pendingList)
+        self.progressList = [offset for start, end, offset in self.rangeList]
+        return pendingList
+
+    def updateProgress(self, rangeIndex, offset):
+        """@brief Record the progress of a range.
+           @param rangeIndex The index of the range.
+           @param offset The offset the range has been transferred up to.
+           @return The number of bytes of the file transferred."""
+        with self.lock:
+            self.progressList[rangeIndex] = offset
+            return sum([progressOffset - fileRange[0] for progressOffset, fileRange in zip(self.progressList, self.rangeList)])
+
+    def rangeComplete(self):
+        """@brief Called when a range has been transferred.
+           @return True if all the ranges have been transferred."""
+        with self.lock:
+            self._pendingCount -= 1
+            return self._pendingCount <= 0
+
+class SFTPTransfer(object):
+    """@brief Responsible for transferring files over SFTP faster than SFTPClient.get()/put() by
+              - Keeping a number of read or write requests in flight on each channel.
+              - Splitting large files into byte ranges transferred over several SFTP channels in parallel.
+              - Transferring many files concurrently over several SFTP channels.
+              - Resuming interrupted transfers.
+              Files are written to a .part file which is renamed once the transfer completes."""
+
+    DEFAULT_CHANNEL_COUNT       = 4
+    DEFAULT_BLOCK_SIZE          = 32768             # The largest read that all SFTP servers must support.
+    DEFAULT_PIPELINE_DEPTH      = 64                # Requests in flight on each channel.
+    DEFAULT_RANGE_THRESHOLD     = 64*1024*1024      # Files this size or larger are split into ranges.
+    STATE_SAVE_BYTES            = 8*1024*1024       # How often the progress of a ranged transfer is saved.
+    READ_BATCH_BLOCKS           = 256               # Limits the memory holding prefetched data on each channel.
+    PART_SUFFIX                 = ".part"
+    STATE_SUFFIX                = ".part.json"
+    # The folder holding the state files of uploads. This is only accessible by the user as
+    # the state decides which parts of a file are sent when a transfer is resumed.
+    UPLOAD_STATE_DIR            = os.path.join(os.path.expanduser("~"), ".p3lib_sftp_state")
+
+    def __init__(self, ssh, channelCount=DEFAULT_CHANNEL_COUNT, blockSize=DEFAULT_BLOCK_SIZE, pipelineDepth=DEFAULT_PIPELINE_DEPTH,
+                 rangeThreshold=DEFAULT_RANGE_THRESHOLD, progressCallback=None, preserveTimes=False):
+        """@brief Constructor
+           @param ssh A connected SSH instance.
+           @param channelCount The maximum number of SFTP channels used at the same time.
+           @param blockSize The size of each read or write request.
+           @param pipelineDepth The number of read requests in flight on each channel.
+           @param rangeThreshold Files this size or larger are split into channelCount ranges
+                                 that are transferred in parallel.
+           @param progressCallback If not None this method is called as data is transferred with the
+                                   arguments: source path, bytes transferred, file size.
+                                   This is called from the transfer threads.
+           @param preserveTimes If True the modification time of each file sent or received is set to that of the source file."""
+        self._ssh               = ssh
+        self._channelCount      = max(1, channelCount)
+        self._blockSize         = blockSize
+        self._pipelineDepth     = max(1, pipelineDepth)
+        self._rangeThreshold    = rangeThreshold
+        self._progressCallback  = progressCallback
+        self._preserveTimes     = preserveTimes
+        self._sftpLock          = threading.Lock()
+        self._sftpList          = []
+        self._freeSFTPList      = []
+        self._sftpAvailable     = threading.Condition(self._sftpLock)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.close()
+        return False
+
+    def close(self):
+        """@brief Close the SFTP channels."""
+        with self._sftpLock:
+            sftpList = self._sftpList
+            self._sftpList = []
+            self._freeSFTPList = []
+        for sftp in sftpList:
+            sftp.close()
+
+    def get(self, remoteFilePath, localFilePath, resume=False):
+        """@brief Get a file from the ssh server.
+           @param remoteFilePath The remote file on the ssh server.
+           @param localFilePath The path of the file after it's been received.
+           @param resume If True and a previous transfer of the file was interrupted, the transfer continues from where it stopped."""
+        self.getFiles([(remoteFilePath, localFilePath)], resume=resume)
+
+    def put(self, localFilePath, remoteFilePath, resume=False):
+        """@brief Put a file on the ssh server.
+           @param localFilePath The local file to send.
+           @param remoteFilePath The remote file on the ssh server.
+           @param resume If True and a previous transfer of the file was interrupted, the transfer continues from where it stopped."""
+        self.putFiles([(localFilePath, remoteFilePath)], resume=resume)
+
+    def getFiles(self, fileList, resume=False):
+        """@brief Get files from the ssh server concurrently.
+           @param fileList A list of (remote file, local file) tuples.
+           @param resume If True interrupted transfers are resumed."""
+        self._transferFiles(fileList, True, resume)
+
+    def putFiles(self, fileList, resume=False):
+        """@brief Put files on the ssh server concurrently.
+           @param fileList A list of (local file, remote file) tuples.
+           @param resume If True interrupted transfers are resumed."""
+        self._transferFiles(fileList, False, resume)
+
+    def _transferFiles(self, fileList, download, resume):
+        """@brief Transfer files. Small files are transferred by the thread that finds their size.
+                  Large files are split into ranges that are then transferred in parallel.
+           @param fileList A list of (source file, destination file) tuples.
+           @param download True to get files from the ssh server, False to put files on it.
+           @param resume If True interrupted transfers are resumed."""
+        if not fileList:
+            return
+        executor = ThreadPoolExecutor(max_workers=min(self._channelCount, max(len(fileList), self._channelCount)))
+        try:
+            startFutureList = [executor.submit(self._startFile, srcPath, destPath, download, resume) for srcPath, destPath in fileList]
+            rangeFutureList = []
+            for future in as_completed(startFutureList):
+                fileTransfer = future.result()
+                if fileTransfer:
+                    for rangeIndex in fileTransfer.getPendingRangeIndexList():
+                        rangeFutureList.append(executor.submit(self._transferRange, fileTransfer, rangeIndex))
+            for future in as_completed(rangeFutureList):
+                future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _startFile(self, srcPath, destPath, download, resume):
+        """@brief Start transferring a file.
+           @param srcPath The file to transfer.
+           @param destPath The destination file.
+           @param download True if getting the file from the ssh server.
+           @param resume If True an interrupted transfer is resumed.
+           @return None if the file has been transferred or an SFTPFileTransfer instance whose
+                   ranges must be transferred."""
+        sftp = self._getSFTP()
+        try:
+            if download:
+                srcStat = sftp.stat(srcPath)
+            else:
+                srcStat = os.stat(srcPath)
+            size = srcStat.st_size
+            mtime = int(srcStat.st_mtime)
+            ranged = self._channelCount > 1 and size >= self._rangeThreshold
+            stateFile = None
+            # Files smaller than STATE_SAVE_BYTES are quicker to send again than to resume.
+            if ranged or size >= SFTPTransfer.STATE_SAVE_BYTES:
+                stateFile = self._getStateFile(destPath, download)
+            fileTransfer = SFTPFileTransfer(srcPath, destPath, download, size, mtime, stateFile)
+
+            if ranged:
+                if not (resume and fileTransfer.loadState() and self._tmpFileExists(sftp, fileTransfer)):
+                    fileTransfer.setRanges(self._channelCount, self._blockSize)
+                    self._createTmpFile(sftp, fileTransfer, size)
+                    fileTransfer.saveState()
+                elif not fileTransfer.getPendingRangeIndexList():
+                    # All the ranges were transferred but the .part file was not renamed.
+                    self._completeFile(sftp, fileTransfer)
+                    return None
+                return fileTransfer
+
+            # A single range that is transferred in order so the size of the .part file shows how much has been transferred.
+            # The state file records the size and modification time of the source file so that the .part file is
+            # only resumed if the source file has not changed.
+            partSize = None
+            if resume and stateFile and fileTransfer.loadState():
+                partSize = self._getTmpFileSize(sftp, fileTransfer)
+            fileTransfer.setRanges(1, self._blockSize)
+            if partSize is not None and partSize <= size:
+                fileTransfer.rangeList[0][2] = partSize
+            else:
+                self._createTmpFile(sftp, fileTransfer, 0)
+                if stateFile:
+                    fileTransfer.saveState()
+            fileTransfer.getPendingRangeIndexList()
+            self._transferRangeOnChannel(sftp, fileTransfer, 0)
+            self._completeFile(sftp, fileTransfer)
+            return None
+
+        except:
+            self._releaseSFTP(sftp, failed=True)
+            sftp = None
+            raise
+
+        finally:
+            if sftp:
+                self._releaseSFTP(sftp)
+
+    def _transferRange(self, fileTransfer, rangeIndex):
+        """@brief Transfer a range of a file on an SFTP channel. Called from a worker thread.
+           @param fileTransfer The SFTPFileTransfer instance.
+           @param rangeIndex The index of the range to transfer."""
+        sftp = self._getSFTP()
+        try:
+            try:
+                self._transferRangeOnChannel(sftp, fileTransfer, rangeIndex)
+            finally:
+                fileTransfer.saveState()
+            if fileTransfer.rangeComplete():
+                self._completeFile(sftp, fileTransfer)
+        except:
+            self._releaseSFTP(sftp, failed=True)
+            raise
+        self._releaseSFTP(sftp)
+
+    def _transferRangeOnChannel(self, sftp, fileTransfer, rangeIndex):
+        """@brief Transfer a range of a file.
+           @param sftp The SFTP client to use.
+           @param fileTransfer The SFTPFileTransfer instance.
+           @param rangeIndex The index of the range to transfer."""
+        fileRange = fileTransfer.rangeList[rangeIndex]
+        end = fileRange[1]
+        offset = fileRange[2]
+        savedOffset = offset
+        if fileTransfer.download:
+            with sftp.open(fileTransfer.srcPath, 'rb') as remoteFd, open(fileTransfer.tmpPath, 'r+b') as localFd:
+                localFd.seek(offset)
+                while offset < end:
+                    chunkList = []
+                    chunkOffset = offset
+                    while chunkOffset < end and len(chunkList) < SFTPTransfer.READ_BATCH_BLOCKS:
+                        chunkSize = min(self._blockSize, end - chunkOffset)
+                        chunkList.append( (chunkOffset, chunkSize) )
+                        chunkOffset += chunkSize
+                    for data in remoteFd.readv(chunkList, max_concurrent_prefetch_requests=self._pipelineDepth):
+                        if not data:
+                            raise SSHError("{} is shorter than expected.".format(fileTransfer.srcPath))
+                        localFd.write(data)
+                        offset += len(data)
+                        self._updateProgress(fileTransfer, rangeIndex, offset)
+                    if offset - savedOffset >= SFTPTransfer.STATE_SAVE_BYTES and fileTransfer.stateFile:
+                        localFd.flush()
+                        fileRange[2] = offset
+                        fileTransfer.saveState()
+                        savedOffset = offset
+        else:
+            with open(fileTransfer.srcPath, 'rb') as localFd, sftp.open(fileTransfer.tmpPath, 'r+b') as remoteFd:
+                remoteFd.set_pipelined(True)
+                localFd.seek(offset)
+                remoteFd.seek(offset)
+                while offset < end:
+                    data = localFd.read(min(self._blockSize, end - offset))
+                    if not data:
+                        raise SSHError("{} is shorter than expected.".format(fileTransfer.srcPath))
+                    saveState = offset + len(data) - savedOffset >= SFTPTransfer.STATE_SAVE_BYTES and fileTransfer.stateFile
+                    if saveState:
+                        # A write that is not pipelined waits until the server has acknowledged it and
+                        # every write before it, so the saved offset only covers data the server has stored.
+                        remoteFd.flush()
+                        remoteFd.set_pipelined(False)
+                    remoteFd.write(data)
+                    offset += len(data)
+                    self._updateProgress(fileTransfer, rangeIndex, offset)
+                    if saveState:
+                        remoteFd.set_pipelined(True)
+                        fileRange[2] = offset
+                        fileTransfer.saveState()
+                        savedOffset = offset
+        fileRange[2] = offset
+
+    def _updateProgress(self, fileTransfer, rangeIndex, offset):
+        """@brief Call the progress callback.
+           @param fileTransfer The SFTPFileTransfer instance.
+           @param rangeIndex The index of the range being transferred.
+           @param offset The offset in the file up to which the range has been transferred."""
+        if self._progressCallback:
+            self._progressCallback(fileTransfer.srcPath, fileTransfer.updateProgress(rangeIndex, offset), fileTransfer.size)
+
+    def _completeFile(self, sftp, fileTransfer):
+        """@brief Rename the .part file to the destination file once all of it has been transferred.
+           @param sftp The SFTP client to use.
+           @param fileTransfer The SFTPFileTransfer instance."""
+        partSize = self._getTmpFileSize(sftp, fileTransfer)
+        if partSize != fileTransfer.size:
+            raise SSHError("{} is {} bytes but {} bytes were expected.".format(fileTransfer.tmpPath, partSize, fileTransfer.size))
+        if fileTransfer.download:
+            if self._preserveTimes:
+                os.utime(fileTransfer.tmpPath, (fileTransfer.mtime, fileTransfer.mtime))
+            os.replace(fileTransfer.tmpPath, fileTransfer.destPath)
+        else:
+            if self._preserveTimes:
+                sftp.utime(fileTransfer.tmpPath, (fileTransfer.mtime, fileTransfer.mtime))
+            SSH._SFTPReplace(sftp, fileTransfer.tmpPath, fileTransfer.destPath)
+        fileTransfer.removeState()
+
+    def _getStateFile(self, destPath, download):
+        """@brief Get the local file used to save the progress of a ranged transfer.
+           @param destPath The destination file.
+           @param download True if getting the file from the ssh server.
+           @return The state file."""
+        if download:
+            return destPath + SFTPTransfer.STATE_SUFFIX
+        os.makedirs(SFTPTransfer.UPLOAD_STATE_DIR, mode=0o700, exist_ok=True)
+        transferID = "{}:{}:{}:{}".format(self._ssh.getUsername(), self._ssh.getHost(), self._ssh.getPort(), destPath)
+        return os.path.join(SFTPTransfer.UPLOAD_STATE_DIR, "{}{}".format(hashlib.sha1(transferID.encode('utf-8')).hexdigest(), SFTPTransfer.STATE_SUFFIX))
+
+    def _tmpFileExists(self, sftp, fileTransfer):
+        """@return True if the .part file exists."""
+        return self._getTmpFileSize(sftp, fileTransfer) is not None
+
+    def _getTmpFileSize(self, sftp, fileTransfer):
+        """@return The size of the .part file or None if it does not exist."""
+        try:
+            if fileTransfer.download:
+                return os.path.getsize(fileTransfer.tmpPath)
+            return sftp.stat(fileTransfer.tmpPath).st_size
+        except (IOError, OSError):
+            return None
+
+    def _createTmpFile(self, sftp, fileTransfer, size):
+        """@brief Create an empty .part file.
+           @param sftp The SFTP client to use.
+           @param fileTransfer The SFTPFileTransfer instance.
+           @param size The size of the file to create. The ranges are written into this."""
+        if fileTransfer.download:
+            with open(fileTransfer.tmpPath, 'wb') as fd:
+                fd.truncate(size)
+        else:
+            with sftp.open(fileTransfer.tmpPath, 'wb') as fd:
+                if size > 0:
+                    fd.truncate(size)
+
+    def _getSFTP(self):
+        """@brief Get an SFTP client that is not in use, opening a new SFTP channel if fewer
+                  than channelCount are open.
+           @return An SFTPClient instance."""
+        with self._sftpAvailable:
+            while not self._freeSFTPList and len(self._sftpList) >= self._channelCount:
+                self._sftpAvailable.wait()
+            if self._freeSFTPList:
+                return self._freeSFTPList.pop()
+            # Reserve a place for the new channel while it is opened outside the lock.
+            self._sftpList.append(None)
+        try:
+            sftp = SFTPClient.from_transport(self._ssh.getTransport())
+        except:
+            with self._sftpAvailable:
+                self._sftpList.remove(None)
+                self._sftpAvailable.notify()
+            raise
+        with self._sftpAvailable:
+            self._sftpList[self._sftpList.index(None)] = sftp
+        return sftp
+
+    def _releaseSFTP(self, sftp, failed=False):
+        """@brief Return an SFTP client so that it can be used by another transfer.
+           @param sftp The SFTPClient instance.
+           @param failed If True an error occurred using the SFTP client so it is closed."""
+        with self._sftpAvailable:
+            if failed:
+                if sftp in self._sftpList:
+                    self._sftpList.remove(sftp)
+            else:
+                self._freeSFTPList.append(sftp)
+            self._sftpAvailable.notify()
+        if failed:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+
+class SFTPDirSync(object):
+    """@brief Responsible for making a folder on an ssh server the same as a local folder by only
+              transferring files that are new or have changed. A manifest of the size, modification
+              time and SHA256 hash of each file sent is saved in the remote folder. A file is sent if
+              its size or modification time differs from the remote file unless its hash shows the
+              contents are unchanged. The hashes of local files are cached so that a file is only
+              hashed again when its size or modification time changes."""
+
+    MANIFEST_FILE   = ".p3lib_sync_manifest.json"
+    HASH_READ_SIZE  = 1024*1024
+    # The folder holding the cached hashes of the files in each local folder synchronised.
+    # This is only accessible by the user as the cache decides which files are sent.
+    HASH_CACHE_DIR  = os.path.join(os.path.expanduser("~"), ".p3lib_sync_cache")
+
+    def __init__(self, ssh, channelCount=SFTPTransfer.DEFAULT_CHANNEL_COUNT, progressCallback=None):
+        """@brief Constructor
+           @param ssh A connected SSH instance.
+           @param channelCount The number of files transferred in parallel.
+           @param progressCallback If not None called with the arguments: source path, bytes transferred, file size."""
+        self._ssh               = ssh
+        self._channelCount      = channelCount
+        self._progressCallback  = progressCallback
+
+    def sync(self, localDir, remoteDir, delete=False):
+        """@brief Make the remote folder the same as the local folder.
+           @param localDir The local folder.
+           @param remoteDir The folder on the ssh server. This is created if it does not exist.
+           @param delete If True files and folders in the remote folder that are not in the local folder are removed.
+           @return A dict containing
+                   sent        A list of the files sent (relative to the folder).
+                   touched     A list of the files whose contents were unchanged but whose modification time was updated.
+                   deleted     A list of the remote files and folders removed.
+                   unchanged   The number of files that did not need to be sent.
+                   bytes       The number of bytes sent."""
+        remoteDir = SSH._GetSFTPPath(remoteDir).rstrip("/") or "/"
+        localFileDict, localDirSet = SFTPDirSync._GetLocalFiles(localDir)
+        hashCacheFile = SFTPDirSync._GetHashCacheFile(localDir)
+        hashCache = _loadJSON(hashCacheFile)
+        result = {"sent": [], "touched": [], "deleted": [], "unchanged": 0, "bytes": 0}
+
+        with self._ssh._sftpSession() as sftp:
+            if sftp is None:
+                raise SSHError("The ssh server does not support SFTP.")
+            remoteFileDict, remoteDirSet = self._getRemoteFiles(sftp, remoteDir)
+            manifest = self._loadManifest(sftp, remoteDir)
+            newManifest = {}
+            sendList = []
+            for relPath, (size, mtime) in localFileDict.items():
+                remoteAttrs = remoteFileDict.get(relPath)
+                manifestEntry = manifest.get(relPath, {})
+                if remoteAttrs == (size, mtime):
+                    result["unchanged"] += 1
+                    newManifest[relPath] = {"size": size, "mtime": mtime, "sha256": manifestEntry.get("sha256")}
+                    continue
+
+                fileHash = SFTPDirSync._GetHash(localDir, relPath, size, mtime, hashCache)
+                newManifest[relPath] = {"size": size, "mtime": mtime, "sha256": fileHash}
+                if remoteAttrs and remoteAttrs[0] == size and manifestEntry.get("sha256") == fileHash and \
+                   manifestEntry.get("mtime") == remoteAttrs[1]:
+                    # The remote file is the one sent previously and the contents are unchanged.
+                    result["touched"].append(relPath)
+                else:
+                    sendList.append(relPath)
+
+            # Create the remote folders needed, parents first.
+            for relDir in sorted(localDirSet - remoteDirSet, key=lambda relDir: relDir.count("/")):
+                sftp.mkdir(posixpath.join(remoteDir, relDir))
+
+            sendList.sort()
+            if sendList:
+                fileList = [(os.path.join(localDir, *relPath.split("/")), posixpath.join(remoteDir, relPath)) for relPath in sendList]
+                with SFTPTransfer(self._ssh, channelCount=self._channelCount, progressCallback=self._progressCallback, preserveTimes=True) as sftpTransfer:
+                    sftpTransfer.putFiles(fileList)
+                result["sent"] = sendList
+                result["bytes"] = sum([localFileDict[relPath][0] for relPath in sendList])
+
+            for relPath in result["touched"]:
+                mtime = localFileDict[relPath][1]
+                sftp.utime(posixpath.join(remoteDir, relPath), (mtime, mtime))
+
+            if delete:
+                for relPath in sorted(set(remoteFileDict) - set(localFileDict)):
+                    sftp.remove(posixpath.join(remoteDir, relPath))
+                    result["deleted"].append(relPath)
+                # Remove folders, children first.
+                for relDir in sorted(remoteDirSet - localDirSet, key=lambda relDir: relDir.count("/"), reverse=True):
+                    sftp.rmdir(posixpath.join(remoteDir, relDir))
+                    result["deleted"].append(relDir)
+            else:
+                # Keep the manifest entries of remote files that were not removed.
+                for relPath in set(remoteFileDict) - set(localFileDict):
+                    if relPath in manifest:
+                        newManifest[relPath] = manifest[relPath]
+
+            self._saveManifest(sftp, remoteDir, newManifest)
+
+        _saveJSON(hashCacheFile, hashCache)
+        return result
+
+    @staticmethod
+    def _GetLocalFiles(localDir):
+        """@brief Get the files and folders in a local folder.
+           @param localDir The local folder.
+           @return A tuple containing
+                   0 = A dict of relative file path (/ separated): (size, modification time)
+                   1 = A set of the relative folder paths."""
+        if not os.path.isdir(localDir):
+            raise SSHError("{} folder not found.".format(localDir))
+        fileDict = {}
+        dirSet = set()
+        for root, dirNames, fileNames in os.walk(localDir):
+            relRoot = os.path.relpath(root, localDir).replace(os.sep, "/")
+            relRoot = "" if relRoot == "." else relRoot
+            for dirName in dirNames:
+                dirSet.add(posixpath.join(relRoot, dirName))
+            for fileName in fileNames:
+                fileStat = os.stat(os.path.join(root, fileName))
+                fileDict[posixpath.join(relRoot, fileName)] = (fileStat.st_size, int(fileStat.st_mtime))
+        return fileDict, dirSet
+
+    def _getRemoteFiles(self, sftp, remoteDir):
+        """@brief Get the files and folders in a remote folder, creating the folder if it does not exist.
+           @param sftp An SFTP client.
+           @param remoteDir The remote folder.
+           @return A tuple containing
+                   0 = A dict of relative file path: (size, modification time). The manifest file is not included.
+                   1 = A set of the relative folder paths."""
+        fileDict = {}
+        dirSet = set()
+        if not SSH._SFTPIsDir(sftp, remoteDir):
+            # Create the folder and any missing parent folders.
+            parentDir = ""
+            for dirName in remoteDir.split("/"):
+                parentDir = posixpath.join(parentDir, dirName) if parentDir else (dirName or "/")
+                if not SSH._SFTPIsDir(sftp, parentDir):
+                    sftp.mkdir(parentDir)
+            return fileDict, dirSet
+
+        relDirList = [""]
+        while relDirList:
+            relDir = relDirList.pop()
+            for attr in sftp.listdir_attr(posixpath.join(remoteDir, relDir)):
+                relPath = posixpath.join(relDir, attr.filename)
+                if stat.S_ISDIR(attr.st_mode):
+                    dirSet.add(relPath)
+                    relDirList.append(relPath)
+                elif relPath != SFTPDirSync.MANIFEST_FILE:
+                    fileDict[relPath] = (attr.st_size, attr.st_mtime)
+        return fileDict, dirSet
+
+    def _loadManifest(self, sftp, remoteDir):
+        """@brief Load the manifest saved in the remote folder by the previous sync.
+           @return A dict of relative file path: dict of size, mtime and sha256."""
+        try:
+            with sftp.open(posixpath.join(remoteDir, SFTPDirSync.MANIFEST_FILE), 'r') as fd:
+                return json.loads(fd.read().decode('utf-8'))
+        except (IOError, ValueError):
+            return {}
+
+    def _saveManifest(self, sftp, remoteDir, manifest):
+        """@brief Save the manifest in the remote folder."""
+        manifestFile = posixpath.join(remoteDir, SFTPDirSync.MANIFEST_FILE)
+        tmpManifestFile = manifestFile + SFTPTransfer.PART_SUFFIX
+        with sftp.open(tmpManifestFile, 'w') as fd:
+            fd.write(json.dumps(manifest).encode('utf-8'))
+        SSH._SFTPReplace(sftp, tmpManifestFile, manifestFile)
+
+    @staticmethod
+    def _GetHash(localDir, relPath, size, mtime, hashCache):
+        """@brief Get the SHA256 hash of a local file. The cached hash is used if the file has not changed.
+           @param localDir The local folder.
+           @param relPath The file path relative to the local folder.
+           @param size The size of the file.
+           @param mtime The modification time of the file.
+           @param hashCache A dict of relative file path: [size, mtime, hash].
+           @return The hash as a hex string."""
+        cacheEntry = hashCache.get(relPath)
+        if cacheEntry and cacheEntry[0] == size and cacheEntry[1] == mtime:
+            return cacheEntry[2]
+        sha256 = hashlib.sha256()
+        with open(os.path.join(localDir, *relPath.split("/")), 'rb') as fd:
+            for data in iter(lambda: fd.read(SFTPDirSync.HASH_READ_SIZE), b''):
+                sha256.update(data)
+        fileHash = sha256.hexdigest()
+        hashCache[relPath] = [size, mtime, fileHash]
+        return fileHash
+
+    @staticmethod
+    def _GetHashCacheFile(localDir):
+        """@return The file used to cache the hashes of the files in a local folder."""
+        os.makedirs(SFTPDirSync.HASH_CACHE_DIR, mode=0o700, exist_ok=True)
+        dirID = hashlib.sha1(os.path.abspath(localDir).encode('utf-8')).hexdigest()
+        return os.path.join(SFTPDirSync.HASH_CACHE_DIR, "{}.json".format(dirID))
 
 class SSH(object):
     """@brief responsible for connecting an ssh connection, excuting commands."""
@@ -129,6 +991,37 @@ class SSH(object):
     SSH_COPY_PROG                       = "/usr/bin/ssh-copy-id"
     SERVER_AUTHORISED_KEYS_FILE         = "~/.ssh/authorized_keys"
     DEFAULT_SSH_CONNECTION_TIMEOUT      = 20
+    # The file that records the private key that last worked for each host, port and user.
+    # Set to None to disable the cache.
+    KEY_CACHE_FILE                      = os.path.join(os.path.expanduser("~"), ".p3lib_ssh_key_cache.json")
+    # Pass as the useCompression argument to choose compression and the cipher from the measured
+    # speed of the link to each host and of this machine's CPU.
+    ADAPTIVE                            = "adaptive"
+    # The file that records the link measurements and choices made for each host in adaptive mode.
+    # Set to None to measure the link on every connection.
+    LINK_PROFILE_CACHE_FILE             = os.path.join(os.path.expanduser("~"), ".p3lib_ssh_link_cache.json")
+    LINK_PROFILE_MAX_AGE_SECONDS        = 86400
+    LINK_PROBE_BYTES                    = 1024*1024
+    LINK_PROBE_MAX_SECONDS              = 2.0
+    # Compression is used if the link is slower than this fraction of the local zlib throughput.
+    # The fraction allows for the compression and decompression at the other end of the link.
+    ADAPTIVE_ZLIB_FRACTION              = 0.5
+    ADAPTIVE_CIPHER_LIST                = ("aes128-gcm@openssh.com", "aes256-gcm@openssh.com", "aes128-ctr", "aes256-ctr")
+    _CacheLock                          = threading.Lock()
+    _CPUProfile                         = None
+    _CPUProfileLock                     = threading.Lock()
+    # The delay before each reconnect attempt starts at RECONNECT_MIN_SECONDS and is multiplied
+    # by RECONNECT_BACKOFF_FACTOR after each failed attempt up to RECONNECT_MAX_SECONDS.
+    RECONNECT_MIN_SECONDS               = 1.0
+    RECONNECT_MAX_SECONDS               = 60.0
+    RECONNECT_BACKOFF_FACTOR            = 2.0
+    # The number of reconnect attempts made before a method that needs the connection fails.
+    RECONNECT_CALL_ATTEMPTS             = 3
+    # How often the connection is checked when autoReconnect is set and keepAliveSeconds is 0.
+    CONNECTION_CHECK_SECONDS            = 15
+    CONNECTION_CHECK_TIMEOUT            = 10
+    # The number of unanswered TCP keepalive probes before the OS drops the connection.
+    KEEPALIVE_PROBE_COUNT               = 3
 
     @staticmethod
     def AddKey(privateKey):
@@ -218,6 +1111,69 @@ class SSH(object):
                     keyFileList.append(keyFile)
         return keyFileList
 
+    @staticmethod
+    def GetCachedPrivateKeyFile(host, port, username):
+        """@brief Get the private key file that was last used to login to an ssh server.
+           @param host The ssh server address.
+           @param port The ssh server port.
+           @param username The ssh username.
+           @return The private key file or None if not known."""
+        keyDict = SSH._GetCacheEntry(SSH.KEY_CACHE_FILE, SSH._GetKeyCacheID(host, port, username))
+        if keyDict:
+            return keyDict.get("keyFile")
+        return None
+
+    @staticmethod
+    def _CachePrivateKeyFile(host, port, username, keyFile, keyType, fingerprint):
+        """@brief Record the private key file used to login to an ssh server.
+           @param host The ssh server address.
+           @param port The ssh server port.
+           @param username The ssh username.
+           @param keyFile The private key file.
+           @param keyType The key algorithm (E.G ssh-ed25519).
+           @param fingerprint The hex fingerprint of the key."""
+        keyDict = {"keyFile": keyFile, "keyType": keyType, "fingerprint": fingerprint}
+        SSH._SetCacheEntry(SSH.KEY_CACHE_FILE, SSH._GetKeyCacheID(host, port, username), keyDict)
+
+    @staticmethod
+    def _GetKeyCacheID(host, port, username):
+        """@return The key cache dict key for an ssh server login."""
+        return "{}@{}:{}".format(username, host, port)
+
+    @staticmethod
+    def _GetCacheEntry(cacheFile, cacheID):
+        """@brief Get an entry from a local JSON cache file.
+           @param cacheFile The cache file or None if the cache is disabled.
+           @param cacheID The key of the entry in the cache.
+           @return The entry dict or None if not found."""
+        if not cacheFile:
+            return None
+        with SSH._CacheLock:
+            cacheDict = _loadJSON(cacheFile)
+        entryDict = cacheDict.get(cacheID)
+        if isinstance(entryDict, dict):
+            return entryDict
+        return None
+
+    @staticmethod
+    def _SetCacheEntry(cacheFile, cacheID, entryDict):
+        """@brief Add or replace an entry in a local JSON cache file.
+           @param cacheFile The cache file or None if the cache is disabled.
+           @param cacheID The key of the entry in the cache.
+           @param entryDict The entry dict."""
+        if not cacheFile:
+            return
+        with SSH._CacheLock:
+            cacheDict = _loadJSON(cacheFile)
+            if cacheDict.get(cacheID) == entryDict:
+                return
+            cacheDict[cacheID] = entryDict
+            try:
+                _saveJSON(cacheFile, cacheDict)
+            except OSError:
+                # The caches only speed up connections so failing to write one is not an error.
+                pass
+
     @staticmethod
     def GetPublicKey():
         """@brief Get the public ssh key from the local machine
@@ -267,15 +1223,35 @@ class SSH(object):
             return (hostname, username, keytype, key)
         return (None, None, None, None)
 
-    def __init__(self, host, username, password=None, useCompression=True, port=22, uio=None, privateKeyFile = None):
+    def __init__(self, host, username, password=None, useCompression=True, port=22, uio=None, privateKeyFile = None, usePool=False, multiKeyAuth=False,
+                 keepAliveSeconds=0, autoReconnect=False):
         """@brief Constructor
            @param host The SSH hostname
            @param username The ssh username
            @param password The ssh password (default=None)
-           @param useCompression If True then use compression on the ssh session (default=True)
+           @param useCompression If True then use compression on the ssh session (default=True).
+                                 If SSH.ADAPTIVE then compression and the cipher are chosen from the
+                                 speed of the link to the host and the CPU cost of compression and
+                                 encryption. See SSH.getSessionStats().
            @param port The ssh port number (default = 22)
            @param uio A UIO instance (default=None)
            @param privateKeyFile The private ssh keyfile (default=None=Use default private keyfile)
+           @param usePool If True then connect() uses a connection to the same host, port and user from the
+                          process wide SSHConnectionPool if one is available and close() returns the connection
+                          to the pool rather than closing it (default=False).
+           @param multiKeyAuth If True then connect() builds the connection once and each private key
+                               is tried on it in turn. If False (default) the connection is built again for
+                               each private key tried. In both cases the private key that last worked for
+                               the host, port and user (see KEY_CACHE_FILE) is tried first.
+           @param keepAliveSeconds If > 0 an ssh keepalive message is sent when the connection has been idle
+                                   for this many seconds and TCP keepalive probes are sent at the same
+                                   interval. This stops NAT devices and firewalls dropping idle
+                                   connections (default=0, disabled).
+           @param autoReconnect If True a thread checks the connection (every keepAliveSeconds or
+                                CONNECTION_CHECK_SECONDS) and reconnects, with exponential backoff, if it
+                                has been lost. Methods that use the connection also reconnect if it has
+                                been lost. Reconnect listeners (E.G SSHTunnelManager) are called after each
+                                reconnect. Not used with usePool as the pool reconnects pooled connections.
            """
         self._host              = host
         self._port              = port
@@ -291,6 +1267,17 @@ class SSH(object):
         logging.getLogger("paramiko").setLevel(logging.WARNING)
         self._ssh.set_missing_host_key_policy(AutoAddPolicy())
         self._sftp = None
+        self._usePool = usePool
+        self._pooledConnection = None
+        self._multiKeyAuth = multiKeyAuth
+        self._linkProfile = None
+        self._keepAliveSeconds = keepAliveSeconds
+        self._autoReconnect = autoReconnect and not usePool
+        self._reconnectLock = threading.RLock()
+        self._reconnectListenerList = []
+        self._reconnectCount = 0
+        self._monitorThread = None
+        self._monitorStopEvent = None
 
     def _info(self, text):
         """@brief Present an info level message to the user.
@@ -310,77 +1297,389 @@ class SSH(object):
         if self._uio:
             self._uio.debug(text)
 
+    def _setTCPKeepAlive(self, sock):
+        """@brief Enable TCP keepalives on the ssh connection socket. The first probe is sent after the
+                  connection has been idle for keepAliveSeconds rather than the OS default (2 hours on Linux).
+           @param sock The socket of the ssh connection."""
+        if not isinstance(sock, socket.socket):
+            # E.G A ProxyCommand.
+            return
+        keepAliveSeconds = max(1, int(self._keepAliveSeconds))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # macOS names the idle time option TCP_KEEPALIVE.
+        idleOption = getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None))
+        if idleOption is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, idleOption, keepAliveSeconds)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, keepAliveSeconds)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, SSH.KEEPALIVE_PROBE_COUNT)
+
     def isConnected(self):
         """@brief Check if a connection is active.
            @return True if connected."""
         connected = False
-        if self._ssh and self._ssh.get_transport() is not None:
-            connected = self._ssh.get_transport().is_active()
+        sshClient = self._ssh
+        if sshClient and sshClient.get_transport() is not None:
+            connected = sshClient.get_transport().is_active()
         return connected
 
+    def _getClient(self):
+        """@brief Get the ssh client. If another thread is part way through a reconnect attempt
+                  this waits for the attempt to complete.
+           @return The ExtendedSSHClient instance."""
+        with self._reconnectLock:
+            sshClient = self._ssh
+        if sshClient is None:
+            raise SSHError("Not connected to {}:{}.".format(self._host, self._port))
+        return sshClient
+
     def _connect(self, connectSFTPSession=False, timeout=DEFAULT_SSH_CONNECTION_TIMEOUT):
         """@brief Connect the ssh connection
            @param connectSFTPSession If True then just after the ssh connection
                   is built an SFT session will be built ready for file transfer.
            @param timeout The connection timeout in seconds.
            @return a ref to the SSHClient object"""
-        if not self._ssh:
-            self._ssh = ExtendedSSHClient()
+        # The client is only made available to other threads once it is connected.
+        sshClient = ExtendedSSHClient()
+        sshClient.set_missing_host_key_policy(AutoAddPolicy())
+        try:
+            privateKeyFileList = self._getPrivateKeyFileList()
+            if self._multiKeyAuth:
+                connected = self._connectMultiKey(sshClient, privateKeyFileList, timeout)
+            else:
+                connected = self._connectSingleKey(sshClient, privateKeyFileList, timeout)
 
-        connected = False
-        for privateKeyFile in SSH.GetPrivateKeyFileList():
+            if not connected:
+                raise Exception("Failed to connect to the SSH server {}@{}.".format(self._username, self._host))
+
+            # It can be usefull to know what local IP address was used to reach the ssh server
+            localAddress = sshClient.get_transport().sock.getsockname()[0]
+            if self.useCompression == SSH.ADAPTIVE:
+                self._adaptTransport(sshClient.get_transport(), timeout)
+            else:
+                sshClient.get_transport().use_compression(self.useCompression)
+            if self._keepAliveSeconds > 0:
+                sshClient.get_transport().set_keepalive(self._keepAliveSeconds)
+                self._setTCPKeepAlive(sshClient.get_transport().sock)
+            sftp = None
+            if connectSFTPSession:
+                sftp = SFTPClient.from_transport( sshClient.get_transport() )
+
+        except:
+            sshClient.close()
+            raise
+
+        oldClient = self._ssh
+        self._localAddress = localAddress
+        self._sftp = sftp
+        self._ssh = sshClient
+        if oldClient and oldClient is not sshClient:
+            oldClient.close()
+        return self._ssh
+
+    def _getPrivateKeyFileList(self):
+        """@return The list of private key files to try, the key that last worked for this server first."""
+        privateKeyFileList = SSH.GetPrivateKeyFileList()
+        cachedKeyFile = SSH.GetCachedPrivateKeyFile(self._host, self._port, self._username)
+        if cachedKeyFile in privateKeyFileList:
+            privateKeyFileList.remove(cachedKeyFile)
+            privateKeyFileList.insert(0, cachedKeyFile)
+        return privateKeyFileList
+
+    def _getConnectConfig(self, keyFilename, timeout):
+        """@brief Get the arguments passed to SSHClient.connect().
+           @param keyFilename A private key file or a list of them.
+           @param timeout The connection timeout in seconds.
+           @return A dict of arguments."""
+        cfg = {
+            'hostname': self._host,
+            'port': self._port,
+            'timeout': timeout,
+            'username': self._username,
+            'key_filename': keyFilename,
+            # Compression is negotiated when the connection is built. In adaptive mode the
+            # connection starts without compression and the keys are renegotiated if required.
+            'compress': self.useCompression is True,
+            # This used to be required or else loging in without the password would fail.
+            # This is no longer true for the latest paramiko as of 8 Mar 2024.
+            # Therefore this workaround has been removed but shown in place in case of future issues.
+            #'disabled_algorithms': dict(pubkeys=['rsa-sha2-256', 'rsa-sha2-512'])
+        }
+        # If we have a password then add this to the config
+        if self._password and len(self._password) > 0:
+            cfg['password']=self._password
+        return cfg
+
+    def _connectSingleKey(self, sshClient, privateKeyFileList, timeout):
+        """@brief Build the ssh connection for each private key in turn until one connects.
+           @param sshClient The ExtendedSSHClient instance to connect.
+           @param privateKeyFileList The private key files to try.
+           @param timeout The connection timeout in seconds.
+           @return True if connected."""
+        authException = None
+        for privateKeyFile in privateKeyFileList:
             if os.path.isfile(privateKeyFile):
                 msg = "Trying private key {}".format(privateKeyFile)
                 self._debug(msg)
                 try:
-                    #Define the ssh config
-                    cfg = {
-                        'hostname': self._host,
-                        'port': self._port,
-                        'timeout': timeout,
-                        'username': self._username,
-                        'key_filename': privateKeyFile,
-                        # This used to be required or else loging in without the password would fail.
-                        # This is no longer true for the latest paramiko as of 8 Mar 2024.
-                        # Therefore this workaround has been removed but shown in place in case of future issues.
-                        #'disabled_algorithms': dict(pubkeys=['rsa-sha2-256', 'rsa-sha2-512'])
-                    }
-                    # If we have a password then add this to the config
-                    if self._password and len(self._password) > 0:
-                        cfg['password']=self._password
-                    self._ssh.connect(**cfg)
-                    connected = True
-                    break
-        
-                # Ensure we throw an exception in the event of authencication failure as this ensures
-                # that the code to triggers the code to allow the user to copy thier public ssh key to
-                # the server in order that future logins are passwordless.
-                except AuthenticationException:
-                    raise
+                    sshClient.connect(**self._getConnectConfig(privateKeyFile, timeout))
+                    self._cacheAuthKey(sshClient, [privateKeyFile])
+                    return True
+
+                except AuthenticationException as ex:
+                    authException = ex
 
                 except:
                     pass
 
-        if not connected:
-            raise Exception("Failed to connect to the SSH server {}@{}.".format(self._username, self._host))
+        # Ensure we throw an exception in the event of authencication failure as this ensures
+        # that the code to triggers the code to allow the user to copy thier public ssh key to
+        # the server in order that future logins are passwordless.
+        if authException:
+            raise authException
 
-        # It can be usefull to know what local IP address was used to reach the ssh server
-        self._localAddress = self._ssh.get_transport().sock.getsockname()[0]
-        self._ssh.get_transport().use_compression(self.useCompression)
-        if connectSFTPSession:
-            self._sftp = SFTPClient.from_transport( self._ssh.get_transport() )
-        return self._ssh
+        return False
+
+    def _connectMultiKey(self, sshClient, privateKeyFileList, timeout):
+        """@brief Build the ssh connection once and try each private key on it until one authenticates.
+           @param sshClient The ExtendedSSHClient instance to connect.
+           @param privateKeyFileList The private key files to try.
+           @param timeout The connection timeout in seconds.
+           @return True if connected."""
+        privateKeyFileList = [privateKeyFile for privateKeyFile in privateKeyFileList if os.path.isfile(privateKeyFile)]
+        if not privateKeyFileList:
+            return False
+        self._debug("Trying private keys {}".format(", ".join(privateKeyFileList)))
+        try:
+            # SSHClient tries each key file in turn on the same transport.
+            sshClient.connect(**self._getConnectConfig(privateKeyFileList, timeout))
+
+        # As above authentication failures are passed to the caller.
+        except AuthenticationException:
+            raise
+
+        except:
+            return False
+
+        self._cacheAuthKey(sshClient, privateKeyFileList)
+        return True
+
+    def _cacheAuthKey(self, sshClient, privateKeyFileList):
+        """@brief Record the private key that the connection authenticated with in the key cache.
+           @param sshClient The connected ExtendedSSHClient instance.
+           @param privateKeyFileList The private key files that were tried."""
+        if not SSH.KEY_CACHE_FILE:
+            return
+        transport = sshClient.get_transport()
+        authKey = None
+        if transport and transport.auth_handler:
+            authKey = transport.auth_handler.private_key
+        if authKey is None:
+            return
+        fingerprint = authKey.get_fingerprint().hex()
+        keyDict = SSH._GetCacheEntry(SSH.KEY_CACHE_FILE, SSH._GetKeyCacheID(self._host, self._port, self._username))
+        if keyDict and keyDict.get("fingerprint") == fingerprint and keyDict.get("keyFile") in privateKeyFileList:
+            # The cached key worked again so there's no need to load the key files to find it.
+            return
+        keyFile = None
+        for privateKeyFile in privateKeyFileList:
+            try:
+                if PKey.from_path(privateKeyFile, self._password).get_fingerprint() == authKey.get_fingerprint():
+                    keyFile = privateKeyFile
+                    break
+            except Exception:
+                pass
+        # Only keys loaded from the key files are cached, not (E.G) ssh agent keys.
+        if keyFile:
+            SSH._CachePrivateKeyFile(self._host, self._port, self._username, keyFile, authKey.get_name(), fingerprint)
+
+    def getSessionStats(self):
+        """@brief Get details of the current ssh session.
+           @return A dict containing the host, port, adaptive (True if useCompression is SSH.ADAPTIVE),
+                   compression (the compression algorithm in use for data sent), cipher and mac.
+                   In adaptive mode linkProfile holds the measurements the choice of compression and cipher
+                   was made from (linkBytesPerSecond, zlibBytesPerSecond, cipherBytesPerSecond), the choices
+                   made (compression, cipher), source ('probe' if measured on this connection or 'cache') and
+                   time (when measured). Otherwise linkProfile is None."""
+        sessionStats = {"host":         self._host,
+                        "port":         self._port,
+                        "adaptive":     self.useCompression == SSH.ADAPTIVE,
+                        "compression":  None,
+                        "cipher":       None,
+                        "mac":          None,
+                        "linkProfile":  self._linkProfile}
+        sshClient = self._ssh
+        transport = sshClient.get_transport() if sshClient else None
+        if transport and transport.is_active():
+            sessionStats["compression"] = transport.local_compression
+            sessionStats["cipher"] = transport.local_cipher
+            sessionStats["mac"] = transport.local_mac
+        return sessionStats
+
+    @staticmethod
+    def GetCPUProfile():
+        """@brief Measure how fast this machine can compress (as paramiko does, a packet at a time) and encrypt data.
+                  This is measured once per process.
+           @return A dict containing zlibBytesPerSecond and cipherBytesPerSecond. cipherBytesPerSecond is
+                   a dict keyed by the name of each cipher in SSH.ADAPTIVE_CIPHER_LIST."""
+        with SSH._CPUProfileLock:
+            if SSH._CPUProfile is None:
+                packetSize = 32768
+                sampleBytes = 1024*1024
+                # Half text like data and half random data.
+                sample = (b"p3lib adaptive ssh compression sample line 0123456789\n" * (sampleBytes//32))[:sampleBytes//2] + os.urandom(sampleBytes//2)
+
+                compressor = zlib.compressobj()
+                startTime = perf_counter()
+                for offset in range(0, len(sample), packetSize):
+                    compressor.compress(sample[offset:offset+packetSize])
+                    compressor.flush(zlib.Z_FULL_FLUSH)
+                zlibBytesPerSecond = len(sample) / max(perf_counter() - startTime, 1E-6)
+
+                cipherBytesPerSecond = {}
+                for cipherName in SSH.ADAPTIVE_CIPHER_LIST:
+                    keyBytes = 16 if cipherName.startswith("aes128") else 32
+                    key = os.urandom(keyBytes)
+                    # The fastest of two runs is used so that the first run does not pay for any set up costs.
+                    bestSeconds = None
+                    for _ in range(2):
+                        startTime = perf_counter()
+                        if cipherName.endswith("gcm@openssh.com"):
+                            aesGCM = AESGCM(key)
+                            nonce = os.urandom(12)
+                            for offset in range(0, len(sample), packetSize):
+                                aesGCM.encrypt(nonce, sample[offset:offset+packetSize], None)
+                        else:
+                            # The CTR ciphers are used with a separate MAC.
+                            encryptor = Cipher(algorithms.AES(key), modes.CTR(os.urandom(16))).encryptor()
+                            for offset in range(0, len(sample), packetSize):
+                                packet = sample[offset:offset+packetSize]
+                                encryptor.update(packet)
+                                hmac.new(key, packet, hashlib.sha256).digest()
+                        elapsedSeconds = perf_counter() - startTime
+                        if bestSeconds is None or elapsedSeconds < bestSeconds:
+                            bestSeconds = elapsedSeconds
+                    cipherBytesPerSecond[cipherName] = len(sample) / max(bestSeconds, 1E-6)
+
+                SSH._CPUProfile = {"zlibBytesPerSecond": zlibBytesPerSecond,
+                                   "cipherBytesPerSecond": cipherBytesPerSecond}
+            return SSH._CPUProfile
+
+    def _adaptTransport(self, transport, timeout):
+        """@brief Choose compression and the cipher for the connection. The choices are made from the
+                  speed of the link to the host (measured or read from LINK_PROFILE_CACHE_FILE) and the
+                  CPU cost of compression and encryption on this machine. If they differ from those in
+                  use the session keys are renegotiated to apply them.
+           @param transport The transport of the connection.
+           @param timeout The timeout in seconds for the link measurement."""
+        cacheID = "{}:{}".format(self._host, self._port)
+        linkProfile = SSH._GetCacheEntry(SSH.LINK_PROFILE_CACHE_FILE, cacheID)
+        if linkProfile and time() - linkProfile.get("time", 0) <= SSH.LINK_PROFILE_MAX_AGE_SECONDS:
+            linkProfile["source"] = "cache"
+        else:
+            linkProfile = self._getLinkProfile(transport, timeout)
+            if linkProfile["linkBytesPerSecond"] is not None:
+                SSH._SetCacheEntry(SSH.LINK_PROFILE_CACHE_FILE, cacheID, linkProfile)
+
+        # Put the chosen cipher first. The others remain in case the server does not support it.
+        securityOptions = transport.get_security_options()
+        cipher = linkProfile["cipher"]
+        if cipher in securityOptions.ciphers:
+            securityOptions.ciphers = (cipher,) + tuple(c for c in securityOptions.ciphers if c != cipher)
+        transport.use_compression(linkProfile["compression"])
+
+        compressing = transport.local_compression not in (None, "none")
+        if compressing != linkProfile["compression"] or transport.local_cipher != cipher:
+            transport.renegotiate_keys()
+        self._linkProfile = linkProfile
+        self._debug("Adaptive ssh session to {}:{}: compression={}, cipher={} ({}).".format(self._host,
+                                                                                          self._port,
+                                                                                          linkProfile["compression"],
+                                                                                          transport.local_cipher,
+                                                                                          linkProfile["source"]))
+
+    def _getLinkProfile(self, transport, timeout):
+        """@brief Measure the speed of the link to the host and choose compression and the cipher.
+           @param transport The transport of the connection.
+           @param timeout The timeout in seconds for the link measurement.
+           @return A link profile dict as described in getSessionStats()."""
+        cpuProfile = SSH.GetCPUProfile()
+        cipherBytesPerSecond = cpuProfile["cipherBytesPerSecond"]
+        linkBytesPerSecond = self._probeLinkBytesPerSecond(transport, timeout)
+        # If the link could not be measured it is treated as fast so compression is not used.
+        compression = linkBytesPerSecond is not None and linkBytesPerSecond < cpuProfile["zlibBytesPerSecond"]*SSH.ADAPTIVE_ZLIB_FRACTION
+        return {"linkBytesPerSecond":   linkBytesPerSecond,
+                "zlibBytesPerSecond":   cpuProfile["zlibBytesPerSecond"],
+                "cipherBytesPerSecond": cipherBytesPerSecond,
+                "compression":          compression,
+                "cipher":               max(cipherBytesPerSecond, key=cipherBytesPerSecond.get),
+                "source":               "probe",
+                "time":                 time()}
+
+    def _probeLinkBytesPerSecond(self, transport, timeout):
+        """@brief Measure the speed of the link to the host by reading data from a remote command.
+                  The time until the first data arrives (round trip and command start up) is not included.
+           @param transport The transport of the connection.
+           @param timeout The timeout in seconds.
+           @return The measured bytes per second or None if the measurement failed."""
+        try:
+            chan = transport.open_session(timeout=timeout)
+        except Exception:
+            return None
+        try:
+            chan.settimeout(timeout)
+            chan.exec_command("head -c {} /dev/zero".format(SSH.LINK_PROBE_BYTES))
+            firstByteTime = None
+            rxByteCount = 0
+            while True:
+                data = chan.recv(ExtendedSSHClient.READ_SIZE)
+                if not data:
+                    break
+                now = perf_counter()
+                if firstByteTime is None:
+                    firstByteTime = now
+                else:
+                    rxByteCount += len(data)
+                if now - firstByteTime >= SSH.LINK_PROBE_MAX_SECONDS:
+                    break
+            if firstByteTime is None or rxByteCount == 0:
+                return None
+            return rxByteCount / max(perf_counter() - firstByteTime, 1E-6)
+        except Exception:
+            return None
+        finally:
+            chan.close()
 
     def getLocalAddress(self):
         """@brief Get the local IP address of the network interface used to connect to the ssh server"""
         return self._localAddress
 
+    def getHost(self):
+        """@return The ssh server hostname."""
+        return self._host
+
+    def getPort(self):
+        """@return The ssh server port number."""
+        return self._port
+
+    def getUsername(self):
+        """@return The ssh username."""
+        return self._username
+
     def getSSHClient(self):
         """@brief return a ref to the SSHClient object"""
         return self._ssh
 
     def close(self):
-        """@brief Close an open ssh connection."""
+        """@brief Close an open ssh connection. If the connection was taken from the
+                  SSHConnectionPool it is returned to the pool."""
+        self._stopMonitor()
+        if self._pooledConnection:
+            SSHConnectionPool.GetDefault().release(self._pooledConnection)
+            self._pooledConnection = None
+            self._ssh = None
+
         if self._ssh:
             self._ssh.close()
             self._ssh = None
@@ -392,7 +1691,143 @@ class SSH(object):
         """@brief Get the ssh transport object. Should only be
                   called when the ssh session is connected.
            @return The ssh transport object."""
-        return self._ssh.get_transport()
+        self._updateConnection()
+        return self._getClient().get_transport()
+
+    def _updateConnection(self):
+        """@brief If the connection was taken from the SSHConnectionPool get the current ssh client
+                  from the pool. This will have been reconnected if the previous connection was lost.
+                  Otherwise, if autoReconnect was set and the connection has been lost, reconnect."""
+        if self._pooledConnection:
+            self._ssh = self._pooledConnection.getClient()
+            if self._sftp:
+                self._sftp = self._pooledConnection.getSFTP()
+
+        elif self._monitorThread and not self.isConnected():
+            self._reconnect(self._ssh, maxAttempts=SSH.RECONNECT_CALL_ATTEMPTS)
+
+    def checkConnection(self, timeout=CONNECTION_CHECK_TIMEOUT):
+        """@brief Check that the ssh server is responding by opening and closing a channel.
+                  isConnected() only checks the local state of the connection so it does not detect
+                  a connection that was silently dropped (E.G by a NAT device).
+           @param timeout The time in seconds to wait for the server to respond.
+           @return True if the server responded."""
+        sshClient = self._ssh
+        if not sshClient or not self.isConnected():
+            return False
+        try:
+            chan = sshClient.get_transport().open_session(timeout=timeout)
+            chan.close()
+        except Exception:
+            return False
+        return True
+
+    def reconnect(self, maxAttempts=None, timeout=DEFAULT_SSH_CONNECTION_TIMEOUT):
+        """@brief Close the ssh connection and connect again. Failed attempts are retried after a delay that
+                  increases exponentially from RECONNECT_MIN_SECONDS to RECONNECT_MAX_SECONDS. The reconnect
+                  listeners are called once connected.
+           @param maxAttempts The maximum number of attempts or None (default) to keep trying until connected
+                              or, if autoReconnect was set, close() is called.
+           @param timeout The connection timeout in seconds for each attempt.
+           @return True if connected, False if close() was called before the connection was made."""
+        return self._reconnect(self._ssh, maxAttempts=maxAttempts, timeout=timeout)
+
+    def _reconnect(self, lostClient, maxAttempts=None, timeout=DEFAULT_SSH_CONNECTION_TIMEOUT, stopEvent=None):
+        """@brief Replace a lost connection. The reconnect lock is only held for each connection attempt
+                  so other threads that need the connection are not blocked while this one waits to retry.
+           @param lostClient The ExtendedSSHClient instance of the lost connection. If another thread has
+                             already replaced it with a working connection that connection is used.
+           @param maxAttempts The maximum number of attempts or None to keep trying.
+           @param timeout The connection timeout in seconds for each attempt.
+           @param stopEvent If set the attempts stop. If None the event that stops the connection monitor is used.
+           @return True if connected, False if close() was called before the connection was made."""
+        if stopEvent is None:
+            stopEvent = self._monitorStopEvent
+        connectSFTPSession = self._sftp is not None
+        delaySeconds = SSH.RECONNECT_MIN_SECONDS
+        attempt = 0
+        while True:
+            attempt += 1
+            with self._reconnectLock:
+                if self._ssh is not lostClient and self.isConnected():
+                    return True
+                # The lost client is closed but left in place until _connect() replaces it so
+                # that other threads never see a client that is part way through connecting.
+                if self._ssh:
+                    self._ssh.close()
+                self._sftp = None
+                try:
+                    self._connect(connectSFTPSession=connectSFTPSession, timeout=timeout)
+                    # If close() was called while connecting the new connection is not wanted.
+                    if stopEvent and stopEvent.is_set():
+                        self._ssh.close()
+                        self._ssh = None
+                        return False
+                    self._info("Reconnected to {}:{}.".format(self._host, self._port))
+                    for reconnectListener in list(self._reconnectListenerList):
+                        try:
+                            reconnectListener(self)
+                        except Exception as ex:
+                            self._warn("Reconnect listener failed: {}".format(ex))
+                    self._reconnectCount += 1
+                    return True
+                except Exception as ex:
+                    if maxAttempts is not None and attempt >= maxAttempts:
+                        raise
+                    self._warn("Reconnect to {}:{} failed ({}). Retrying in {:.1f} seconds.".format(self._host, self._port, ex, delaySeconds))
+            if stopEvent:
+                if stopEvent.wait(delaySeconds):
+                    return False
+            else:
+                sleep(delaySeconds)
+            delaySeconds = min(delaySeconds*SSH.RECONNECT_BACKOFF_FACTOR, SSH.RECONNECT_MAX_SECONDS)
+
+    def getReconnectCount(self):
+        """@return The number of times reconnect() has rebuilt the connection."""
+        return self._reconnectCount
+
+    def addReconnectListener(self, reconnectListener):
+        """@brief Add a function to be called (with this SSH instance as the argument) each time the
+                  connection is rebuilt by reconnect().
+           @param reconnectListener The function to call."""
+        if reconnectListener not in self._reconnectListenerList:
+            self._reconnectListenerList.append(reconnectListener)
+
+    def removeReconnectListener(self, reconnectListener):
+        """@brief Remove a function added with addReconnectListener().
+           @param reconnectListener The function to remove."""
+        if reconnectListener in self._reconnectListenerList:
+            self._reconnectListenerList.remove(reconnectListener)
+
+    def _startMonitor(self):
+        """@brief Start the thread that checks the connection and reconnects if it has been lost."""
+        if self._monitorThread and self._monitorThread.is_alive():
+            return
+        self._monitorStopEvent = threading.Event()
+        self._monitorThread = threading.Thread(target=self._monitorConnection, args=(self._monitorStopEvent,), daemon=True)
+        self._monitorThread.start()
+
+    def _stopMonitor(self):
+        """@brief Stop the connection monitor thread if running."""
+        if self._monitorStopEvent:
+            self._monitorStopEvent.set()
+        if self._monitorThread and self._monitorThread is not threading.current_thread():
+            self._monitorThread.join(SSH.CONNECTION_CHECK_TIMEOUT)
+        self._monitorThread = None
+        self._monitorStopEvent = None
+
+    def _monitorConnection(self, stopEvent):
+        """@brief Check the connection periodically and reconnect if it has been lost.
+           @param stopEvent Set to stop the thread."""
+        checkSeconds = self._keepAliveSeconds if self._keepAliveSeconds > 0 else SSH.CONNECTION_CHECK_SECONDS
+        while not stopEvent.wait(checkSeconds):
+            lostClient = self._ssh
+            if not self.checkConnection():
+                self._warn("The ssh connection to {}:{} has been lost.".format(self._host, self._port))
+                try:
+                    self._reconnect(lostClient, stopEvent=stopEvent)
+                except Exception as ex:
+                    self._warn("Reconnect to {}:{} failed: {}".format(self._host, self._port, ex))
 
     def runCmd(self, cmd, throwError=True, timeout=None):
         """@brief Run a command over an ssh session
@@ -405,7 +1840,41 @@ class SSH(object):
               1 - Lines of text from stdout
               2 - lines of text from stderr
         """
-        return self._ssh.runCmd(cmd, throwError=throwError, timeout=timeout)
+        self._updateConnection()
+        return self._getClient().runCmd(cmd, throwError=throwError, timeout=timeout)
+
+    def runCmdStream(self, cmd, throwError=True, timeout=None, encoding='utf-8', maxLineLength=SSHCmdStream.DEFAULT_MAX_LINE_LENGTH):
+        """@brief Run a command over an ssh session and read the lines of text it outputs as they arrive.
+                  E.G
+                  for stream, line in ssh.runCmdStream("journalctl", timeout=60):
+                      if stream == SSHCmdStream.STDOUT:
+                          print(line)
+           @param cmd The command to execute
+           @param throwError If True and the exit status of the command is not 0 then an SSHError is thrown
+                             once all the output has been read.
+           @param timeout The maximum time in seconds for the whole command or None (default) if no timeout is required.
+           @param encoding The text encoding of the command output.
+           @param maxLineLength Lines longer than this are split so that memory use is bounded.
+           @return An SSHCmdStream instance."""
+        self._updateConnection()
+        return self._getClient().runCmdStream(cmd, throwError=throwError, timeout=timeout, encoding=encoding, maxLineLength=maxLineLength)
+
+    def runBatch(self, cmdList, throwError=True, timeout=None):
+        """@brief Run a list of commands in a single remote shell session rather than opening
+                  a channel for each one. E.G
+                  for rc, stdoutLines, stderrLines in ssh.runBatch(["cd /tmp", "ls", "df -h ."]):
+                      print(stdoutLines)
+           @param cmdList A list of the commands to execute. These run one after the other in the same shell.
+           @param throwError If True and a command fails (non zero exit status) the commands after it are
+                             not run and an SSHError is thrown.
+           @param timeout The maximum time in seconds for all the commands or None (default) if no timeout is required.
+           @return A list with an element for each command. Each element is a list containing
+              0 - the return code/exit status of the command
+              1 - Lines of text from stdout
+              2 - lines of text from stderr
+        """
+        self._updateConnection()
+        return self._getClient().runBatch(cmdList, throwError=throwError, timeout=timeout)
 
     def startCmd(self, cmd):
         """@brief Start executing a command. This will return after starting the command and before the command has completed.
@@ -419,7 +1888,8 @@ class SSH(object):
                         When the command is complete the caller should call channel.close()
            @return A channel instance in which the command is executing.
            """
-        return self._ssh.startCmd(cmd)
+        self._updateConnection()
+        return self._getClient().startCmd(cmd)
 
     def connect(self, enableAutoLoginSetup=False, connectSFTPSession=False, timeout=DEFAULT_SSH_CONNECTION_TIMEOUT):
         """@brief Connect the ssh connection
@@ -433,14 +1903,38 @@ class SSH(object):
                    login was setup for connection to succeed."""
         setupAutoLogin = False
         try:
-            self._connect(connectSFTPSession=connectSFTPSession, timeout=timeout)
+            self.connectOrAcquire(connectSFTPSession=connectSFTPSession, timeout=timeout)
 
         except AuthenticationException:
             self._setupAutologin(timeout)
-            self._connect(connectSFTPSession=connectSFTPSession, timeout=timeout)
+            self.connectOrAcquire(connectSFTPSession=connectSFTPSession, timeout=timeout)
             setupAutoLogin = True
         return setupAutoLogin
 
+    def connectOrAcquire(self, connectSFTPSession=False, timeout=DEFAULT_SSH_CONNECTION_TIMEOUT):
+        """@brief Connect the ssh connection or, if usePool was set, get a connection from the SSHConnectionPool.
+                  Unlike connect() an authentication failure is raised rather than prompting the user to
+                  setup auto login so this is suitable for connections made without user interaction.
+           @param connectSFTPSession If True then an SFTP session is made available for file transfer.
+           @param timeout The connection timeout in seconds."""
+        if self._usePool:
+            if self._pooledConnection is None:
+                self._pooledConnection = SSHConnectionPool.GetDefault().acquire(self._host,
+                                                                                 self._username,
+                                                                                 password=self._password,
+                                                                                 port=self._port,
+                                                                                 useCompression=self.useCompression,
+                                                                                 uio=self._uio,
+                                                                                 timeout=timeout)
+            self._ssh = self._pooledConnection.getClient()
+            self._localAddress = self._pooledConnection.getLocalAddress()
+            if connectSFTPSession:
+                self._sftp = self._pooledConnection.getSFTP()
+        else:
+            self._connect(connectSFTPSession=connectSFTPSession, timeout=timeout)
+            if self._autoReconnect:
+                self._startMonitor()
+
     def _setupAutologin(self, timeout=DEFAULT_SSH_CONNECTION_TIMEOUT):
         """@brief Setup autologin on the ssh server.
            @param timeout The connection timeout in seconds."""
@@ -486,67 +1980,176 @@ class SSH(object):
     def updateAuthorisedKeys(self, publicKey):
         """Update the authorised keys file on the remote ssh server with the
            public ssh key"""
-        authKeysFile = self.getRemoteAuthorisedKeyFile()
-        cmd = "test -d %s" % (authKeysFile)
-        rc, stdoutlines, stderrlines = self.runCmd(cmd, throwError=False)
-        if rc == 0:
-            # If this is a dir with nothing in it, delete it and create an empty
-            # authorized_keys file.
-            self.runCmd("rmdir %s" % (authKeysFile))
-            self.runCmd("touch %s" % (authKeysFile))
-
-        self.runCmd("echo \"%s\" >> %s" % (publicKey, authKeysFile))
-        self.runCmd("chmod 600 %s" % (authKeysFile))
+        with self._sftpSession() as sftp:
+            authKeysFile = self._getRemoteAuthorisedKeyFile(sftp)
+            if sftp and SSH._SFTPIsDir(sftp, SSH._GetSFTPPath(authKeysFile)):
+                # If this is a dir with nothing in it, delete it and create an authorized_keys file.
+                sftp.rmdir(SSH._GetSFTPPath(authKeysFile))
+            authKeyLines = self._readAuthKeys(sftp, authKeysFile)
+            if authKeyLines is None:
+                authKeyLines = []
+            authKeyLines.append(publicKey)
+            self._writeAuthKeys(sftp, authKeysFile, authKeyLines)
         return authKeysFile
 
     def getRemoteAuthorisedKeys(self):
         """Get the remote authorised keys file over the ssh connection."""
-        authKeysFile = self.getRemoteAuthorisedKeyFile()
-        cmd = "test -f %s" % (authKeysFile)
-        rc, stdoutLines, stderrLines = self.runCmd(cmd, throwError=False)
-        if rc != 0:
-            # Auth keys file not found, attempt to create an empty one.
-            cmd = "touch %s" % (authKeysFile)
-            rc, stdoutLines, stderrLines = self.runCmd(cmd, throwError=False)
-            cmd = "test -f %s" % (authKeysFile)
-            rc, stdoutLines, stderrLines = self.runCmd(cmd, throwError=False)
-            if rc != 0:
-                raise SSHError("!!! Server auth keys file not found (%s). Failed to create it." % (authKeysFile))
-
-        rc, stdoutLines, stderrLines = self.runCmd("cat %s" % (authKeysFile), throwError=False)
+        with self._sftpSession() as sftp:
+            authKeysFile = self._getRemoteAuthorisedKeyFile(sftp)
+            authKeyLines = self._readAuthKeys(sftp, authKeysFile)
+            if authKeyLines is None:
+                # Auth keys file not found, attempt to create an empty one.
+                try:
+                    self._writeAuthKeys(sftp, authKeysFile, [])
+                except Exception:
+                    raise SSHError("!!! Server auth keys file not found (%s). Failed to create it." % (authKeysFile))
+                authKeyLines = []
 
         # Ensure we only return non empty lines
-        authKeyLines = []
-        for l in stdoutLines:
-            if len(l.strip()) > 0:
-                authKeyLines.append(l)
-        return authKeyLines
+        return [l for l in authKeyLines if len(l.strip()) > 0]
 
     def getRemoteAuthorisedKeyFile(self):
         """@brief Return the remote authorised key file for the current ssh connection."""
+        with self._sftpSession() as sftp:
+            return self._getRemoteAuthorisedKeyFile(sftp)
 
-        authKeysFile = SSH.DEFAULT_REMOTE_SSH_AUTH_KEYS_FILE
+    @staticmethod
+    def _GetSFTPPath(remotePath):
+        """@brief Get the path of a remote file as used by SFTP. SFTP does not expand ~ but paths
+                  relative to the users home folder are supported.
+           @param remotePath The remote path as used in a shell command.
+           @return The remote path as used by SFTP."""
+        if remotePath == "~":
+            return "."
+        if remotePath.startswith("~/"):
+            return remotePath[2:]
+        return remotePath
 
-        cmd = "test -d %s" % (SSH.DROPBEAR_DIR)
-        rc, stdoutLines, stderrLines = self.runCmd(cmd, throwError=False)
-        # If the ssh server uses dropbear
-        if rc == 0:
-            authKeysFile = SSH.DROPBEAR_AUTH_KEYS_FILE
-        else:
-            # Check for the users ssh config folder
-            cmd = "test -d %s" % (SSH.DEFAULT_REMOTE_SSH_CONFIG_FOLDER)
-            rc, stdoutLines, stderrLines = self.runCmd(cmd, throwError=False)
-            if rc != 0:
-                # If the remote ssh config folder does not exist, create it
-                cmd = f"mkdir {SSH.DEFAULT_REMOTE_SSH_CONFIG_FOLDER}"
-                rc, stdoutLines, stderrLines = self.runCmd(cmd, throwError=True)
+    @staticmethod
+    def _SFTPIsDir(sftp, sftpPath):
+        """@return True if the remote path is a folder."""
+        try:
+            return stat.S_ISDIR(sftp.stat(sftpPath).st_mode)
+        except IOError:
+            return False
 
-        return authKeysFile
+    @staticmethod
+    def _SFTPReplace(sftp, srcPath, destPath):
+        """@brief Rename a remote file, replacing the destination file if it exists.
+           @param sftp An SFTP client.
+           @param srcPath The remote file to rename.
+           @param destPath The new name of the remote file."""
+        try:
+            sftp.posix_rename(srcPath, destPath)
+        except IOError:
+            # The server does not support the posix rename extension.
+            try:
+                sftp.remove(destPath)
+            except IOError:
+                pass
+            sftp.rename(srcPath, destPath)
+
+    @contextlib.contextmanager
+    def _sftpSession(self):
+        """@brief Provide an SFTP client for the duration of a with statement. The SFTP session
+                  opened by connect() is used if present, otherwise one is opened and closed.
+                  None is provided if the ssh server has no SFTP subsystem (E.G some dropbear installs)."""
+        self._updateConnection()
+        if self._sftp:
+            yield self._sftp
+            return
+        try:
+            sftp = SFTPClient.from_transport(self.getTransport())
+        except Exception:
+            sftp = None
+        try:
+            yield sftp
+        finally:
+            if sftp:
+                sftp.close()
+
+    def _getRemoteAuthorisedKeyFile(self, sftp):
+        """@brief Get the remote authorised key file, creating the users ssh config folder if required.
+           @param sftp An SFTP client or None if SFTP is not available.
+           @return The remote authorised keys file."""
+        if sftp:
+            # If the ssh server uses dropbear
+            if SSH._SFTPIsDir(sftp, SSH.DROPBEAR_DIR):
+                return SSH.DROPBEAR_AUTH_KEYS_FILE
+            sshConfigFolder = SSH._GetSFTPPath(SSH.DEFAULT_REMOTE_SSH_CONFIG_FOLDER)
+            if not SSH._SFTPIsDir(sftp, sshConfigFolder):
+                sftp.mkdir(sshConfigFolder, mode=0o700)
+            return SSH.DEFAULT_REMOTE_SSH_AUTH_KEYS_FILE
+
+        cmd = "if [ -d {} ]; then echo dropbear; else mkdir -p {}; fi".format(SSH.DROPBEAR_DIR, SSH.DEFAULT_REMOTE_SSH_CONFIG_FOLDER)
+        rc, stdoutLines, stderrLines = self.runCmd(cmd, throwError=True)
+        if "dropbear" in stdoutLines:
+            return SSH.DROPBEAR_AUTH_KEYS_FILE
+        return SSH.DEFAULT_REMOTE_SSH_AUTH_KEYS_FILE
+
+    def _readAuthKeys(self, sftp, authKeysFile):
+        """@brief Read the authorised keys file.
+           @param sftp An SFTP client or None if SFTP is not available.
+           @param authKeysFile The remote authorised keys file.
+           @return A list of the lines in the file or None if the file does not exist."""
+        if sftp:
+            try:
+                with sftp.open(SSH._GetSFTPPath(authKeysFile), 'r') as fd:
+                    return fd.read().decode('utf-8').splitlines()
+            except IOError:
+                return None
+
+        rc, stdoutLines, stderrLines = self.runCmd("cat %s" % (authKeysFile), throwError=False)
+        if rc != 0:
+            return None
+        return stdoutLines
+
+    def _writeAuthKeys(self, sftp, authKeysFile, authKeyLines, backupFile=None, backupLines=None):
+        """@brief Replace the authorised keys file. The new contents are written to a temporary file
+                  which is then renamed so that the authorised keys file is never left partially written.
+           @param sftp An SFTP client or None if SFTP is not available.
+           @param authKeysFile The remote authorised keys file.
+           @param authKeyLines The lines of the new authorised keys file.
+           @param backupFile If not None the backup file to save the previous authorised keys file to.
+           @param backupLines The lines of the previous authorised keys file."""
+        text = "".join([line + "\n" for line in authKeyLines if len(line.strip()) > 0])
+        tmpAuthKeysFile = "%s.tmp" % (authKeysFile)
+        if sftp:
+            if backupFile:
+                self._writeSFTPFile(sftp, SSH._GetSFTPPath(backupFile), "".join([line + "\n" for line in backupLines]))
+            sftpTmpFile = SSH._GetSFTPPath(tmpAuthKeysFile)
+            self._writeSFTPFile(sftp, sftpTmpFile, text)
+            SSH._SFTPReplace(sftp, sftpTmpFile, SSH._GetSFTPPath(authKeysFile))
+            return
+
+        # Write the new file contents to the stdin of a single remote command.
+        cmd = "umask 077 && cat > {} && chmod 600 {} && mv -f {} {}".format(tmpAuthKeysFile, tmpAuthKeysFile, tmpAuthKeysFile, authKeysFile)
+        if backupFile:
+            cmd = "cp -p {} {} && {}".format(authKeysFile, backupFile, cmd)
+        chan = self.startCmd(cmd)
+        try:
+            chan.sendall(text.encode('utf-8'))
+            chan.shutdown_write()
+            exitStatus = chan.recv_exit_status()
+        finally:
+            chan.close()
+        if exitStatus != 0:
+            raise SSHError("Failed to write the %s file on the ssh server (error code %d)." % (authKeysFile, exitStatus))
+
+    def _writeSFTPFile(self, sftp, sftpPath, text):
+        """@brief Write a remote file that is only readable by the user.
+           @param sftp An SFTP client.
+           @param sftpPath The remote file.
+           @param text The file contents."""
+        with sftp.open(sftpPath, 'w') as fd:
+            fd.chmod(0o600)
+            fd.write(text.encode('utf-8'))
 
     def getFile(self, remoteFilePath, localFilePath ):
         """@brief Get a file from the sftp server
            @param remoteFilePath The remote file on the ssh server.
            @param localFilePath The path of the file after it's been received"""
+        self._updateConnection()
         if self._sftp:
             self._sftp.get(remoteFilePath,localFilePath)
         else:
@@ -556,11 +2159,44 @@ class SSH(object):
         """@brief Get a file from the sftp server
            @param localFilePath The path of the file after it's been received
            @param remoteFilePath The remote file on the ssh server."""
+        self._updateConnection()
         if self._sftp:
             self._sftp.put(localFilePath, remoteFilePath)
         else:
             raise SSHError("SFTP not connected.")
 
+    def getSFTPTransfer(self, channelCount=SFTPTransfer.DEFAULT_CHANNEL_COUNT, blockSize=SFTPTransfer.DEFAULT_BLOCK_SIZE,
+                        pipelineDepth=SFTPTransfer.DEFAULT_PIPELINE_DEPTH, rangeThreshold=SFTPTransfer.DEFAULT_RANGE_THRESHOLD, progressCallback=None,
+                        preserveTimes=False):
+        """@brief Get an SFTPTransfer instance for high throughput file transfers over this ssh connection.
+                  E.G
+                  with ssh.getSFTPTransfer(channelCount=8) as sftpTransfer:
+                      sftpTransfer.get("/var/log/capture.pcap", "capture.pcap", resume=True)
+           @param channelCount The maximum number of SFTP channels used at the same time.
+           @param blockSize The size of each read or write request.
+           @param pipelineDepth The number of read requests in flight on each channel.
+           @param rangeThreshold Files this size or larger are split into ranges transferred in parallel.
+           @param progressCallback If not None called with the arguments: source path, bytes transferred, file size.
+           @param preserveTimes If True the modification time of each file is set to that of the source file.
+           @return An SFTPTransfer instance. close() should be called when finished with it."""
+        return SFTPTransfer(self,
+                            channelCount=channelCount,
+                            blockSize=blockSize,
+                            pipelineDepth=pipelineDepth,
+                            rangeThreshold=rangeThreshold,
+                            progressCallback=progressCallback,
+                            preserveTimes=preserveTimes)
+
+    def syncDir(self, localDir, remoteDir, delete=False, channelCount=SFTPTransfer.DEFAULT_CHANNEL_COUNT, progressCallback=None):
+        """@brief Make a folder on the ssh server the same as a local folder, only sending files that are new or have changed.
+           @param localDir The local folder.
+           @param remoteDir The folder on the ssh server. This is created if it does not exist.
+           @param delete If True files and folders in the remote folder that are not in the local folder are removed.
+           @param channelCount The number of files sent in parallel.
+           @param progressCallback If not None called with the arguments: source path, bytes transferred, file size.
+           @return A dict summarising the changes (see SFTPDirSync.sync())."""
+        return SFTPDirSync(self, channelCount=channelCount, progressCallback=progressCallback).sync(localDir, remoteDir, delete=delete)
+
     def getAuthKeyBackupFile(self, maxBackupFileCount=10):
         """@brief Get the name of the backup name for the authorised keys file.
            @param maxBackupFileCount The maximum number of backup files to keep.
@@ -570,31 +2206,40 @@ class SSH(object):
              backup file.
            - The backup files have the suffix .backup1, .backup2 etc.
         """
-        authKeysFile = self.getRemoteAuthorisedKeyFile()
-        authKeyBackupFilePart = "%s.backup" % (authKeysFile)
-        suffixNum = 1
-        while True:
-            authKeyBackupFileName = "%s%d" % (authKeyBackupFilePart, suffixNum)
-            rc, stdoutLines, stderrLines = self.runCmd("test -f %s" % (authKeyBackupFileName), throwError=False)
-            if rc != 0:
-                return authKeyBackupFileName
-            # If all the backup files have been created
-            if suffixNum >= maxBackupFileCount:
-                # List the files in creation order (oldest first)
-                rc, stdoutLines, stderrLines = self.runCmd("ls -ltr %s*" % (authKeyBackupFilePart), throwError=False)
-                if rc == 0:
-                    if len(stdoutLines) > 0:
-                        elems = stdoutLines[0].split()
-                        if len(elems) > 0:
-                            # Return the oldest file as the next backup filename so that we roll
-                            # around the always replacing the oldest backup file.
-                            backupfile = elems[len(elems) - 1]
-                            return backupfile
-
-                raise SSHError("Unable to %s to %s. Please manually remove the backup files on the ssh server." % (
-                authKeysFile, authKeyBackupFilePart))
-
-            suffixNum = suffixNum + 1
+        with self._sftpSession() as sftp:
+            authKeysFile = self._getRemoteAuthorisedKeyFile(sftp)
+            return self._getAuthKeyBackupFile(sftp, authKeysFile, maxBackupFileCount)
+
+    def _getAuthKeyBackupFile(self, sftp, authKeysFile, maxBackupFileCount=10):
+        """@brief Get the name of the backup name for the authorised keys file from a single
+                  listing of the folder holding it.
+           @param sftp An SFTP client or None if SFTP is not available.
+           @param authKeysFile The remote authorised keys file.
+           @param maxBackupFileCount The maximum number of backup files to keep.
+           @return The backup file."""
+        authKeysFolder, authKeysFilename = authKeysFile.rsplit("/", 1)
+        backupFilenamePart = "%s.backup" % (authKeysFilename)
+        # Get the backup files in the folder, oldest first.
+        if sftp:
+            attrList = sftp.listdir_attr(SSH._GetSFTPPath(authKeysFolder))
+            # SFTP file times are in whole seconds so files with the same time are ordered by name.
+            attrList.sort(key=lambda attr: (attr.st_mtime, len(attr.filename), attr.filename))
+            filenameList = [attr.filename for attr in attrList]
+        else:
+            rc, filenameList, stderrLines = self.runCmd("ls -1tr %s" % (authKeysFolder), throwError=True)
+
+        backupFilenameList = [filename for filename in filenameList if filename.startswith(backupFilenamePart)]
+        for suffixNum in range(1, maxBackupFileCount+1):
+            backupFilename = "%s%d" % (backupFilenamePart, suffixNum)
+            if backupFilename not in backupFilenameList:
+                return "%s/%s" % (authKeysFolder, backupFilename)
+
+        # All the backup files have been created so replace the oldest backup file.
+        if backupFilenameList:
+            return "%s/%s" % (authKeysFolder, backupFilenameList[0])
+
+        raise SSHError("Unable to %s to %s. Please manually remove the backup files on the ssh server." % (
+                       authKeysFile, backupFilenamePart))
 
     def _getPublicKeyID(self, publicKey):
         """@brief Get the public key ID string.
@@ -606,56 +2251,1047 @@ class SSH(object):
 
     def removeAuthKey(self, publicKey):
         """@brief Remove authorised keys from the server authorised keys file.
+                  The authorised keys file is read once, edited in memory and written
+                  back (after saving a backup) by renaming a temporary file.
            @param publicKeysForRemoval A list of public keys for removal."""
-        remove = False
-        previousAuthKeysFile = self.getAuthKeyBackupFile()
         publicKeyID = self._getPublicKeyID(publicKey)
         self._info("Public ssh key ID: {}".format(publicKeyID))
-        authKeysFile = self.getRemoteAuthorisedKeyFile()
-        tmpAuthKeysFile = "%s.tmp" % (authKeysFile)
-        retCode, publicKeyList, _ = self.runCmd("cat {}".format(authKeysFile), throwError=False)
-        if retCode == 0:
+        with self._sftpSession() as sftp:
+            authKeysFile = self._getRemoteAuthorisedKeyFile(sftp)
+            publicKeyList = self._readAuthKeys(sftp, authKeysFile)
             newAuthKeysList = []
-            for publicKey in publicKeyList:
-                if publicKey.find(publicKeyID) >= 0:
-                    self._info("Found {} public key on ssh server.".format(publicKeyID))
-                    remove = True
+            remove = False
+            if publicKeyList is not None:
+                for authKey in publicKeyList:
+                    if authKey.find(publicKeyID) >= 0:
+                        self._info("Found {} public key on ssh server.".format(publicKeyID))
+                        remove = True
+                    else:
+                        newAuthKeysList.append(authKey)
+
+            if remove:
+                previousAuthKeysFile = self._getAuthKeyBackupFile(sftp, authKeysFile)
+                self._writeAuthKeys(sftp, authKeysFile, newAuthKeysList, backupFile=previousAuthKeysFile, backupLines=publicKeyList)
+                self._info("Removed {} public key from the ssh server.".format(publicKeyID))
+            else:
+                self._info("{} public key not found in ssh server authorised keys file.".format(publicKeyID))
+
+        return remove
+
+class PooledSSHConnection(object):
+    """@brief Responsible for holding an ssh connection in the SSHConnectionPool. The connection is
+              checked before it is handed out and reconnected if it has been lost."""
+
+    def __init__(self, host, username, password=None, port=22, useCompression=True, uio=None,
+                 timeout=SSH.DEFAULT_SSH_CONNECTION_TIMEOUT,
+                 keepAliveSeconds=15,
+                 healthCheckSeconds=30):
+        """@brief Constructor
+           @param host The SSH hostname
+           @param username The ssh username
+           @param password The ssh password (default=None)
+           @param port The ssh port number (default = 22)
+           @param useCompression If True then use compression on the ssh session (default=True)
+           @param uio A UIO instance (default=None)
+           @param timeout The connection timeout in seconds.
+           @param keepAliveSeconds The period in seconds between ssh keepalive messages sent on an idle connection. 0 = no keepalives.
+           @param healthCheckSeconds If the connection has not been used for this many seconds a channel
+                                     is opened to check the ssh server is still responding before it is used."""
+        self._ssh                   = SSH(host, username, password=password, useCompression=useCompression, port=port, uio=uio, keepAliveSeconds=keepAliveSeconds)
+        self._uio                   = uio
+        self._timeout               = timeout
+        self._healthCheckSeconds    = healthCheckSeconds
+        self._lock                  = threading.Lock()
+        # Guards _lastUsedTime so that it can be read while _lock is held for a (re)connect.
+        self._usedLock              = threading.Lock()
+        self._sftp                  = None
+        self._refCount              = 0
+        self._lastUsedTime          = 0
+        self._connectCount          = 0
+
+    def getClient(self):
+        """@brief Get the ssh client, connecting or reconnecting if required.
+           @return An ExtendedSSHClient instance."""
+        with self._lock:
+            if not self._isHealthy():
+                self._reconnect()
+            with self._usedLock:
+                self._lastUsedTime = time()
+            return self._ssh.getSSHClient()
+
+    def getSFTP(self):
+        """@brief Get the SFTP client that is shared by all users of this connection.
+           @return An SFTPClient instance."""
+        client = self.getClient()
+        with self._lock:
+            if self._sftp is None:
+                self._sftp = SFTPClient.from_transport( client.get_transport() )
+            return self._sftp
+
+    def getLocalAddress(self):
+        """@brief Get the local IP address of the network interface used to connect to the ssh server"""
+        return self._ssh.getLocalAddress()
+
+    def getConnectCount(self):
+        """@return The number of times the ssh connection has been built."""
+        return self._connectCount
+
+    def isConnected(self):
+        """@return True if the ssh connection is active."""
+        return self._ssh.isConnected()
+
+    def addRef(self):
+        """@brief Called when the connection is handed out by the pool."""
+        self._refCount += 1
+
+    def removeRef(self):
+        """@brief Called when the connection is returned to the pool."""
+        if self._refCount > 0:
+            self._refCount -= 1
+
+    def getRefCount(self):
+        """@return The number of users of the connection."""
+        return self._refCount
+
+    def getIdleSeconds(self):
+        """@return The number of seconds since the connection was last used."""
+        with self._usedLock:
+            return time() - self._lastUsedTime
+
+    def close(self):
+        """@brief Close the ssh connection."""
+        with self._lock:
+            self._closeSFTP()
+            self._ssh.close()
+
+    def _isHealthy(self):
+        """@brief Check the ssh connection. The transport state is checked each time. If the connection
+                  has been idle for a while a channel is opened and closed to check the server is responding.
+           @return True if the connection can be used."""
+        if not self._ssh.isConnected():
+            return False
+        if self.getIdleSeconds() > self._healthCheckSeconds:
+            try:
+                chan = self._ssh.getTransport().open_session(timeout=self._timeout)
+                chan.close()
+            except Exception:
+                return False
+        return True
+
+    def _reconnect(self):
+        """@brief Build the ssh connection, closing any previous connection."""
+        if self._connectCount > 0 and self._uio:
+            self._uio.debug("Reconnecting pooled ssh connection to {}@{}:{}".format(self._ssh.getUsername(), self._ssh.getHost(), self._ssh.getPort()))
+        self._closeSFTP()
+        self._ssh.close()
+        # The SSH instance sets the keepalive interval on the new connection.
+        self._ssh.connectOrAcquire(timeout=self._timeout)
+        self._connectCount += 1
+
+    def _closeSFTP(self):
+        """@brief Close the shared SFTP client if open."""
+        if self._sftp:
+            try:
+                self._sftp.close()
+            except Exception:
+                pass
+            self._sftp = None
+
+class SSHConnectionPool(object):
+    """@brief Responsible for sharing ssh connections keyed by (host, port, username) so that
+              the cost of building an ssh connection (TCP connect, key exchange and trying each
+              private key) is only paid once. Many command channels and a single SFTP client can
+              share each connection.
+              Connections that are not in use are closed, once idle for idleCloseSeconds, by a
+              background thread and by acquire(). The health of a connection is checked when it
+              is handed out (see PooledSSHConnection.getClient()) not in the background. Idle
+              connections are kept alive by ssh keepalive messages."""
+
+    DEFAULT_KEEPALIVE_SECONDS       = 15
+    DEFAULT_HEALTH_CHECK_SECONDS    = 30
+    DEFAULT_IDLE_CLOSE_SECONDS      = 300
+    DEFAULT_REAP_SECONDS            = 60
+
+    _DefaultPool                    = None
+    _DefaultPoolLock                = threading.Lock()
+
+    @staticmethod
+    def GetDefault():
+        """@brief Get the process wide connection pool, creating it if required.
+           @return An SSHConnectionPool instance."""
+        with SSHConnectionPool._DefaultPoolLock:
+            if SSHConnectionPool._DefaultPool is None:
+                SSHConnectionPool._DefaultPool = SSHConnectionPool()
+                atexit.register(SSHConnectionPool._DefaultPool.closeAll)
+            return SSHConnectionPool._DefaultPool
+
+    def __init__(self, keepAliveSeconds=DEFAULT_KEEPALIVE_SECONDS, healthCheckSeconds=DEFAULT_HEALTH_CHECK_SECONDS, idleCloseSeconds=DEFAULT_IDLE_CLOSE_SECONDS,
+                 reapSeconds=DEFAULT_REAP_SECONDS):
+        """@brief Constructor
+           @param keepAliveSeconds The period in seconds between ssh keepalive messages sent on idle connections. 0 = no keepalives.
+           @param healthCheckSeconds Connections idle for longer than this are checked before they are handed out.
+           @param idleCloseSeconds Connections that are not in use and have been idle for longer than this are closed.
+           @param reapSeconds The period in seconds at which a background thread closes idle connections.
+                              The thread runs while the pool holds connections. 0 = idle connections are
+                              only closed by acquire() and closeIdle()."""
+        self._keepAliveSeconds      = keepAliveSeconds
+        self._healthCheckSeconds    = healthCheckSeconds
+        self._idleCloseSeconds      = idleCloseSeconds
+        self._reapSeconds           = reapSeconds
+        self._lock                  = threading.Lock()
+        self._connectionDict        = {}
+        self._reaperThread          = None
+        self._reaperStopEvent       = None
+
+    def acquire(self, host, username, password=None, port=22, useCompression=True, uio=None, timeout=SSH.DEFAULT_SSH_CONNECTION_TIMEOUT):
+        """@brief Get a connected ssh connection. release() must be called when the caller has finished with it.
+                  The password, useCompression and uio arguments are only used when a connection to the
+                  host, port and username is first built.
+           @param host The SSH hostname
+           @param username The ssh username
+           @param password The ssh password (default=None)
+           @param port The ssh port number (default = 22)
+           @param useCompression If True then use compression on the ssh session (default=True)
+           @param uio A UIO instance (default=None)
+           @param timeout The connection timeout in seconds.
+           @return A PooledSSHConnection instance."""
+        key = (host, port, username)
+        with self._lock:
+            self._closeIdle()
+            pooledConnection = self._connectionDict.get(key)
+            if pooledConnection is None:
+                pooledConnection = PooledSSHConnection(host,
+                                                       username,
+                                                       password=password,
+                                                       port=port,
+                                                       useCompression=useCompression,
+                                                       uio=uio,
+                                                       timeout=timeout,
+                                                       keepAliveSeconds=self._keepAliveSeconds,
+                                                       healthCheckSeconds=self._healthCheckSeconds)
+                self._connectionDict[key] = pooledConnection
+            pooledConnection.addRef()
+            self._startReaper()
+
+        # Connect outside the pool lock so that connections to other hosts are not held up.
+        try:
+            pooledConnection.getClient()
+        except:
+            self.release(pooledConnection)
+            raise
+        return pooledConnection
+
+    def release(self, pooledConnection):
+        """@brief Return a connection to the pool. The connection is left open for reuse.
+           @param pooledConnection The PooledSSHConnection instance returned by acquire()."""
+        with self._lock:
+            pooledConnection.removeRef()
+
+    def getConnectionCount(self):
+        """@return The number of connections held in the pool."""
+        with self._lock:
+            return len(self._connectionDict)
+
+    def closeIdle(self):
+        """@brief Close connections that are not in use and have been idle for longer than idleCloseSeconds."""
+        with self._lock:
+            self._closeIdle()
+
+    def closeAll(self):
+        """@brief Close all the connections in the pool."""
+        with self._lock:
+            self._stopReaper()
+            pooledConnectionList = list(self._connectionDict.values())
+            self._connectionDict = {}
+        for pooledConnection in pooledConnectionList:
+            pooledConnection.close()
+
+    def _closeIdle(self):
+        """@brief Close idle connections. The pool lock must be held by the caller."""
+        for key, pooledConnection in list(self._connectionDict.items()):
+            if pooledConnection.getRefCount() == 0 and pooledConnection.getIdleSeconds() > self._idleCloseSeconds:
+                pooledConnection.close()
+                del self._connectionDict[key]
+
+    def _startReaper(self):
+        """@brief Start the thread that closes idle connections if not running. The pool lock must be held by the caller."""
+        if self._reapSeconds <= 0 or self._reaperThread:
+            return
+        self._reaperStopEvent = threading.Event()
+        self._reaperThread = threading.Thread(target=self._reapIdle, args=(self._reaperStopEvent,), daemon=True)
+        self._reaperThread.start()
+
+    def _stopReaper(self):
+        """@brief Stop the thread that closes idle connections. The pool lock must be held by the caller."""
+        if self._reaperStopEvent:
+            self._reaperStopEvent.set()
+        self._reaperThread = None
+        self._reaperStopEvent = None
+
+    def _reapIdle(self, stopEvent):
+        """@brief Close idle connections periodically. The thread exits when the pool is empty.
+           @param stopEvent Set to stop the thread."""
+        while not stopEvent.wait(self._reapSeconds):
+            with self._lock:
+                if stopEvent.is_set():
+                    return
+                self._closeIdle()
+                if not self._connectionDict:
+                    self._stopReaper()
+                    return
+
+class SSHFleetResult(object):
+    """@brief Holds the result of running a command on one host of an SSHFleet."""
+
+    def __init__(self, host, cmd):
+        """@brief Constructor
+           @param host The ssh server address.
+           @param cmd The command executed on the host."""
+        self.host               = host
+        self.cmd                = cmd
+        self.exitStatus         = None
+        self.stdoutLines        = []
+        self.stderrLines        = []
+        self.durationSeconds    = 0.0
+        self.error              = None  # The reason the command could not be executed (E.G connection failed or timeout).
+
+    def isSuccess(self):
+        """@return True if the command executed and returned an exit status of 0."""
+        return self.error is None and self.exitStatus == 0
+
+    def __str__(self):
+        """@return A one line summary of the result."""
+        if self.error:
+            return "{}: ERROR: {} ({:.3f} seconds)".format(self.host, self.error, self.durationSeconds)
+        return "{}: exit status {} ({:.3f} seconds)".format(self.host, self.exitStatus, self.durationSeconds)
+
+class SSHFleet(object):
+    """@brief Responsible for running commands on many ssh servers in parallel using a bounded pool of threads."""
+
+    DEFAULT_MAX_WORKERS     = 32
+
+    @staticmethod
+    def GetSummary(resultList):
+        """@brief Get a summary of the results of running a command on a fleet of hosts.
+           @param resultList A list of SSHFleetResult instances.
+           @return A dict containing
+                   hostCount       The number of hosts.
+                   successCount    The number of hosts on which the command returned an exit status of 0.
+                   failureCount    The number of hosts on which the command returned a non zero exit status.
+                   errorCount      The number of hosts on which the command could not be executed.
+                   exitStatusDict  A dict of the number of hosts that returned each exit status.
+                   maxSeconds      The longest time taken by a host.
+                   failedHostList  The hosts that did not return an exit status of 0."""
+        summary = {"hostCount":       len(resultList),
+                   "successCount":    0,
+                   "failureCount":    0,
+                   "errorCount":      0,
+                   "exitStatusDict":  {},
+                   "maxSeconds":      0.0,
+                   "failedHostList":  []}
+        for result in resultList:
+            if result.error:
+                summary["errorCount"] += 1
+            else:
+                summary["exitStatusDict"][result.exitStatus] = summary["exitStatusDict"].get(result.exitStatus, 0) + 1
+                if result.exitStatus == 0:
+                    summary["successCount"] += 1
                 else:
-                    newAuthKeysList.append(publicKey)
+                    summary["failureCount"] += 1
+            if not result.isSuccess():
+                summary["failedHostList"].append(result.host)
+            summary["maxSeconds"] = max(summary["maxSeconds"], result.durationSeconds)
+        return summary
+
+    def __init__(self, hostList, username, password=None, port=22, uio=None, maxWorkers=DEFAULT_MAX_WORKERS,
+                 connectTimeout=SSH.DEFAULT_SSH_CONNECTION_TIMEOUT, useCompression=True, usePool=False):
+        """@brief Constructor
+           @param hostList A list of ssh server addresses.
+           @param username The ssh username.
+           @param password The ssh password (default=None).
+           @param port The ssh port number (default = 22).
+           @param uio A UIO instance (default=None).
+           @param maxWorkers The maximum number of hosts that commands are run on at the same time.
+           @param connectTimeout The ssh connection timeout in seconds.
+           @param useCompression If True then use compression on the ssh sessions (default=True).
+           @param usePool If True then connections are taken from and returned to the SSHConnectionPool
+                          so that they are reused by later commands (default=False)."""
+        self._hostList          = list(hostList)
+        # Results are identified by host as every host uses the same port and username.
+        hostSet = set()
+        for host in self._hostList:
+            if host in hostSet:
+                raise SSHError("{} is in the host list more than once.".format(host))
+            hostSet.add(host)
+        self._username          = username
+        self._password          = password
+        self._port              = port
+        self._uio               = uio
+        self._maxWorkers        = maxWorkers
+        self._connectTimeout    = connectTimeout
+        self._useCompression    = useCompression
+        self._usePool           = usePool
+
+    def getHostList(self):
+        """@return The list of hosts in the fleet."""
+        return self._hostList
+
+    def runCmd(self, cmd, timeout=None):
+        """@brief Run a command on every host in the fleet. This is a generator that yields the result
+                  from each host as soon as it completes so results are not held up by slow hosts.
+           @param cmd The command to run on every host or a dict of host: command. If a dict is
+                      passed then hosts that are not in the dict are skipped.
+           @param timeout The maximum time in seconds allowed for each host to connect and run the
+                          command or None (default) if no timeout is required.
+           @return A generator of SSHFleetResult instances in the order they complete."""
+        if isinstance(cmd, dict):
+            hostCmdList = [(host, cmd[host]) for host in self._hostList if host in cmd]
+        else:
+            hostCmdList = [(host, cmd) for host in self._hostList]
+
+        if not hostCmdList:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=min(self._maxWorkers, len(hostCmdList)))
+        try:
+            futureList = [executor.submit(self._runHostCmd, host, hostCmd, timeout) for host, hostCmd in hostCmdList]
+            for future in as_completed(futureList):
+                yield future.result()
+        finally:
+            # If the caller stops reading results, hosts that have not been started are skipped.
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def runCmdAll(self, cmd, timeout=None):
+        """@brief Run a command on every host in the fleet and wait for all hosts to complete.
+           @param cmd The command to run on every host or a dict of host: command.
+           @param timeout The maximum time in seconds allowed for each host or None (default) if no timeout is required.
+           @return A list of SSHFleetResult instances in the same order as the host list."""
+        resultDict = {result.host: result for result in self.runCmd(cmd, timeout=timeout)}
+        return [resultDict[host] for host in self._hostList if host in resultDict]
+
+    def showSummary(self, resultList):
+        """@brief Show a table of the results and a summary to the user.
+           @param resultList A list of SSHFleetResult instances."""
+        if not self._uio:
+            return
+        table = [["Host", "Exit Status", "Seconds", "Error"]]
+        for result in resultList:
+            exitStatus = "" if result.exitStatus is None else str(result.exitStatus)
+            error = result.error if result.error else ""
+            table.append([str(result.host), exitStatus, "{:.3f}".format(result.durationSeconds), error])
+        self._uio.showTable(table)
+        summary = SSHFleet.GetSummary(resultList)
+        self._uio.info("{} hosts: {} succeeded, {} failed, {} errors. Slowest host took {:.3f} seconds.".format(summary["hostCount"],
+                                                                                                             summary["successCount"],
+                                                                                                             summary["failureCount"],
+                                                                                                             summary["errorCount"],
+                                                                                                             summary["maxSeconds"]))
+
+    def _runHostCmd(self, host, cmd, timeout):
+        """@brief Connect to a host and run a command on it. Called from a worker thread.
+           @param host The ssh server address.
+           @param cmd The command to run.
+           @param timeout The maximum time in seconds allowed or None.
+           @return An SSHFleetResult instance."""
+        result = SSHFleetResult(host, cmd)
+        startTime = time()
+        deadline = None if timeout is None else startTime + timeout
+        connectTimeout = self._connectTimeout if timeout is None else min(self._connectTimeout, timeout)
+        ssh = SSH(host, self._username, password=self._password, port=self._port, useCompression=self._useCompression, uio=self._uio, usePool=self._usePool)
+        try:
+            ssh.connectOrAcquire(timeout=connectTimeout)
+            chan = ssh.startCmd(cmd)
+            try:
+                result.exitStatus, stdoutBytes, stderrBytes = ExtendedSSHClient.ReadChannel(chan, deadline)
+            finally:
+                chan.close()
+            result.stdoutLines = ExtendedSSHClient.GetLines(stdoutBytes)
+            result.stderrLines = ExtendedSSHClient.GetLines(stderrBytes)
+
+        except Exception as ex:
+            result.error = str(ex) if str(ex) else ex.__class__.__name__
+
+        finally:
+            ssh.close()
+            result.durationSeconds = time() - startTime
+        return result
+
+class AsyncSSH(object):
+    """@brief An asyncio interface to an SSH connection. The blocking paramiko calls are made in
+              a thread pool so that the event loop of a NiceGUI or Bokeh app is not blocked while
+              they execute. Many operations (on one or many AsyncSSH instances) may be awaited
+              concurrently. E.G
+
+              async with AsyncSSH(host, username) as ssh:
+                  rc, stdoutLines, stderrLines = await ssh.run("uptime")
+                  await ssh.get("/var/log/syslog", "syslog")
+
+              Cancelling an awaiting task does not stop an ssh operation that has already
+              started in the thread pool."""
+
+    DEFAULT_MAX_WORKERS     = 32
+
+    _DefaultExecutor        = None
+    _DefaultExecutorLock    = threading.Lock()
+
+    @staticmethod
+    def GetDefaultExecutor():
+        """@brief Get the process wide thread pool used by AsyncSSH instances that were not given one.
+                  It is shut down when the process exits.
+           @return A ThreadPoolExecutor instance."""
+        with AsyncSSH._DefaultExecutorLock:
+            if AsyncSSH._DefaultExecutor is None:
+                AsyncSSH._DefaultExecutor = ThreadPoolExecutor(max_workers=AsyncSSH.DEFAULT_MAX_WORKERS, thread_name_prefix="p3lib_async_ssh")
+                atexit.register(AsyncSSH._DefaultExecutor.shutdown, wait=False, cancel_futures=True)
+            return AsyncSSH._DefaultExecutor
+
+    def __init__(self, host, username, password=None, useCompression=True, port=22, uio=None, privateKeyFile=None, usePool=False, executor=None):
+        """@brief Constructor
+           @param host The SSH hostname
+           @param username The ssh username
+           @param password The ssh password (default=None)
+           @param useCompression If True then use compression on the ssh session (default=True).
+                                 If SSH.ADAPTIVE then compression and the cipher are chosen from the
+                                 speed of the link to the host and the CPU cost of compression and
+                                 encryption. See SSH.getSessionStats().
+           @param port The ssh port number (default = 22)
+           @param uio A UIO instance (default=None)
+           @param privateKeyFile The private ssh keyfile (default=None=Use default private keyfile)
+           @param usePool If True the connection is taken from the SSHConnectionPool (default=False).
+           @param executor The concurrent.futures executor that the ssh operations run in. If None
+                           (default) the executor returned by GetDefaultExecutor() is used."""
+        self._ssh = SSH(host,
+                        username,
+                        password=password,
+                        useCompression=useCompression,
+                        port=port,
+                        uio=uio,
+                        privateKeyFile=privateKeyFile,
+                        usePool=usePool)
+        self._executor = executor
+        if self._executor is None:
+            self._executor = AsyncSSH.GetDefaultExecutor()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, excType, excValue, tb):
+        await self.close()
+        return False
+
+    def getSSH(self):
+        """@return The SSH instance that this instance wraps. Its methods block the calling thread."""
+        return self._ssh
 
-        if remove:
-            # Remove any pre existing tmp auth keys file
-            self.runCmd("rm -f %s" % (tmpAuthKeysFile), throwError=False)
+    async def _call(self, method, *args, **kwargs):
+        """@brief Call a blocking method in the executor.
+           @param method The method to call.
+           @return The value returned by the method."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
 
-            # Create empty tmp auth keys file
-            self.runCmd("touch %s" % (tmpAuthKeysFile))
+    async def connect(self, enableAutoLoginSetup=False, timeout=SSH.DEFAULT_SSH_CONNECTION_TIMEOUT):
+        """@brief Connect the ssh connection.
+           @param enableAutoLoginSetup See SSH.connect().
+           @param timeout The connection timeout in seconds.
+           @return See SSH.connect()."""
+        return await self._call(self._ssh.connect, enableAutoLoginSetup=enableAutoLoginSetup, timeout=timeout)
+
+    async def close(self):
+        """@brief Close the ssh connection."""
+        await self._call(self._ssh.close)
 
-            for newAuthKey in newAuthKeysList:
-                self.runCmd("echo \"%s\" >> %s" % (newAuthKey, tmpAuthKeysFile), throwError=False)
+    def isConnected(self):
+        """@return True if connected."""
+        return self._ssh.isConnected()
+
+    async def run(self, cmd, throwError=True, timeout=None):
+        """@brief Run a command over the ssh connection.
+           @param cmd The command to execute.
+           @param throwError If True and the exit status of the command is not 0 then an SSHError is thrown.
+           @param timeout The timeout value in seconds or None (default) if no command timeout is required.
+           @return See SSH.runCmd()."""
+        return await self._call(self._ssh.runCmd, cmd, throwError=throwError, timeout=timeout)
+
+    async def runBatch(self, cmdList, throwError=True, timeout=None):
+        """@brief Run a list of commands in a single remote shell session.
+           @param cmdList A list of the commands to execute.
+           @param throwError If True and a command fails an SSHError is thrown.
+           @param timeout The maximum time in seconds for all the commands or None (default).
+           @return See SSH.runBatch()."""
+        return await self._call(self._ssh.runBatch, cmdList, throwError=throwError, timeout=timeout)
+
+    async def get(self, remoteFilePath, localFilePath, resume=False, channelCount=SFTPTransfer.DEFAULT_CHANNEL_COUNT, progressCallback=None):
+        """@brief Get a file from the ssh server. Each call uses its own SFTP channels so several
+                  files may be transferred at the same time.
+           @param remoteFilePath The remote file on the ssh server.
+           @param localFilePath The path of the file after it's been received.
+           @param resume If True an interrupted transfer of the file is resumed.
+           @param channelCount The maximum number of SFTP channels used for the file.
+           @param progressCallback If not None called (from an executor thread) with the arguments:
+                                   source path, bytes transferred, file size."""
+        await self._call(self._transfer, True, remoteFilePath, localFilePath, resume, channelCount, progressCallback)
+
+    async def put(self, localFilePath, remoteFilePath, resume=False, channelCount=SFTPTransfer.DEFAULT_CHANNEL_COUNT, progressCallback=None):
+        """@brief Put a file on the ssh server. Each call uses its own SFTP channels so several
+                  files may be transferred at the same time.
+           @param localFilePath The local file to send.
+           @param remoteFilePath The remote file on the ssh server.
+           @param resume If True an interrupted transfer of the file is resumed.
+           @param channelCount The maximum number of SFTP channels used for the file.
+           @param progressCallback If not None called (from an executor thread) with the arguments:
+                                   source path, bytes transferred, file size."""
+        await self._call(self._transfer, False, localFilePath, remoteFilePath, resume, channelCount, progressCallback)
+
+    async def syncDir(self, localDir, remoteDir, delete=False, channelCount=SFTPTransfer.DEFAULT_CHANNEL_COUNT, progressCallback=None):
+        """@brief Make a folder on the ssh server the same as a local folder, only sending files that are new or have changed.
+           @param localDir The local folder.
+           @param remoteDir The folder on the ssh server.
+           @param delete If True files and folders in the remote folder that are not in the local folder are removed.
+           @param channelCount The number of files sent in parallel.
+           @param progressCallback If not None called (from an executor thread) with the arguments:
+                                   source path, bytes transferred, file size.
+           @return See SSH.syncDir()."""
+        return await self._call(self._ssh.syncDir, localDir, remoteDir, delete=delete, channelCount=channelCount, progressCallback=progressCallback)
+
+    def _transfer(self, download, srcPath, destPath, resume, channelCount, progressCallback):
+        """@brief Transfer a file. Called in an executor thread.
+           @param download True to get a file from the ssh server, False to put a file on it."""
+        with self._ssh.getSFTPTransfer(channelCount=channelCount, progressCallback=progressCallback) as sftpTransfer:
+            if download:
+                sftpTransfer.get(srcPath, destPath, resume=resume)
+            else:
+                sftpTransfer.put(srcPath, destPath, resume=resume)
 
-            # Remove any pre existing previous auth keys file
-            self.runCmd("rm -f %s" % (previousAuthKeysFile), throwError=False)
+class TunnelConnection(object):
+    """@brief Holds the state of a TCP connection forwarded over an ssh channel."""
 
-            # Move the current auth keys file to the old one and the tmp to the current one
-            self.runCmd("mv %s %s" % (authKeysFile, previousAuthKeysFile))
-            self.runCmd("mv %s %s" % (tmpAuthKeysFile, authKeysFile))
-            self._info("Removed {} public key from the ssh server.".format(publicKeyID))
+    def __init__(self, sock, chan, name, closeCallback=None, tunnelStats=None):
+        """@brief Constructor
+           @param sock The TCP socket at this end of the tunnel.
+           @param chan The ssh channel to the other end of the tunnel.
+           @param name A name for the connection used in messages.
+           @param closeCallback If not None this is called with this TunnelConnection instance when the connection closes.
+           @param tunnelStats If not None the TunnelStats instance of the tunnel that this connection belongs to."""
+        self.sock           = sock
+        self.chan           = chan
+        self.name           = name
+        self.closeCallback  = closeCallback
+        self.tunnelStats    = tunnelStats
+        self.toChanBuffer   = bytearray()   # Data read from the socket waiting to be sent on the channel.
+        self.toSockBuffer   = bytearray()   # Data read from the channel waiting to be sent on the socket.
+        self.sockEOF        = False
+        self.chanEOF        = False
+        self.sockShutdown   = False
+        self.chanShutdown   = False
+        self.closed         = False
+        self.sockMask       = 0
+        self.chanMask       = 0
+        self.tunnelLoop     = None
+
+class TunnelStats(object):
+    """@brief Responsible for holding the counters of a forward or reverse ssh tunnel. The
+              counters are updated from the threads that open and forward tunnel connections."""
+
+    FORWARD = "forward"
+    REVERSE = "reverse"
+
+    def __init__(self, direction, serverPort, destHost, destPort):
+        """@brief Constructor
+           @param direction TunnelStats.FORWARD or TunnelStats.REVERSE.
+           @param serverPort The TCP server port of the tunnel.
+           @param destHost The host address of the tunnel destination.
+           @param destPort The TCP port of the tunnel destination."""
+        self._direction             = direction
+        self._serverPort            = serverPort
+        self._destHost              = destHost
+        self._destPort              = destPort
+        self._lock                  = threading.Lock()
+        self._connectionCount       = 0
+        self._activeConnectionCount = 0
+        self._openFailureCount      = 0
+        self._bytesToRemote         = 0
+        self._bytesFromRemote       = 0
+        self._setupSecondsTotal     = 0.0
+        self._setupSecondsMax       = 0.0
+
+    def connectionOpened(self, setupSeconds):
+        """@brief Record a connection that has been opened.
+           @param setupSeconds The time taken to open the ssh channel (forward tunnels) or to
+                               connect to the destination (reverse tunnels)."""
+        with self._lock:
+            self._connectionCount += 1
+            self._activeConnectionCount += 1
+            self._setupSecondsTotal += setupSeconds
+            self._setupSecondsMax = max(self._setupSecondsMax, setupSeconds)
+
+    def connectionClosed(self):
+        """@brief Record a connection that has closed."""
+        with self._lock:
+            self._activeConnectionCount -= 1
+
+    def openFailed(self):
+        """@brief Record a connection that could not be opened."""
+        with self._lock:
+            self._openFailureCount += 1
+
+    def addBytes(self, toRemoteBytes, fromRemoteBytes):
+        """@brief Add to the byte counters.
+           @param toRemoteBytes The number of bytes sent to the remote end of the ssh connection.
+           @param fromRemoteBytes The number of bytes received from the remote end of the ssh connection."""
+        with self._lock:
+            self._bytesToRemote += toRemoteBytes
+            self._bytesFromRemote += fromRemoteBytes
+
+    def getStats(self):
+        """@return A dict of the tunnel counters."""
+        with self._lock:
+            setupSecondsAvg = 0.0
+            if self._connectionCount > 0:
+                setupSecondsAvg = self._setupSecondsTotal/self._connectionCount
+            return {"direction":                self._direction,
+                    "serverPort":               self._serverPort,
+                    "destHost":                 self._destHost,
+                    "destPort":                 self._destPort,
+                    "connectionCount":          self._connectionCount,
+                    "activeConnectionCount":    self._activeConnectionCount,
+                    "openFailureCount":         self._openFailureCount,
+                    "bytesToRemote":            self._bytesToRemote,
+                    "bytesFromRemote":          self._bytesFromRemote,
+                    "setupSecondsAvg":          setupSecondsAvg,
+                    "setupSecondsMax":          self._setupSecondsMax}
+
+class TunnelLoop(object):
+    """@brief Responsible for moving data between the sockets and ssh channels of many tunnel
+              connections in a single thread using a selector. Data read from one end of a
+              connection is buffered until all of it has been written to the other end. Reading
+              stops while the buffer is full so that a slow reader holds up the sender rather
+              than data being lost or memory use growing."""
+
+    SOCK                    = 1
+    CHAN                    = 2
+    CHANNEL_RETRY_SECONDS   = 0.01  # ssh channels cannot signal when they can be written to so they are polled.
+
+    def __init__(self, readSize, maxBufferedBytes, socketBufferSize=None):
+        """@brief Constructor
+           @param readSize The maximum number of bytes read from a socket or channel at a time.
+           @param maxBufferedBytes The maximum number of bytes buffered in each direction of a connection.
+           @param socketBufferSize If not None the size of the kernel send and receive buffers of each socket."""
+        self._readSize          = readSize
+        self._maxBufferedBytes  = maxBufferedBytes
+        self._socketBufferSize  = socketBufferSize
+        self._selector          = selectors.DefaultSelector()
+        self._wakeReadSock, self._wakeWriteSock = socket.socketpair()
+        self._wakeReadSock.setblocking(False)
+        self._wakeWriteSock.setblocking(False)
+        self._selector.register(self._wakeReadSock, selectors.EVENT_READ, None)
+        self._lock              = threading.Lock()
+        self._addList           = []
+        self._closeList         = []
+        self._connectionSet     = set()
+        self._running           = True
+        self._thread            = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, tunnelConnection):
+        """@brief Add a connection. This may be called from any thread.
+           @param tunnelConnection The TunnelConnection instance."""
+        with self._lock:
+            self._addList.append(tunnelConnection)
+        self._wake()
+
+    def close(self, tunnelConnection):
+        """@brief Close a connection. This may be called from any thread.
+           @param tunnelConnection The TunnelConnection instance."""
+        with self._lock:
+            self._closeList.append(tunnelConnection)
+        self._wake()
+
+    def getConnectionCount(self):
+        """@return The number of connections handled by this loop."""
+        with self._lock:
+            return len(self._connectionSet) + len(self._addList)
+
+    def stop(self):
+        """@brief Close all connections and stop the loop thread."""
+        self._running = False
+        self._wake()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _wake(self):
+        """@brief Wake the loop thread so that it handles added or closed connections."""
+        try:
+            self._wakeWriteSock.send(b'\0')
+        except (BlockingIOError, OSError):
+            # The loop is already due to wake up or has stopped.
+            pass
+
+    def _run(self):
+        """@brief The loop thread."""
+        try:
+            while self._running:
+                pendingChanWrite = any(tunnelConnection.toChanBuffer for tunnelConnection in self._connectionSet)
+                eventList = self._selector.select(TunnelLoop.CHANNEL_RETRY_SECONDS if pendingChanWrite else None)
+                touchedSet = set()
+                for key, mask in eventList:
+                    if key.data is None:
+                        self._handleWake()
+                        continue
+                    tunnelConnection, end = key.data
+                    if tunnelConnection.closed:
+                        # Closed while handling an earlier event.
+                        continue
+                    touchedSet.add(tunnelConnection)
+                    if end == TunnelLoop.SOCK:
+                        if mask & selectors.EVENT_WRITE:
+                            self._flushToSock(tunnelConnection)
+                        if mask & selectors.EVENT_READ:
+                            self._readSock(tunnelConnection)
+                    else:
+                        self._readChan(tunnelConnection)
+
+                # Retry channel writes that were held up by the ssh flow control window.
+                if pendingChanWrite:
+                    # _flushToChan() removes the connection from the set if it is closed.
+                    for tunnelConnection in list(self._connectionSet):
+                        if tunnelConnection.toChanBuffer and not tunnelConnection.closed:
+                            self._flushToChan(tunnelConnection)
+                            touchedSet.add(tunnelConnection)
+
+                for tunnelConnection in touchedSet:
+                    self._update(tunnelConnection)
+        finally:
+            for tunnelConnection in list(self._connectionSet):
+                self._close(tunnelConnection)
+            self._selector.close()
+            self._wakeReadSock.close()
+            self._wakeWriteSock.close()
+
+    def _handleWake(self):
+        """@brief Add and close connections as requested by other threads."""
+        try:
+            while self._wakeReadSock.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            addList, self._addList = self._addList, []
+            closeList, self._closeList = self._closeList, []
+        for tunnelConnection in addList:
+            self._start(tunnelConnection)
+        for tunnelConnection in closeList:
+            self._close(tunnelConnection)
+
+    def _start(self, tunnelConnection):
+        """@brief Start moving data for a connection."""
+        tunnelConnection.sock.setblocking(False)
+        if self._socketBufferSize:
+            tunnelConnection.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._socketBufferSize)
+            tunnelConnection.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._socketBufferSize)
+        tunnelConnection.chan.settimeout(0.0)
+        self._connectionSet.add(tunnelConnection)
+        self._update(tunnelConnection)
+
+    def _readSock(self, tunnelConnection):
+        """@brief Read data from the socket and send it on the channel."""
+        try:
+            data = tunnelConnection.sock.recv(self._readSize)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._close(tunnelConnection)
+            return
+        if data:
+            tunnelConnection.toChanBuffer += data
         else:
-            self._info("{} public key not found in ssh server authorised keys file.".format(publicKeyID))
+            tunnelConnection.sockEOF = True
+        self._flushToChan(tunnelConnection)
 
-        return remove
+    def _readChan(self, tunnelConnection):
+        """@brief Read data from the channel and send it on the socket."""
+        try:
+            data = tunnelConnection.chan.recv(self._readSize)
+        except socket.timeout:
+            return
+        except Exception:
+            self._close(tunnelConnection)
+            return
+        if data:
+            tunnelConnection.toSockBuffer += data
+            if tunnelConnection.tunnelStats:
+                tunnelConnection.tunnelStats.addBytes(0, len(data))
+        else:
+            tunnelConnection.chanEOF = True
+        self._flushToSock(tunnelConnection)
+
+    def _flushToChan(self, tunnelConnection):
+        """@brief Send as much buffered data on the channel as its flow control window allows."""
+        chan = tunnelConnection.chan
+        try:
+            while tunnelConnection.toChanBuffer and chan.send_ready():
+                sentBytes = chan.send(bytes(tunnelConnection.toChanBuffer[:self._readSize]))
+                if sentBytes <= 0:
+                    break
+                del tunnelConnection.toChanBuffer[:sentBytes]
+                if tunnelConnection.tunnelStats:
+                    tunnelConnection.tunnelStats.addBytes(sentBytes, 0)
+            if tunnelConnection.sockEOF and not tunnelConnection.toChanBuffer and not tunnelConnection.chanShutdown:
+                chan.shutdown_write()
+                tunnelConnection.chanShutdown = True
+        except socket.timeout:
+            pass
+        except Exception:
+            self._close(tunnelConnection)
+
+    def _flushToSock(self, tunnelConnection):
+        """@brief Send as much buffered data on the socket as it will accept without blocking."""
+        sock = tunnelConnection.sock
+        try:
+            if tunnelConnection.toSockBuffer:
+                sentBytes = sock.send(tunnelConnection.toSockBuffer)
+                del tunnelConnection.toSockBuffer[:sentBytes]
+            if tunnelConnection.chanEOF and not tunnelConnection.toSockBuffer and not tunnelConnection.sockShutdown:
+                sock.shutdown(socket.SHUT_WR)
+                tunnelConnection.sockShutdown = True
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close(tunnelConnection)
+
+    def _update(self, tunnelConnection):
+        """@brief Close a connection once both ends have finished or update the events the selector waits for."""
+        if tunnelConnection.closed:
+            return
+        if tunnelConnection.sockShutdown and tunnelConnection.chanShutdown:
+            self._close(tunnelConnection)
+            return
+
+        sockMask = 0
+        if not tunnelConnection.sockEOF and len(tunnelConnection.toChanBuffer) < self._maxBufferedBytes:
+            sockMask |= selectors.EVENT_READ
+        if tunnelConnection.toSockBuffer:
+            sockMask |= selectors.EVENT_WRITE
+        chanMask = 0
+        if not tunnelConnection.chanEOF and len(tunnelConnection.toSockBuffer) < self._maxBufferedBytes:
+            chanMask |= selectors.EVENT_READ
+
+        tunnelConnection.sockMask = self._register(tunnelConnection.sock, tunnelConnection.sockMask, sockMask, (tunnelConnection, TunnelLoop.SOCK))
+        tunnelConnection.chanMask = self._register(tunnelConnection.chan, tunnelConnection.chanMask, chanMask, (tunnelConnection, TunnelLoop.CHAN))
+
+    def _register(self, fileObj, currentMask, mask, data):
+        """@brief Update the events the selector waits for on a socket or channel.
+           @return The new event mask."""
+        if mask != currentMask:
+            if currentMask == 0:
+                self._selector.register(fileObj, mask, data)
+            elif mask == 0:
+                self._selector.unregister(fileObj)
+            else:
+                self._selector.modify(fileObj, mask, data)
+        return mask
+
+    def _close(self, tunnelConnection):
+        """@brief Close both ends of a connection."""
+        if tunnelConnection.closed:
+            return
+        tunnelConnection.closed = True
+        for fileObj, mask in ((tunnelConnection.sock, tunnelConnection.sockMask), (tunnelConnection.chan, tunnelConnection.chanMask)):
+            if mask:
+                try:
+                    self._selector.unregister(fileObj)
+                except (KeyError, ValueError):
+                    pass
+            try:
+                fileObj.close()
+            except Exception:
+                pass
+        self._connectionSet.discard(tunnelConnection)
+        if tunnelConnection.tunnelStats:
+            tunnelConnection.tunnelStats.connectionClosed()
+        if tunnelConnection.closeCallback:
+            tunnelConnection.closeCallback(tunnelConnection)
+
+class TunnelEngine(object):
+    """@brief Responsible for forwarding the data of many tunnel connections using a small
+              number of TunnelLoop threads rather than a thread for each connection."""
+
+    DEFAULT_LOOP_COUNT          = 1
+    DEFAULT_READ_SIZE           = 65536
+    DEFAULT_MAX_BUFFERED_BYTES  = 1024*1024
+
+    _DefaultEngine              = None
+    _DefaultEngineLock          = threading.Lock()
+
+    @staticmethod
+    def GetDefault():
+        """@brief Get the process wide tunnel engine used by ForwardingHandler instances that were not given one.
+           @return A TunnelEngine instance."""
+        with TunnelEngine._DefaultEngineLock:
+            if TunnelEngine._DefaultEngine is None:
+                TunnelEngine._DefaultEngine = TunnelEngine()
+            return TunnelEngine._DefaultEngine
+
+    def __init__(self, loopCount=DEFAULT_LOOP_COUNT, readSize=DEFAULT_READ_SIZE, maxBufferedBytes=DEFAULT_MAX_BUFFERED_BYTES, socketBufferSize=None):
+        """@brief Constructor
+           @param loopCount The number of TunnelLoop threads. Connections are shared between them.
+           @param readSize The maximum number of bytes read from a socket or channel at a time.
+           @param maxBufferedBytes The maximum number of bytes buffered in each direction of a connection.
+           @param socketBufferSize If not None the size of the kernel send and receive buffers of each socket."""
+        self._loopList = [TunnelLoop(readSize, maxBufferedBytes, socketBufferSize=socketBufferSize) for _ in range(max(1, loopCount))]
+        self._lock = threading.Lock()
+        self._nextLoopIndex = 0
+
+    def addTunnel(self, sock, chan, name="", closeCallback=None, tunnelStats=None):
+        """@brief Start forwarding data between a socket and an ssh channel. The engine closes both
+                  when either end has closed and all data has been sent.
+           @param sock A connected TCP socket.
+           @param chan An open ssh channel.
+           @param name A name for the connection.
+           @param closeCallback If not None this is called (from a loop thread) with the TunnelConnection instance when it closes.
+           @param tunnelStats If not None the TunnelStats instance that the bytes forwarded are added to.
+                              The caller is responsible for calling its connectionOpened() method.
+           @return A TunnelConnection instance."""
+        tunnelConnection = TunnelConnection(sock, chan, name, closeCallback=closeCallback, tunnelStats=tunnelStats)
+        with self._lock:
+            tunnelLoop = self._loopList[self._nextLoopIndex]
+            self._nextLoopIndex = (self._nextLoopIndex + 1) % len(self._loopList)
+        tunnelConnection.tunnelLoop = tunnelLoop
+        tunnelLoop.add(tunnelConnection)
+        return tunnelConnection
+
+    def closeTunnel(self, tunnelConnection):
+        """@brief Close a tunnel connection.
+           @param tunnelConnection The TunnelConnection instance returned by addTunnel()."""
+        tunnelConnection.tunnelLoop.close(tunnelConnection)
+
+    def getTunnelCount(self):
+        """@return The number of open tunnel connections."""
+        return sum([tunnelLoop.getConnectionCount() for tunnelLoop in self._loopList])
+
+    def stop(self):
+        """@brief Close all tunnel connections and stop the loop threads."""
+        for tunnelLoop in self._loopList:
+            tunnelLoop.stop()
 
 class SSHTunnelManager(object):
     """@brief Responsible for setting up, tearing down and maintaining lists of
               SSH port forwarding and ssh reverse port forwarding connections."""
 
-    RX_BUFFER_SIZE = 65535
+    RX_BUFFER_SIZE = TunnelEngine.DEFAULT_READ_SIZE
 
-    def __init__(self, uio, ssh, useCompression):
+    def __init__(self, uio, ssh, useCompression, readSize=RX_BUFFER_SIZE, maxBufferedBytes=TunnelEngine.DEFAULT_MAX_BUFFERED_BYTES, loopCount=TunnelEngine.DEFAULT_LOOP_COUNT, socketBufferSize=None):
         """@brief Constructor
            @param uio  UIO instance
            @param ssh An instance of SSHClient that has previously been
-                      connected to an ssh server"""
+                      connected to an ssh server
+           @param useCompression If True use compression on the ssh connection.
+           @param readSize The maximum number of bytes read from a tunnel socket or channel at a time.
+           @param maxBufferedBytes The maximum number of bytes buffered in each direction of a tunnel
+                                   connection before reading from the sender stops.
+           @param loopCount The number of threads used to forward the data of all tunnel connections.
+           @param socketBufferSize If not None the size of the kernel send and receive buffers of tunnel sockets."""
         self._uio = uio
         self._ssh = ssh
         self._useCompression = useCompression
@@ -664,6 +3300,13 @@ class SSHTunnelManager(object):
 
         self._forwardingServerList = []
         self._reverseSShDict = {}
+        self._tunnelStatsDict = {}
+        self._tunnelEngine = TunnelEngine(loopCount=loopCount,
+                                          readSize=readSize,
+                                          maxBufferedBytes=maxBufferedBytes,
+                                          socketBufferSize=socketBufferSize)
+        # If the ssh connection is rebuilt (see SSH autoReconnect) the tunnels are moved to the new connection.
+        self._ssh.addReconnectListener(self._reconnected)
 
     def _info(self, text):
         """@brief Present an info level message to the user.
@@ -685,8 +3328,9 @@ class SSHTunnelManager(object):
 
     def startFwdSSHTunnel(self, serverPort, destHost, destPort, serverBindAddress=''):
         """@brief Start an ssh port forwarding tunnel. This is a non blocking method.
-                  A separate thread will be started to handle data transfer over the
-                  ssh forwarding connection.
+                  A separate thread will be started to accept connections on the
+                  TCP server port. The data of each connection is forwarded by the
+                  tunnel engine threads.
            @param serverPort The TCP server port. On a port forwarding connection
                              the TCP server runs on the src end of the ssh connection.
                              This is the machine that this python code is executing on.
@@ -698,6 +3342,7 @@ class SSHTunnelManager(object):
         self._info("Forwarding local TCP server port (%d) to %s:%d on the remote end of the ssh connection." % (
         serverPort, destHost, destPort))
         transport = self._ssh.getTransport()
+        tunnelStats = TunnelStats(TunnelStats.FORWARD, serverPort, destHost, destPort)
 
         class SubHander(ForwardingHandler):
             chain_host = destHost
@@ -705,9 +3350,12 @@ class SSHTunnelManager(object):
             ssh_transport = transport
             ssh_transport.use_compression(self._useCompression)
             uo = self._uio
+            tunnel_engine = self._tunnelEngine
+            tunnel_stats = tunnelStats
 
         forwardingServer = ForwardingServer((serverBindAddress, serverPort), SubHander)
         self._forwardingServerList.append(forwardingServer)
+        self._tunnelStatsDict[(TunnelStats.FORWARD, serverPort)] = tunnelStats
         newThread = threading.Thread(target=forwardingServer.serve_forever)
         newThread.daemon = True
         newThread.start()
@@ -756,10 +3404,9 @@ class SSHTunnelManager(object):
            @param serverBindAddress The server address to bind to."""
         self._info("Forwarding (reverse) Remote TCP server port (%d) to %s:%d on this end of the ssh connection." % (
         serverPort, destHost, destPort))
-        # We add the None refs as the placeholders will be used later
-        chan = None
-        sock = None
-        self._reverseSShDict[serverPort] = (destHost, destPort, chan, sock)
+        # The list holds the TunnelConnection instances of the connections to this port so that they can be closed.
+        self._reverseSShDict[serverPort] = (destHost, destPort, [], serverBindAddress)
+        self._tunnelStatsDict[(TunnelStats.REVERSE, serverPort)] = TunnelStats(TunnelStats.REVERSE, serverPort, destHost, destPort)
 
         self._ssh.getTransport().use_compression(self._useCompression)
         self._ssh.getTransport().request_port_forward(serverBindAddress, serverPort, handler=self._startReverseForwardingHandler)
@@ -784,31 +3431,15 @@ class SSHTunnelManager(object):
            @param serverPort The TCP server port which is currently accepting
                              port forwarding connections on."""
         if serverPort in self._reverseSShDict:
-            revSSHParams = self._reverseSShDict[serverPort]
-            chan = revSSHParams[2]
-            sock = revSSHParams[3]
-
-            if chan:
-                chan.close()
-
-            if sock:
-                sock.close()
-
+            self._closeRevConnections(serverPort)
+            self._cancelRevPortForward(serverPort)
             self._info("Shutdown reverse ssh port forwarding connection using remote server port %d." % (serverPort))
 
     def stopAllRevSSHTunnels(self):
         """@brief Stop all previously started reverse ssh port forwarding servers."""
         for key in list(self._reverseSShDict.keys()):
-            revSSHParams = self._reverseSShDict[key]
-            chan = revSSHParams[2]
-            sock = revSSHParams[3]
-
-            if chan:
-                chan.close()
-
-            if sock:
-                sock.close()
-
+            self._closeRevConnections(key)
+            self._cancelRevPortForward(key)
             self._info("Shutdown reverse ssh port forwarding connection using remote server port %d." % (key))
 
     def stopAllSSHTunnels(self):
@@ -816,6 +3447,26 @@ class SSHTunnelManager(object):
         self.stopAllFwdSSHTunnels()
         self.stopAllRevSSHTunnels()
 
+    def close(self):
+        """@brief Stop all ssh tunnels and the threads that forward their data."""
+        self._ssh.removeReconnectListener(self._reconnected)
+        self.stopAllSSHTunnels()
+        self._tunnelEngine.stop()
+
+    def getTunnelCount(self):
+        """@return The number of open tunnel connections (forward and reverse)."""
+        return self._tunnelEngine.getTunnelCount()
+
+    def getTunnelStats(self):
+        """@brief Get the counters of each tunnel started. These may be used to find out whether
+                  a slow service is slow because of the tunnel or because of the far end.
+           @return A list of dicts, one for each tunnel. Each dict holds the direction (forward
+                   or reverse), serverPort, destHost, destPort, connectionCount,
+                   activeConnectionCount, openFailureCount, bytesToRemote, bytesFromRemote,
+                   setupSecondsAvg and setupSecondsMax of the tunnel. bytesToRemote is
+                   the number of bytes sent to the remote end of the ssh connection."""
+        return [self._tunnelStatsDict[key].getStats() for key in sorted(self._tunnelStatsDict)]
+
     # !!! The following methods are internal and should noit be called externally.
     def _getDestination(self, serverPort):
         """@brief Get destination (address and port) for the given server port.
@@ -826,55 +3477,122 @@ class SSHTunnelManager(object):
 
         return None
 
+    def _cancelRevPortForward(self, serverPort):
+        """@brief Ask the ssh server to stop listening on a reverse ssh port forwarding server port
+                  and forget the tunnel so that it is not started again if the ssh connection is rebuilt.
+           @param serverPort The TCP server port on the ssh server."""
+        serverBindAddress = self._reverseSShDict.pop(serverPort)[3]
+        try:
+            self._ssh.getTransport().cancel_port_forward(serverBindAddress, serverPort)
+        except Exception:
+            # The connection may already have been lost.
+            pass
+
+    def _reconnected(self, ssh):
+        """@brief Called when the ssh connection has been rebuilt. Connections through the tunnels were
+                  lost with the previous connection. The forwarding servers are still listening and
+                  now open channels on the new connection. The reverse port forwarding requests are
+                  sent to the ssh server again.
+           @param ssh The SSH instance."""
+        transport = ssh.getTransport()
+        transport.use_compression(self._useCompression)
+        for forwardingServer in self._forwardingServerList:
+            forwardingServer.RequestHandlerClass.ssh_transport = transport
+        for serverPort in list(self._reverseSShDict.keys()):
+            if not self._restartRevSSHTunnel(transport, serverPort):
+                # The ssh server may still be listening on the port for the lost connection
+                # until it notices that the connection has gone, so keep trying.
+                threading.Thread(target=self._retryRevSSHTunnel, args=(transport, serverPort), daemon=True).start()
+        self._info("Restarted %d forward and %d reverse ssh tunnels." % (len(self._forwardingServerList), len(self._reverseSShDict)))
+
+    def _restartRevSSHTunnel(self, transport, serverPort):
+        """@brief Ask the ssh server to listen on a reverse ssh port forwarding server port again.
+           @param transport The transport of the new ssh connection.
+           @param serverPort The TCP server port on the ssh server.
+           @return True if the ssh server accepted the request."""
+        revSSHParams = self._reverseSShDict.get(serverPort)
+        if revSSHParams is None:
+            # The tunnel has been stopped.
+            return True
+        try:
+            transport.request_port_forward(revSSHParams[3], serverPort, handler=self._startReverseForwardingHandler)
+            return True
+        except Exception as ex:
+            self._warn("Failed to restart reverse ssh port forwarding on remote server port %d: %s" % (serverPort, ex))
+            return False
+
+    def _retryRevSSHTunnel(self, transport, serverPort):
+        """@brief Retry _restartRevSSHTunnel() with an increasing delay until it succeeds, the tunnel is
+                  stopped or the ssh connection is lost.
+           @param transport The transport of the new ssh connection.
+           @param serverPort The TCP server port on the ssh server."""
+        delaySeconds = SSH.RECONNECT_MIN_SECONDS
+        while True:
+            sleep(delaySeconds)
+            if not transport.is_active():
+                # If the connection is rebuilt again _reconnected() restarts the tunnel.
+                return
+            if self._restartRevSSHTunnel(transport, serverPort):
+                self._info("Restarted reverse ssh port forwarding on remote server port %d." % (serverPort))
+                return
+            delaySeconds = min(delaySeconds*SSH.RECONNECT_BACKOFF_FACTOR, SSH.RECONNECT_MAX_SECONDS)
+
+    def _closeRevConnections(self, serverPort):
+        """@brief Close all the connections made to a reverse ssh port forwarding server port.
+           @param serverPort The TCP server port on the ssh server."""
+        tunnelConnectionList = self._reverseSShDict[serverPort][2]
+        for tunnelConnection in list(tunnelConnectionList):
+            self._tunnelEngine.closeTunnel(tunnelConnection)
+
     def _startReverseForwardingHandler(self, chan, xxx_todo_changeme, xxx_todo_changeme1):
         """@brief Called when a channel is connected in order to start a handler thread fot it."""
         (origin_addr, origin_port) = xxx_todo_changeme
         (server_addr, serverPort) = xxx_todo_changeme1
-        destHost, destPort = self._getDestination(serverPort)
+        destination = self._getDestination(serverPort)
+        if destination is None:
+            # The tunnel has been stopped.
+            chan.close()
+            return
+        destHost, destPort = destination
 
+        # The connection to the destination is made in a separate thread as this method is called
+        # from the ssh transport thread.
         hThread = threading.Thread(target=self._reverseForwardingHandler, args=(chan, serverPort, destHost, destPort))
-        hThread.setDaemon(True)
+        hThread.daemon = True
         hThread.start()
 
     def _reverseForwardingHandler(self, chan, serverPort, destHost, destPort):
-        """@brief Handle a reverse ssh forwarding connection.
+        """@brief Connect to the destination of a reverse ssh forwarding connection and pass the
+                  connection to the tunnel engine.
            @param chan A connected channel over an ssh connection.
            @param serverPort The server port (on remote ssh server) from where the reverse ssh connection originated.
            @param destHost The destination host address.
            @param destPort The destination port address."""
 
+        tunnelStats = self._tunnelStatsDict[(TunnelStats.REVERSE, serverPort)]
         sock = socket.socket()
-        # Add references to the chnl and sock so that they can be closed if required
-        self._reverseSShDict[serverPort] = (destHost, destPort, chan, sock)
+        startTime = time()
         try:
             sock.connect((destHost, destPort))
         except Exception as e:
+            tunnelStats.openFailed()
             self._error('Forwarding (reverse) request to %s:%d failed: %r' % (destHost, destPort, e))
+            sock.close()
+            chan.close()
             return
+        tunnelStats.connectionOpened(time()-startTime)
 
         self._info('Connected!  Reverse tunnel open %r -> %r -> %r' % (chan.origin_addr,
                                                                           chan.getpeername(), (destHost, destPort)))
-        while True:
-            r, w, x = select.select([sock, chan], [], [])
-            if sock in r:
-                data = sock.recv(SSHTunnelManager.RX_BUFFER_SIZE)
-                if len(data) == 0:
-                    break
-                try:
-                    chan.send(data)
-                except:
-                    break
-            if chan in r:
-                data = chan.recv(SSHTunnelManager.RX_BUFFER_SIZE)
-                if len(data) == 0:
-                    break
-                try:
-                    sock.send(data)
-                except:
-                    break
-        chan.close()
-        sock.close()
-        self._info('Tunnel closed from server port %d' % (serverPort))
+        tunnelConnectionList = self._reverseSShDict[serverPort][2]
+
+        def tunnelClosed(tunnelConnection):
+            if tunnelConnection in tunnelConnectionList:
+                tunnelConnectionList.remove(tunnelConnection)
+            self._info('Tunnel closed from server port %d' % (serverPort))
+
+        tunnelConnection = self._tunnelEngine.addTunnel(sock, chan, name="%s:%d" % (destHost, destPort), closeCallback=tunnelClosed, tunnelStats=tunnelStats)
+        tunnelConnectionList.append(tunnelConnection)
 
 
 class ForwardingServer(socketserver.ThreadingTCPServer):
@@ -882,10 +3600,34 @@ class ForwardingServer(socketserver.ThreadingTCPServer):
     daemon_threads = True
     allow_reuse_address = True
 
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True):
+        self._tunnelledSet = set()
+        self._tunnelledLock = threading.Lock()
+        socketserver.ThreadingTCPServer.__init__(self, server_address, RequestHandlerClass, bind_and_activate=bind_and_activate)
+
+    def setTunnelled(self, request):
+        """@brief Mark a connection as handed over to a tunnel engine so that it is not closed
+                  when the handler returns.
+           @param request The connected socket."""
+        with self._tunnelledLock:
+            self._tunnelledSet.add(request)
+
+    def shutdown_request(self, request):
+        with self._tunnelledLock:
+            if request in self._tunnelledSet:
+                self._tunnelledSet.remove(request)
+                return
+        socketserver.ThreadingTCPServer.shutdown_request(self, request)
+
 
 class ForwardingHandler(socketserver.BaseRequestHandler):
     """@brief handler for ssh port forwarding connections."""
 
+    # If not set by a sub class the process wide TunnelEngine is used.
+    tunnel_engine = None
+    # If set by a sub class the TunnelStats instance updated for each connection.
+    tunnel_stats = None
+
     def _info(self, text):
         """@brief Present an info level message to the user.
            @param text The text to be presented to the user."""
@@ -899,37 +3641,38 @@ class ForwardingHandler(socketserver.BaseRequestHandler):
             self.uo.error(text)
 
     def handle(self):
+        startTime = time()
         try:
             chan = self.ssh_transport.open_channel('direct-tcpip',
                                                    (self.chain_host, self.chain_port),
                                                    self.request.getpeername())
         except Exception as e:
+            if self.tunnel_stats:
+                self.tunnel_stats.openFailed()
             self._error('Incoming request to %s:%d failed: %s' % (self.chain_host,
                                                                     self.chain_port,
                                                                     repr(e)))
             return
         if chan is None:
+            if self.tunnel_stats:
+                self.tunnel_stats.openFailed()
             self._error('Incoming request to %s:%d was rejected by the SSH server.' %
                           (self.chain_host, self.chain_port))
             return
+        if self.tunnel_stats:
+            self.tunnel_stats.connectionOpened(time()-startTime)
 
-        self._info('Connected!  Tunnel open %r -> %r -> %r' % (self.request.getpeername(),
+        peername = self.request.getpeername()
+        self._info('Connected!  Tunnel open %r -> %r -> %r' % (peername,
                                                                  chan.getpeername(),
                                                                  (self.chain_host, self.chain_port)))
-        while True:
-            r, w, x = select.select([self.request, chan], [], [])
-            if self.request in r:
-                data = self.request.recv(SSHTunnelManager.RX_BUFFER_SIZE)
-                if len(data) == 0:
-                    break
-                chan.send(data)
-            if chan in r:
-                data = chan.recv(SSHTunnelManager.RX_BUFFER_SIZE)
-                if len(data) == 0:
-                    break
-                self.request.send(data)
 
-        peername = self.request.getpeername()
-        chan.close()
-        self.request.close()
-        self._info('Tunnel closed from %r' % (peername,))
+        def tunnelClosed(tunnelConnection):
+            self._info('Tunnel closed from %r' % (peername,))
+
+        tunnelEngine = self.tunnel_engine
+        if tunnelEngine is None:
+            tunnelEngine = TunnelEngine.GetDefault()
+        # The tunnel engine closes the socket when the tunnel closes.
+        self.server.setTunnelled(self.request)
+        tunnelEngine.addTunnel(self.request, chan, name="%s:%d" % (self.chain_host, self.chain_port), closeCallback=tunnelClosed, tunnelStats=self.tunnel_stats)
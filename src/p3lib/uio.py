@@ -5,15 +5,39 @@ import os
 import re
 import traceback
 import platform
-
-from   threading import Lock
-from   socket import socket, AF_INET, SOCK_DGRAM
+import atexit
+import gzip
+import shutil
+import json
+import signal
+import math
+import functools
+
+from   threading import Lock, Thread, Event, current_thread
+from   socket import socket, gethostname, AF_INET, AF_UNIX, SOCK_DGRAM, SOCK_STREAM
+from   queue import Queue, Empty, Full
 from   getpass import getpass, getuser
-from   time import strftime, localtime
+from   time import time, perf_counter
 from   datetime import datetime
+from   itertools import islice, chain, repeat
+from   collections import deque
 
 from   p3lib.netif import NetIF
 
+# orjson is used (if installed) to serialise LOG_FORMAT_JSON records as it is much faster than json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _dumpJSON(record):
+    """@brief Serialise a log record to a single line of JSON text.
+       @param record The dict to serialise. Values that are not JSON types are converted to strings.
+       @return The JSON text."""
+    if orjson:
+        return orjson.dumps(record, default=str).decode()
+    return json.dumps(record, separators=(",", ":"), ensure_ascii=False, default=str)
+
 class UIO(object):
     """@brief responsible for user output and input via stdout/stdin"""
 
@@ -50,6 +74,16 @@ class UIO(object):
     USER_LOG_SYM_LINK           = "log.txt"
     DEBUG_LOG_SYM_LINK          = "debug_log.txt"
 
+    LOG_FORMAT_TEXT             = "text"
+    LOG_FORMAT_JSON             = "json"
+
+    LEVEL_INFO                  = "INFO"
+    LEVEL_OK                    = "OK"
+    LEVEL_DEBUG                 = "DEBUG"
+    LEVEL_WARN                  = "WARN"
+    LEVEL_ERROR                 = "ERROR"
+    LEVEL_LOG                   = "LOG"     # Text saved directly to the log files (E.G user input).
+
     @staticmethod
     def GetInfoEscapeSeq():
         """@return the info level ANSI escape sequence."""
@@ -91,6 +125,25 @@ class UIO(object):
         self._sysLogEnabled                 = False
         self._sysLogHost                    = None
         self._syslogProgramName             = None
+        self._syslogHandler                 = None
+        self._logWriterDict                 = {}
+        self._logWriterLock                 = Lock()
+        self._logFlushBytes                 = 0
+        self._logFlushSeconds               = 0
+        self._logBackgroundWrite            = False
+        self._logMaxBytes                   = 0
+        self._logRotateSeconds              = 0
+        self._logBackupCount                = 0
+        self._logCompression                = None
+        self._logFormat                     = UIO.LOG_FORMAT_TEXT
+        self._messageLimiter                = None
+        self._ringBuffer                    = None
+        self._ringBufferFile                = None
+        self._ringBufferDumpOnError         = True
+        self._ringBufferSignal              = None
+        self._ringBufferPrevHandler         = None
+        self._spanHistogramDict             = {}
+        self._spanLock                      = Lock()
 
     def logAll(self, enabled):
         """@brief Turn on/off the logging of all output including debug output even if debugging is off."""
@@ -105,96 +158,381 @@ class UIO(object):
         """@return True if debuggin is eenabled."""
         return self._debug
 
-    def info(self, text, highlight=False):
+    def isEnabledFor(self, level):
+        """@brief Check if a message at the given level will be output. This is a cheap check that
+                  callers may use to avoid building messages that would be discarded.
+           @param level The PRIORITY level of the message (E.G PRIORITY.DEBUG).
+           @return True if a message at the level will be output to stdout, a log file or syslog."""
+        if level < PRIORITY.DEBUG:
+            return True
+        return self._debug or (self._debugLogEnabled and self._debugLogFile is not None) or self._ringBuffer is not None
+
+    @staticmethod
+    def _getText(text, args=()):
+        """@brief Get the text of a message. This is only called once we know the message will be output.
+           @param text The message text, a format string if args are supplied or a method that returns the message text.
+           @param args Arguments that are applied to the format string using the % operator.
+           @return The message text."""
+        if callable(text):
+            text = text()
+        if args:
+            text = text % args
+        return text
+
+    def info(self, text, *args, highlight=False, fields=None):
         """@brief Present an info level message to the user.
-           @param text The line of text to be presented to the user."""
+           @param text The line of text to be presented to the user, a format string if args
+                       are supplied or a method that returns the text.
+           @param args Arguments applied to the format string using the % operator.
+           @param highlight If True the whole message is highlighted.
+           @param fields An optional dict of key/value fields added to the record when the log format is LOG_FORMAT_JSON."""
+        key = text
+        text = UIO._getText(text, args)
+        if self._messageLimiter and self._isLimited(UIO.LEVEL_INFO, key, text):
+            return
+        self._showInfo(text, highlight, fields)
+
+    def _showInfo(self, text, highlight=False, fields=None):
+        """@brief Output an info level message."""
+        self._print(self._getInfoDisplayText(text, highlight), UIO.LEVEL_INFO, text, fields)
+        self._update_syslog(PRIORITY.INFO, "INFO:  "+text)
+
+    def _getInfoDisplayText(self, text, highlight=False):
+        """@brief Get the text displayed to the user for an info level message.
+           @param text The message text.
+           @param highlight If True the whole message is highlighted.
+           @return The text to display."""
         if self._colour:
             if self._use_emojis:
-                self._print('ℹ️  ' + text)
+                return 'ℹ️  ' + text
 
             else:
                 if highlight:
-                    self._print('{}INFO:  {}{}'.format(UIO.GetInfoEscapeSeq(), text, UIO.DISPLAY_RESET_ESCAPE_SEQ))
+                    return '{}INFO:  {}{}'.format(UIO.GetInfoEscapeSeq(), text, UIO.DISPLAY_RESET_ESCAPE_SEQ)
                 else:
-                    self._print('{}INFO{}:  {}'.format(UIO.GetInfoEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text))
+                    return '{}INFO{}:  {}'.format(UIO.GetInfoEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text)
         else:
-            self._print('INFO:  {}'.format(text))
-        self._update_syslog(PRIORITY.INFO, "INFO:  "+text)
+            return 'INFO:  {}'.format(text)
+
+    def _infoLines(self, lineList):
+        """@brief Present a number of info level lines of text to the user. The lines are written
+                  to stdout and each log file in a single write.
+           @param lineList A list of lines of text."""
+        displayLineList = [self._getInfoDisplayText(line) for line in lineList]
+        if self._ringBuffer is not None:
+            now = time()
+            self._ringBuffer.extend( (now, UIO.LEVEL_INFO, line, None) for line in lineList )
+        if self._logFormat == UIO.LOG_FORMAT_JSON:
+            for line in lineList:
+                self._storeJSONRecord(UIO.LEVEL_INFO, line, None, mainLog=True, debugLog=self._debugLogEnabled)
+        else:
+            self._storeLinesToLog(displayLineList, self._logFile, UIO.USER_LOG_SYM_LINK)
+            if self._debugLogEnabled and self._debugLogFile:
+                self._storeLinesToLog(displayLineList, self._debugLogFile, UIO.DEBUG_LOG_SYM_LINK)
+        sys.stdout.write("\n".join(displayLineList) + "\n")
+        if self._sysLogEnabled:
+            for line in lineList:
+                self._update_syslog(PRIORITY.INFO, "INFO:  "+line)
 
-    def success(self, text, highlight=False):
+    def success(self, text, *args, highlight=False, fields=None):
         """@brief Present an success message to the user.
-           @param text The line of text to be presented to the user."""
+           @param text The line of text to be presented to the user, a format string if args
+                       are supplied or a method that returns the text.
+           @param args Arguments applied to the format string using the % operator.
+           @param highlight If True the whole message is highlighted.
+           @param fields An optional dict of key/value fields added to the record when the log format is LOG_FORMAT_JSON."""
+        key = text
+        text = UIO._getText(text, args)
+        if self._messageLimiter and self._isLimited(UIO.LEVEL_OK, key, text):
+            return
+        self._showSuccess(text, highlight, fields)
+
+    def _showSuccess(self, text, highlight=False, fields=None):
+        """@brief Output a success message."""
         if self._colour:
             if self._use_emojis:
-                self._print('✅  ' + text)
+                self._print('✅  ' + text, UIO.LEVEL_OK, text, fields)
 
             else:
                 if highlight:
-                    self._print('{}OK:      {}{}'.format(UIO.GetInfoEscapeSeq(), text, UIO.DISPLAY_RESET_ESCAPE_SEQ))
+                    self._print('{}OK:      {}{}'.format(UIO.GetInfoEscapeSeq(), text, UIO.DISPLAY_RESET_ESCAPE_SEQ), UIO.LEVEL_OK, text, fields)
                 else:
-                    self._print('{}OK{}:    {}'.format(UIO.GetInfoEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text))
+                    self._print('{}OK{}:    {}'.format(UIO.GetInfoEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text), UIO.LEVEL_OK, text, fields)
         else:
-            self._print('INFO:  {}'.format(text))
+            self._print('INFO:  {}'.format(text), UIO.LEVEL_OK, text, fields)
         self._update_syslog(PRIORITY.INFO, "INFO:  "+text)
 
-    def debug(self, text):
-        """@brief Present a debug level message to the user if debuging is enabled.
-           @param text The line of text to be presented to the user."""
+    def debug(self, text, *args, fields=None):
+        """@brief Present a debug level message to the user if debuging is enabled. The message
+                  text is only built if debugging or logging of all output is enabled.
+           @param text The line of text to be presented to the user, a format string if args
+                       are supplied (E.G debug("Queue size = %d", qSize)) or a method that returns the text.
+           @param args Arguments applied to the format string using the % operator.
+           @param fields An optional dict of key/value fields added to the record when the log format is LOG_FORMAT_JSON."""
+        if self._debug or (self._debugLogEnabled and self._debugLogFile) or self._ringBuffer is not None:
+            key = text
+            text = UIO._getText(text, args)
+            if self._messageLimiter and self._isLimited(UIO.LEVEL_DEBUG, key, text):
+                return
+            self._showDebug(text, fields)
+
+    def _showDebug(self, text, fields=None):
+        """@brief Output a debug level message."""
         if self._debug:
             if self._colour:
                 if self._use_emojis:
-                    self._print('🔍  ' + text)
+                    self._print('🔍  ' + text, UIO.LEVEL_DEBUG, text, fields)
 
                 else:
-                    self._print('{}DEBUG{}: {}'.format(UIO.GetDebugEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text))
+                    self._print('{}DEBUG{}: {}'.format(UIO.GetDebugEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text), UIO.LEVEL_DEBUG, text, fields)
 
             else:
-                self._print('DEBUG: {}'.format(text))
+                self._print('DEBUG: {}'.format(text), UIO.LEVEL_DEBUG, text, fields)
         elif self._debugLogEnabled and self._debugLogFile:
-            if self._colour:
+            if self._logFormat == UIO.LOG_FORMAT_JSON:
+                self._storeJSONRecord(UIO.LEVEL_DEBUG, text, fields, mainLog=False, debugLog=True)
+            elif self._colour:
                 self.storeToDebugLog('{}DEBUG{}: {}'.format(UIO.GetDebugEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text))
             else:
                 self.storeToDebugLog('DEBUG: {}'.format(text))
+        else:
+            # Debug output is disabled so the message is only held in the ring buffer.
+            if self._ringBuffer is not None:
+                self._ringBuffer.append( (time(), UIO.LEVEL_DEBUG, text, fields) )
+            return
+        if self._ringBuffer is not None and not self._debug:
+            self._ringBuffer.append( (time(), UIO.LEVEL_DEBUG, text, fields) )
         self._update_syslog(PRIORITY.DEBUG, "DEBUG: "+text)
 
-    def warn(self, text):
+    def warn(self, text, *args, fields=None):
         """@brief Present a warning level message to the user.
-           @param text The line of text to be presented to the user."""
+           @param text The line of text to be presented to the user, a format string if args
+                       are supplied or a method that returns the text.
+           @param args Arguments applied to the format string using the % operator.
+           @param fields An optional dict of key/value fields added to the record when the log format is LOG_FORMAT_JSON."""
+        key = text
+        text = UIO._getText(text, args)
+        if self._messageLimiter and self._isLimited(UIO.LEVEL_WARN, key, text):
+            return
+        self._showWarn(text, fields)
+
+    def _showWarn(self, text, fields=None):
+        """@brief Output a warning level message."""
         if self._colour:
             if self._use_emojis:
-                self._print('⚠️  ' + text)
+                self._print('⚠️  ' + text, UIO.LEVEL_WARN, text, fields)
 
             else:
-                self._print('{}WARN{}:  {}'.format(UIO.GetWarnEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text))
+                self._print('{}WARN{}:  {}'.format(UIO.GetWarnEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text), UIO.LEVEL_WARN, text, fields)
         else:
-            self._print('WARN:  {}'.format(text))
+            self._print('WARN:  {}'.format(text), UIO.LEVEL_WARN, text, fields)
         self._update_syslog(PRIORITY.WARNING, "WARN:  "+text)
 
-    def failure(self, text):
+    def failure(self, text, *args, fields=None):
         """@brief Present a failure message to the user. This is the same as an error message.
-           @param text The line of text to be presented to the user."""
-        self.error(text)
+           @param text The line of text to be presented to the user, a format string if args
+                       are supplied or a method that returns the text.
+           @param args Arguments applied to the format string using the % operator.
+           @param fields An optional dict of key/value fields added to the record when the log format is LOG_FORMAT_JSON."""
+        self.error(text, *args, fields=fields)
 
-    def error(self, text):
+    def error(self, text, *args, fields=None):
         """@brief Present an error level message to the user.
-           @param text The line of text to be presented to the user."""
+           @param text The line of text to be presented to the user, a format string if args
+                       are supplied or a method that returns the text.
+           @param args Arguments applied to the format string using the % operator.
+           @param fields An optional dict of key/value fields added to the record when the log format is LOG_FORMAT_JSON."""
+        key = text
+        text = UIO._getText(text, args)
+        if self._messageLimiter and self._isLimited(UIO.LEVEL_ERROR, key, text):
+            return
+        self._showError(text, fields)
+
+    def _showError(self, text, fields=None):
+        """@brief Output an error level message."""
         if self._colour:
             if self._use_emojis:
-                self._print('❌  ' + text)
+                self._print('❌  ' + text, UIO.LEVEL_ERROR, text, fields)
 
             else:
-                self._print('{}ERROR{}: {}'.format(UIO.GetErrorEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text))
+                self._print('{}ERROR{}: {}'.format(UIO.GetErrorEscapeSeq(), UIO.DISPLAY_RESET_ESCAPE_SEQ, text), UIO.LEVEL_ERROR, text, fields)
         else:
-            self._print('ERROR: {}'.format(text))
+            self._print('ERROR: {}'.format(text), UIO.LEVEL_ERROR, text, fields)
         self._update_syslog(PRIORITY.ERROR, "ERROR: "+text)
-
-    def _print(self, text):
-        """@brief Print text to stdout"""
-        self.storeToLog(text)
-        if self._debugLogEnabled and self._debugLogFile:
-            self.storeToDebugLog(text)
+        if self._ringBuffer is not None and self._ringBufferDumpOnError:
+            self.dumpRingBuffer()
+
+    def setMessageLimits(self, maxMessages=0, periodSeconds=1.0, collapseDuplicates=False):
+        """@brief Limit the rate at which messages are output so that a storm of messages (E.G
+                  the same warning generated in a loop) cannot consume all the CPU and disk bandwidth.
+                  Once the rate limit period of a message key has ended, a summary of its suppressed
+                  messages is output before the next message (with any key) is output. Summaries that
+                  are still pending are output when flushSuppressed() is called or the program exits.
+           @param maxMessages The maximum number of messages with the same key (level and message text or
+                              format string) that are output every periodSeconds. 0 = no rate limit.
+           @param periodSeconds The rate limit period in seconds.
+           @param collapseDuplicates If True a message that is the same as the previous message is not output
+                                     but counted and a 'Last message repeated N times' message is output later."""
+        self.flushSuppressed()
+        atexit.unregister(self.flushSuppressed)
+        if maxMessages > 0 or collapseDuplicates:
+            self._messageLimiter = MessageLimiter(maxMessages=maxMessages, periodSeconds=periodSeconds, collapseDuplicates=collapseDuplicates)
+            atexit.register(self.flushSuppressed)
+        else:
+            self._messageLimiter = None
+
+    def flushSuppressed(self):
+        """@brief Output a summary of any messages suppressed by the limits set by setMessageLimits()."""
+        if self._messageLimiter:
+            self._showNotices(self._messageLimiter.getNotices())
+
+    def _isLimited(self, levelName, key, text):
+        """@brief Check a message against the limits set by setMessageLimits().
+           @param levelName The message level name (E.G UIO.LEVEL_WARN).
+           @param key The text, format string or method passed by the caller.
+           @param text The message text.
+           @return True if the message should not be output."""
+        if not isinstance(key, str):
+            key = text
+        limited, noticeList = self._messageLimiter.check(levelName, key, text)
+        if noticeList:
+            self._showNotices(noticeList)
+        return limited
+
+    def _showNotices(self, noticeList):
+        """@brief Output messages that summarise suppressed messages.
+           @param noticeList A list of (level name, notice text) tuples."""
+        showMethodDict = {UIO.LEVEL_INFO:    self._showInfo,
+                          UIO.LEVEL_OK:      self._showSuccess,
+                          UIO.LEVEL_DEBUG:   self._showDebug,
+                          UIO.LEVEL_WARN:    self._showWarn,
+                          UIO.LEVEL_ERROR:   self._showError}
+        for levelName, notice in noticeList:
+            showMethodDict[levelName](notice)
+
+    def _print(self, text, levelName=None, message=None, fields=None):
+        """@brief Print text to stdout and save it to the log files.
+           @param text The text to print.
+           @param levelName The level name (E.G UIO.LEVEL_INFO) used when the log format is LOG_FORMAT_JSON.
+           @param message The message text without the level prefix or colour used when the log format is LOG_FORMAT_JSON.
+           @param fields An optional dict of key/value fields used when the log format is LOG_FORMAT_JSON."""
+        if self._ringBuffer is not None and levelName:
+            self._ringBuffer.append( (time(), levelName, message, fields) )
+        if self._logFormat == UIO.LOG_FORMAT_JSON and levelName:
+            self._storeJSONRecord(levelName, message, fields, mainLog=True, debugLog=self._debugLogEnabled)
+        else:
+            self.storeToLog(text)
+            if self._debugLogEnabled and self._debugLogFile:
+                self.storeToDebugLog(text)
         print(text)
 
+    def enableRingBuffer(self, size, dumpFile, dumpOnError=True, dumpSignal=None):
+        """@brief Keep the most recent messages, at all levels including debug, in memory. These are
+                  only written to a file when an error message is output, a signal is received or
+                  dumpRingBuffer() is called. This provides debug context for failures without the
+                  cost of writing debug messages to a log file all the time.
+           @param size The number of messages to keep. 0 disables the ring buffer.
+           @param dumpFile The file that the messages are appended to when the ring buffer is dumped.
+           @param dumpOnError If True the ring buffer is dumped each time an error message is output.
+           @param dumpSignal If not None the ring buffer is dumped when this signal (E.G signal.SIGUSR1)
+                             is received. The dump is written by a separate thread. If a python handler
+                             was already installed for the signal it is called after the dump is started
+                             and it is reinstalled when the ring buffer is disabled or a different signal
+                             is set. This must be called from the main thread if a signal is or was set."""
+        if self._ringBufferSignal is not None and (size <= 0 or dumpSignal != self._ringBufferSignal):
+            signal.signal(self._ringBufferSignal, self._ringBufferPrevHandler)
+            self._ringBufferSignal = None
+            self._ringBufferPrevHandler = None
+        if size > 0:
+            self._ringBuffer = deque(maxlen=size)
+            self._ringBufferFile = dumpFile
+            self._ringBufferDumpOnError = dumpOnError
+            if dumpSignal is not None and self._ringBufferSignal is None:
+                self._ringBufferPrevHandler = signal.signal(dumpSignal, self._ringBufferSignalHandler)
+                self._ringBufferSignal = dumpSignal
+        else:
+            self._ringBuffer = None
+            self._ringBufferFile = None
+
+    def _ringBufferSignalHandler(self, signum, frame):
+        """@brief Called when the signal passed to enableRingBuffer() is received. The ring buffer
+                  is dumped by a separate thread so no file I/O is performed in the signal handler."""
+        Thread(target=self.dumpRingBuffer, daemon=True).start()
+        if callable(self._ringBufferPrevHandler):
+            self._ringBufferPrevHandler(signum, frame)
+
+    def dumpRingBuffer(self, dumpFile=None):
+        """@brief Append the messages held in the ring buffer to a file and empty the ring buffer.
+                  The messages are saved in the current log format (see setLogFormat()).
+           @param dumpFile The file to write to. If None the file passed to enableRingBuffer() is used.
+           @return The number of messages written."""
+        if self._ringBuffer is None:
+            return 0
+        if dumpFile is None:
+            dumpFile = self._ringBufferFile
+        # popleft() is atomic so this is safe to call from a signal handler or another thread
+        # while messages are being added.
+        recordList = []
+        try:
+            while True:
+                recordList.append(self._ringBuffer.popleft())
+        except IndexError:
+            pass
+        if recordList:
+            lineList = []
+            for recordTime, levelName, message, fields in recordList:
+                timeStamp = datetime.fromtimestamp(recordTime)
+                if self._logFormat == UIO.LOG_FORMAT_JSON:
+                    record = {}
+                    if fields:
+                        record.update(fields)
+                    record["timestamp"] = timeStamp.astimezone().isoformat(timespec="microseconds")
+                    record["level"] = levelName
+                    record["message"] = message
+                    lineList.append(_dumpJSON(record))
+                else:
+                    lineList.append("{}: {:<5} {}".format(timeStamp.strftime("%d/%m/%Y-%H:%M:%S.%f"), levelName+":", message))
+            with open(dumpFile, 'a') as fd:
+                fd.write("\n".join(lineList) + "\n")
+        return len(recordList)
+
+    def setLogFormat(self, logFormat):
+        """@brief Set the format of the log files.
+           @param logFormat UIO.LOG_FORMAT_TEXT (default) = lines of text as presented to the user.
+                            UIO.LOG_FORMAT_JSON = one JSON object per line holding the timestamp, level,
+                            message, thread name and any key/value fields passed with the message.
+                            No ANSI escape sequences are included."""
+        if logFormat not in (UIO.LOG_FORMAT_TEXT, UIO.LOG_FORMAT_JSON):
+            raise Exception("{} is an invalid log format.".format(logFormat))
+        self._logFormat = logFormat
+
+    def getLogFormat(self):
+        """@return The log format (UIO.LOG_FORMAT_TEXT or UIO.LOG_FORMAT_JSON)."""
+        return self._logFormat
+
+    def _storeJSONRecord(self, levelName, message, fields, mainLog=True, debugLog=False):
+        """@brief Save a JSON record to the log files.
+           @param levelName The level name (E.G UIO.LEVEL_INFO).
+           @param message The message text.
+           @param fields A dict of key/value fields to add to the record or None.
+           @param mainLog If True save the record to the main log file if one is defined.
+           @param debugLog If True save the record to the debug log file if one is defined."""
+        mainLog = mainLog and self._logFile
+        debugLog = debugLog and self._debugLogFile
+        if mainLog or debugLog:
+            record = {}
+            if fields:
+                record.update(fields)
+            record["timestamp"] = datetime.now().astimezone().isoformat(timespec="microseconds")
+            record["level"] = levelName
+            record["message"] = message
+            record["thread"] = current_thread().name
+            line = _dumpJSON(record)
+            if mainLog:
+                self._storeToLog(line, self._logFile, addDateTime=False)
+            if debugLog:
+                self._storeToLog(line, self._debugLogFile, addDateTime=False, symLinkFile=UIO.DEBUG_LOG_SYM_LINK)
+
     def getInput(self, prompt, noEcho=False, stripEOL=True):
         """@brief Get a line of text from the user.
            @param noEcho If True then * are printed when each character is pressed.
@@ -323,15 +661,102 @@ class UIO(object):
         """@brief Set a logfile for all output.
            @param logFile The file to send all output to.
            @return None"""
+        self.closeLogs()
         self._logFile=logFile
         self._debugLogFile = "{}.debug.txt".format(self._logFile)
 
+    def setLogBuffering(self, flushBytes=0, flushSeconds=0, background=False):
+        """@brief Set how output to the log files is buffered. The log files are held open
+                  between writes. By default every line is flushed to the log file as it is written.
+           @param flushBytes Buffered log data is written to the log file once at least this many
+                             bytes are pending (0 = not used).
+           @param flushSeconds Buffered log data is written to the log file if this many seconds have
+                               elapsed since it was last written (0 = not used).
+                               If flushBytes and flushSeconds are both 0 (default) every line is written immediately.
+                               Unless background is True this is only checked when a line is written, so the
+                               last lines before a quiet period stay buffered until the next line is written,
+                               flushLogs() or closeLogs() is called or the program exits.
+           @param background If True the log file writes are performed in a background thread so
+                             that the caller never waits for disk I/O.
+           @return None"""
+        self.closeLogs()
+        self._logFlushBytes = flushBytes
+        self._logFlushSeconds = flushSeconds
+        self._logBackgroundWrite = background
+
+    def setLogRotation(self, maxBytes=0, rotateSeconds=0, backupCount=0, compression=None):
+        """@brief Set when the log files are rotated. When a log file is rotated it is renamed with
+                  a date/time suffix and a new log file is started. Rotated log files are compressed
+                  and old rotated log files removed in a background thread.
+           @param maxBytes Rotate the log file when it reaches this size in bytes (0 = not used).
+           @param rotateSeconds Rotate the log file when it has been open for this many seconds (0 = not used).
+           @param backupCount The number of rotated log files to keep (0 = keep all).
+           @param compression None (default) = rotated files are not compressed,
+                              LogFileWriter.COMPRESSION_GZIP or LogFileWriter.COMPRESSION_ZSTD.
+                              The zstandard python module must be installed to use COMPRESSION_ZSTD.
+           @return None"""
+        LogFileWriter.CheckCompression(compression)
+        self.closeLogs()
+        self._logMaxBytes = maxBytes
+        self._logRotateSeconds = rotateSeconds
+        self._logBackupCount = backupCount
+        self._logCompression = compression
+
+    def flushLogs(self):
+        """@brief Write any buffered log data to the log files.
+           @return None"""
+        for logWriter in list(self._logWriterDict.values()):
+            logWriter.flush()
+
+    def closeLogs(self):
+        """@brief Write any buffered log data to the log files and close them. The log
+                  files are opened again if more data is logged.
+           @return None"""
+        with self._logWriterLock:
+            logWriterList = list(self._logWriterDict.values())
+            self._logWriterDict = {}
+        for logWriter in logWriterList:
+            logWriter.close()
+
+    def _getLogWriter(self, logFile, symLinkFile):
+        """@brief Get the LogFileWriter instance for a log file, creating it if required.
+           @param logFile The log file.
+           @param symLinkFile The name of the fixed symlink file to point to the latest log file.
+           @return The LogFileWriter instance."""
+        logWriter = self._logWriterDict.get(logFile)
+        if logWriter is None:
+            with self._logWriterLock:
+                logWriter = self._logWriterDict.get(logFile)
+                if logWriter is None:
+                    symLink = None
+                    # We can't create symlinks on a windows platform
+                    if platform.system() != "Windows":
+                        dirName = self._symLinkDir
+                        # if the simlink has not been set then default to the logging file
+                        if dirName is None:
+                            dirName = os.path.dirname(logFile)
+                        symLink = os.path.join(dirName, symLinkFile)
+                    logWriter = LogFileWriter(logFile,
+                                              symLink=symLink,
+                                              flushBytes=self._logFlushBytes,
+                                              flushSeconds=self._logFlushSeconds,
+                                              background=self._logBackgroundWrite,
+                                              maxBytes=self._logMaxBytes,
+                                              rotateSeconds=self._logRotateSeconds,
+                                              backupCount=self._logBackupCount,
+                                              compression=self._logCompression)
+                    self._logWriterDict[logFile] = logWriter
+        return logWriter
+
     def storeToLog(self, text, addLF=True, addDateTime=True):
         """@brief Save the text to the main log file if one is defined.
            @param text The text to be saved.
            @param addLF If True then a line feed is added to the output in the log file.
            @return None"""
-        self._storeToLog(text, self._logFile, addLF=addLF, addDateTime=addDateTime)
+        if self._logFormat == UIO.LOG_FORMAT_JSON:
+            self._storeJSONRecord(UIO.LEVEL_LOG, UIO.RemoveEscapeSeq(text), None, mainLog=True)
+        else:
+            self._storeToLog(text, self._logFile, addLF=addLF, addDateTime=addDateTime)
 
     def storeToDebugLog(self, text, addLF=True, addDateTime=True):
         """@brief Save the text to the debug log file if one is defined. This file holds all the
@@ -339,7 +764,21 @@ class UIO(object):
            @param text The text to be saved.
            @param addLF If True then a line feed is added to the output in the log file.
            @return None"""
-        self._storeToLog(text, self._debugLogFile, addLF=addLF, addDateTime=addDateTime, symLinkFile=UIO.DEBUG_LOG_SYM_LINK)
+        if self._logFormat == UIO.LOG_FORMAT_JSON:
+            self._storeJSONRecord(UIO.LEVEL_LOG, UIO.RemoveEscapeSeq(text), None, mainLog=False, debugLog=True)
+        else:
+            self._storeToLog(text, self._debugLogFile, addLF=addLF, addDateTime=addDateTime, symLinkFile=UIO.DEBUG_LOG_SYM_LINK)
+
+    def _storeLinesToLog(self, lineList, logFile, symLinkFile):
+        """@brief Save a number of lines of text to a log file (if defined) in a single write.
+           @param lineList The lines of text to be saved.
+           @param logFile The logFile to save data to.
+           @param symLinkFile The name of the fixed symlink file to point to the latest log file.
+           @return None"""
+        if logFile and lineList:
+            timeStr = datetime.now().strftime("%d/%m/%Y-%H:%M:%S.%f")
+            text = "".join(["{}: {}\n".format(timeStr, line) for line in lineList])
+            self._getLogWriter(logFile, symLinkFile).write(text)
 
     def _storeToLog(self, text, logFile, addLF=True, addDateTime=True, symLinkFile=USER_LOG_SYM_LINK):
         """@brief Save the text to the log file if one is defined.
@@ -348,37 +787,15 @@ class UIO(object):
            @param addLF If True then a line feed is added to the output in the log file.
            @param symLinkFile The name of the fixed symlink file to point to the latest log file.
            @return None"""
-        createSymLink = False
         if logFile:
             if addDateTime:
                 timeStr = datetime.now().strftime("%d/%m/%Y-%H:%M:%S.%f")
-                text = "{}: {}".format(strftime(timeStr, localtime()).lower(), text)
-
-            # If the log file is about to be created then we will create a symlink
-            # to the file.
-            if not os.path.isfile(logFile):
-                # We can't create symlinks on a windows platform
-                if platform.system() != "Windows":
-                    createSymLink = True
-
-            with open(logFile, 'a') as fd:
-                if addLF:
-                    fd.write("{}\n".format(text))
-                else:
-                    fd.write(text)
-
-            if createSymLink:
-                #This is helpful as the link will point to the latest log file
-                #which can be useful when debugging. I.E  no need to find the
-                #name of the latest file.
-                dirName = self._symLinkDir
-                # if the simlink has not been set then default to the logging file
-                if dirName is None:
-                    dirName = os.path.dirname(logFile)
-                absSymLink = os.path.join(dirName, symLinkFile)
-                if os.path.lexists(absSymLink):
-                    os.remove(absSymLink)
-                os.symlink(logFile, absSymLink)
+                text = "{}: {}".format(timeStr, text)
+
+            if addLF:
+                text = text + "\n"
+
+            self._getLogWriter(logFile, symLinkFile).write(text)
 
     def showProgBar(self, barChar='*'):
         """@brief Show a bar that grows and shrinks to indicate an activity is occuring."""
@@ -422,10 +839,20 @@ class UIO(object):
             pass
         return username
 
-    def enableSyslog(self, enabled, host="localhost", programName=None):
-        """@brief Enable/disable syslog.
+    def enableSyslog(self, enabled, host="localhost", programName=None, port=514, transport=None, rfc5424=False):
+        """@brief Enable/disable syslog. Syslog messages are queued and sent by a background thread
+                  so that logging does not wait for the syslog server.
            @param enabled If True then syslog is enabled.
-           @param syslogProgramName The name of the program that is being logged. If defined this appears after the username in the syslog output."""
+           @param host The syslog server address.
+           @param syslogProgramName The name of the program that is being logged. If defined this appears after the username in the syslog output.
+           @param port The syslog server port.
+           @param transport SyslogHandler.TRANSPORT_UDP, TRANSPORT_TCP or TRANSPORT_UNIX. If None (default)
+                            the local syslog socket is used for localhost if available, else UDP.
+           @param rfc5424 If True then messages are sent in RFC 5424 format."""
+        if self._syslogHandler:
+            self._syslogHandler.close()
+            self._syslogHandler = None
+
         self._sysLogEnabled = enabled
         self._sysLogHost = host
         if programName:
@@ -433,6 +860,14 @@ class UIO(object):
         else:
             self._syslogProgramName = sys.argv[0]
 
+        if enabled:
+            self._syslogHandler = SyslogHandler(host=host,
+                                                port=port,
+                                                username=self.getCurrentUsername(),
+                                                programName=self._syslogProgramName,
+                                                transport=transport,
+                                                rfc5424=rfc5424)
+
     def _update_syslog(self, pri, msg):
         """Send a message to syslog is syslog is enabled
         Syslog messages will have the following components
@@ -445,80 +880,589 @@ class UIO(object):
 
         The syslog messages will be prefixed withj the application name
         """
-        if self._sysLogEnabled:
-            aMsg=msg
-            #Ensure we have no 0x00 characters in the message.
-            # syslog will throw an error if it finds any
-            if "\x00" in aMsg:
-                aMsg=aMsg.replace("\x00", "")
-
-            #Attempt to get the src IP address for syslog messages.
-            srcIP = ""
-            try:
-                netIF = NetIF()
-                srcIP = netIF.getLocalNetworkAddress()
-            except:
-                pass
-
-            try:
-                if self._syslogProgramName:
-                    idString = str(self.getCurrentUsername()) + "-" + self._syslogProgramName
-                else:
-                    idString = str(self.getCurrentUsername())
-                #send aMsg to syslog with the current process ID and username
-                syslog(pri, "%s %d %s: %s" % (srcIP, os.getpid(), idString, str(aMsg) ), host=self._sysLogHost )
-            #Ignore if se can't resolve address. We don't really syslog want errors to stop the user interface
-            except:
-                pass
+        if self._sysLogEnabled and self._syslogHandler:
+            self._syslogHandler.send(pri, msg)
 
-    def showTable(self, table, rowSeparatorChar = "-", colSeparatorChar = "|"):
-        """@brief Show the contents of a table to the user.
-           @param table This must be a list. Each list element must be a table row (list).
-                        Each element in each row must be a string.
-           @param rowSeparatorChar The character used for horizontal lines to separate table rows.
-           @param colSeparatorChar The character used to separate table columns."""
-        columnWidths = []
-        # Check we have a table to display
-        if len(table) == 0:
+    @staticmethod
+    def GetTableColumnWidths(rowList):
+        """@brief Check the rows of a table and get the width of each column.
+           @param rowList A list of table rows. Each row must be a list (or tuple) of strings
+                          and all rows must have the same number of columns.
+           @return A list of the maximum width of each column."""
+        if len(rowList) == 0:
             raise Exception("No table rows to display")
 
         # Check all rows have the same number of columns in the table
-        colCount = len(table[0])
-        for row in table:
+        colCount = len(rowList[0])
+        for row in rowList:
             if len(row) != colCount:
                 raise Exception(f"{str(row)} column count different from first row ({colCount})")
 
-        for row in table:
-            for col in row:
-                if not isinstance(col, str):
-                    raise Exception(f"Table column is not a string: {col} in {row}")
-
-        # Get the max width for each column
-        for col in range(0,colCount):
-            maxWidth=0
-            for row in table:
-                if len(row[col]) > maxWidth:
-                    maxWidth = len(row[col])
-            columnWidths.append(maxWidth)
+        columnWidths = []
+        for column in zip(*rowList):
+            if not all(map(isinstance, column, repeat(str))):
+                for row in rowList:
+                    for col in row:
+                        if not isinstance(col, str):
+                            raise Exception(f"Table column is not a string: {col} in {row}")
+            columnWidths.append(max(map(len, column)))
+        return columnWidths
 
+    @staticmethod
+    def GetTableLines(rows, columnWidths, rowSeparatorChar = "-", colSeparatorChar = "|"):
+        """@brief Get the lines of text that make up a table.
+           @param rows An iterable (E.G a list or generator) of table rows. Each row must be a list
+                       (or tuple) of strings with the same number of columns as columnWidths.
+           @param columnWidths A list of the width of each column (see GetTableColumnWidths()).
+                               Columns wider than this widen the row they are in.
+           @param rowSeparatorChar The character used for horizontal lines to separate table rows.
+           @param colSeparatorChar The character used to separate table columns.
+           @return A generator that yields each line of the table. The first line is the top line of the table
+                   and each table row is followed by a row separator line."""
+        colCount = len(columnWidths)
         tableWidth = 1
         for columnWidth in columnWidths:
             tableWidth += columnWidth + 3 # Space each side of the column + a column divider character
+        separatorLine = rowSeparatorChar*tableWidth
+
+        # Build the format string for a row once rather than building each row by concatenation.
+        escapedColSeparator = colSeparatorChar.replace("{", "{{").replace("}", "}}")
+        rowFormat = escapedColSeparator + "".join([" {:>%d} %s" % (columnWidth, escapedColSeparator) for columnWidth in columnWidths])
 
-        # Add the top line of the table
-        self.info(rowSeparatorChar*tableWidth)
-
-        # The starting row index
-        for rowIndex in range(0, len(table)):
-            rowText = colSeparatorChar
-            colIndex = 0
-            for col in table[rowIndex]:
-                colWidth = columnWidths[colIndex]
-                rowText = rowText + " " + f"{col:>{colWidth}s}" + " " + colSeparatorChar
-                colIndex += 1
-            self.info(rowText)
-            # Add the row separator line
-            self.info(rowSeparatorChar*tableWidth)
+        yield separatorLine
+        for row in rows:
+            if len(row) != colCount:
+                raise Exception(f"{str(row)} column count different from first row ({colCount})")
+            if not all(map(isinstance, row, repeat(str))):
+                raise Exception(f"Table column is not a string in {row}")
+            yield rowFormat.format(*row)
+            yield separatorLine
+
+    def showTable(self, table, rowSeparatorChar = "-", colSeparatorChar = "|", sampleRowCount=0, pageRowCount=0, pause=False):
+        """@brief Show the contents of a table to the user.
+           @param table A list (or any iterable, E.G a generator) of table rows. Each row must be a list.
+                        Each element in each row must be a string.
+           @param rowSeparatorChar The character used for horizontal lines to separate table rows.
+           @param colSeparatorChar The character used to separate table columns.
+           @param sampleRowCount If 0 (default) all rows are read to find the width of each column.
+                                 If > 0 the column widths are found from this many rows and the remaining
+                                 rows are rendered as they are read so the table need not be held in memory.
+                                 A later row with a column wider than the sampled width is widened.
+           @param pageRowCount If 0 (default) the table is output in one write once it has been rendered.
+                               If > 0 the table is output every pageRowCount rows.
+           @param pause If True and pageRowCount > 0 the user must press enter before the next
+                        page is shown or enter q to stop showing the table."""
+        rowIter = iter(table)
+        if sampleRowCount > 0:
+            sampleRowList = list(islice(rowIter, sampleRowCount))
+        else:
+            sampleRowList = list(rowIter)
+        columnWidths = UIO.GetTableColumnWidths(sampleRowList)
+
+        lineList = []
+        pageRows = 0
+        tableLines = UIO.GetTableLines(chain(sampleRowList, rowIter), columnWidths, rowSeparatorChar=rowSeparatorChar, colSeparatorChar=colSeparatorChar)
+        for lineIndex, line in enumerate(tableLines):
+            lineList.append(line)
+            # Line 0 is the top line of the table. Each table row is followed by a separator line.
+            if pageRowCount > 0 and lineIndex > 0 and lineIndex % 2 == 0:
+                pageRows += 1
+                if pageRows >= pageRowCount:
+                    self._infoLines(lineList)
+                    lineList = []
+                    pageRows = 0
+                    if pause and self.getInput("Press enter to continue or q to quit").lower() == 'q':
+                        return
+
+        if lineList:
+            self._infoLines(lineList)
+
+    def span(self, name):
+        """@brief Time a section of code and record the duration in a histogram for the name.
+                  This may be used as a context manager (with uio.span("connect"): ...) or as a
+                  function decorator (@uio.span("connect")).
+           @param name The name of the span. Durations of all spans with the same name are recorded together.
+           @return A Span instance."""
+        return Span(self, name)
+
+    def recordSpan(self, name, durationSeconds):
+        """@brief Record the duration of a span.
+           @param name The name of the span.
+           @param durationSeconds The duration in seconds."""
+        with self._spanLock:
+            spanHistogram = self._spanHistogramDict.get(name)
+            if spanHistogram is None:
+                spanHistogram = SpanHistogram()
+                self._spanHistogramDict[name] = spanHistogram
+            spanHistogram.add(durationSeconds)
+
+    def getSpanStats(self):
+        """@brief Get the statistics of all the spans recorded.
+           @return A dict keyed by span name. Each value is a dict with the count, total, p50, p95, p99 and max
+                   durations in seconds. Percentiles are accurate to within SpanHistogram.BUCKET_RATIO."""
+        with self._spanLock:
+            return {name: spanHistogram.getStats() for name, spanHistogram in self._spanHistogramDict.items()}
+
+    def resetSpanStats(self):
+        """@brief Discard all the span durations recorded."""
+        with self._spanLock:
+            self._spanHistogramDict = {}
+
+    def showSpanStats(self):
+        """@brief Show a table of the span statistics to the user. Times are in milliseconds."""
+        spanStatsDict = self.getSpanStats()
+        if not spanStatsDict:
+            self.info("No spans recorded.")
+            return
+        table = [["Span", "Count", "Total ms", "p50 ms", "p95 ms", "p99 ms", "Max ms"]]
+        for name in sorted(spanStatsDict):
+            stats = spanStatsDict[name]
+            row = [str(name), str(stats["count"])]
+            for statName in ("total", "p50", "p95", "p99", "max"):
+                row.append("{:.3f}".format(stats[statName]*1000))
+            table.append(row)
+        self.showTable(table)
+
+class Span(object):
+    """@brief Responsible for timing a section of code. Created by UIO.span()."""
+
+    def __init__(self, uio, name):
+        """@brief Constructor
+           @param uio The UIO instance that records the span durations.
+           @param name The span name."""
+        self._uio   = uio
+        self._name  = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self._uio.recordSpan(self._name, perf_counter()-self._start)
+        return False
+
+    def __call__(self, method):
+        """@brief Allow a Span to be used as a decorator. Each call is timed separately so the
+                  decorated method may be called recursively or from several threads."""
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._uio.recordSpan(self._name, perf_counter()-start)
+        return wrapper
+
+class SpanHistogram(object):
+    """@brief Responsible for holding a histogram of durations in logarithmic buckets so that
+              percentiles can be found without holding every duration in memory."""
+
+    MIN_SECONDS         = 1E-7  # Durations shorter than this are held in the first bucket.
+    BUCKET_RATIO        = 1.02  # Each bucket is 2% wider than the previous one.
+    LOG_BUCKET_RATIO    = math.log(BUCKET_RATIO)
+
+    def __init__(self):
+        """@brief Constructor"""
+        self._bucketDict    = {}
+        self._count         = 0
+        self._total         = 0.0
+        self._max           = 0.0
+
+    def add(self, durationSeconds):
+        """@brief Add a duration to the histogram.
+           @param durationSeconds The duration in seconds."""
+        if durationSeconds > SpanHistogram.MIN_SECONDS:
+            index = int(math.log(durationSeconds/SpanHistogram.MIN_SECONDS)/SpanHistogram.LOG_BUCKET_RATIO)
+        else:
+            index = 0
+        self._bucketDict[index] = self._bucketDict.get(index, 0) + 1
+        self._count += 1
+        self._total += durationSeconds
+        if durationSeconds > self._max:
+            self._max = durationSeconds
+
+    def getPercentile(self, percentile):
+        """@brief Get a percentile of the durations.
+           @param percentile The percentile (0 - 100).
+           @return The duration in seconds. This is the upper limit of the bucket holding the percentile."""
+        if self._count == 0:
+            return 0.0
+        rank = self._count*percentile/100.0
+        cumulativeCount = 0
+        for index in sorted(self._bucketDict):
+            cumulativeCount += self._bucketDict[index]
+            if cumulativeCount >= rank:
+                return min(SpanHistogram.MIN_SECONDS*SpanHistogram.BUCKET_RATIO**(index+1), self._max)
+        return self._max
+
+    def getStats(self):
+        """@return A dict with the count, total, p50, p95, p99 and max durations."""
+        return {"count":    self._count,
+                "total":    self._total,
+                "p50":      self.getPercentile(50),
+                "p95":      self.getPercentile(95),
+                "p99":      self.getPercentile(99),
+                "max":      self._max}
+
+class MessageLimiter(object):
+    """@brief Responsible for deciding which messages are suppressed to limit the rate of messages
+              with the same key and to collapse runs of duplicate messages."""
+
+    MAX_KEYS = 1000
+
+    def __init__(self, maxMessages=0, periodSeconds=1.0, collapseDuplicates=False):
+        """@brief Constructor
+           @param maxMessages The maximum number of messages with the same key allowed every periodSeconds. 0 = no rate limit.
+           @param periodSeconds The rate limit period in seconds.
+           @param collapseDuplicates If True a message the same as the previous message is suppressed."""
+        self._maxMessages           = maxMessages
+        self._periodSeconds         = periodSeconds
+        self._collapseDuplicates    = collapseDuplicates
+        self._lock                  = Lock()
+        self._keyDict               = {}    # (level name, key): [period start time, message count, suppressed count]
+        self._suppressedKeySet      = set() # The keys in _keyDict with a suppressed count > 0
+        self._lastLevelName         = None
+        self._lastText              = None
+        self._repeatCount           = 0
+
+    def check(self, levelName, key, text):
+        """@brief Check if a message should be suppressed.
+           @param levelName The message level name.
+           @param key The message key. Messages with the same level and key share a rate limit.
+           @param text The message text.
+           @return A tuple
+                   0 = True if the message should be suppressed.
+                   1 = A list of (level name, notice text) tuples summarising previously suppressed
+                       messages that should be output before this message. When a message is output
+                       this includes every key whose rate limit period has ended, not just this key."""
+        noticeList = []
+        with self._lock:
+            if self._collapseDuplicates and text == self._lastText and levelName == self._lastLevelName:
+                self._repeatCount += 1
+                return True, noticeList
+
+            if self._maxMessages > 0:
+                now = time()
+                dictKey = (levelName, key)
+                keyState = self._keyDict.get(dictKey)
+                if keyState is None or now - keyState[0] >= self._periodSeconds:
+                    if keyState is None and len(self._keyDict) >= MessageLimiter.MAX_KEYS:
+                        noticeList = self._purge(now)
+                    noticeList += self._getExpiredNotices(now)
+                    self._keyDict[dictKey] = [now, 1, 0]
+
+                elif keyState[1] < self._maxMessages:
+                    keyState[1] += 1
+                    noticeList = self._getExpiredNotices(now)
+
+                else:
+                    keyState[2] += 1
+                    self._suppressedKeySet.add(dictKey)
+                    return True, noticeList
+
+            if self._collapseDuplicates:
+                if self._repeatCount > 0:
+                    noticeList.insert(0, (self._lastLevelName, self._getRepeatNotice(self._repeatCount)) )
+                self._lastLevelName = levelName
+                self._lastText = text
+                self._repeatCount = 0
+
+        return False, noticeList
+
+    def getNotices(self):
+        """@brief Get notices summarising all messages suppressed so far and reset the counts.
+           @return A list of (level name, notice text) tuples."""
+        noticeList = []
+        with self._lock:
+            if self._repeatCount > 0:
+                noticeList.append( (self._lastLevelName, self._getRepeatNotice(self._repeatCount)) )
+                self._repeatCount = 0
+            for (levelName, key), keyState in self._keyDict.items():
+                if keyState[2] > 0:
+                    noticeList.append( (levelName, self._getSuppressedNotice(key, keyState[2])) )
+                    keyState[2] = 0
+            self._suppressedKeySet = set()
+        return noticeList
+
+    def _getExpiredNotices(self, now):
+        """@brief Get notices for the keys that have suppressed messages and whose rate limit period has
+                  ended and reset their suppressed counts. Called with the lock held.
+           @param now The current time.
+           @return A list of (level name, notice text) tuples."""
+        noticeList = []
+        for dictKey in list(self._suppressedKeySet):
+            keyState = self._keyDict[dictKey]
+            if now - keyState[0] >= self._periodSeconds:
+                noticeList.append( (dictKey[0], self._getSuppressedNotice(dictKey[1], keyState[2])) )
+                keyState[2] = 0
+                self._suppressedKeySet.discard(dictKey)
+        return noticeList
+
+    def _getRepeatNotice(self, repeatCount):
+        """@return The notice text for a run of duplicate messages."""
+        return "Last message repeated {} times.".format(repeatCount)
+
+    def _getSuppressedNotice(self, key, suppressedCount):
+        """@return The notice text for rate limited messages."""
+        return "{} messages like '{}' suppressed (limit {} per {} seconds).".format(suppressedCount, key, self._maxMessages, self._periodSeconds)
+
+    def _purge(self, now):
+        """@brief Remove keys whose rate limit period has expired without suppressing any messages.
+                  If there are still too many keys they are all removed. Called with the lock held.
+           @param now The current time.
+           @return A list of (level name, notice text) tuples summarising the suppressed messages of
+                   the keys removed so that their counts are not lost."""
+        noticeList = []
+        for dictKey, keyState in list(self._keyDict.items()):
+            if now - keyState[0] >= self._periodSeconds and keyState[2] == 0:
+                del self._keyDict[dictKey]
+        if len(self._keyDict) >= MessageLimiter.MAX_KEYS:
+            for dictKey in self._suppressedKeySet:
+                noticeList.append( (dictKey[0], self._getSuppressedNotice(dictKey[1], self._keyDict[dictKey][2])) )
+            self._keyDict = {}
+            self._suppressedKeySet = set()
+        return noticeList
+
+class LogFileWriter(object):
+    """@brief Responsible for writing text to a log file. The log file is held open between
+              writes rather than being opened and closed for every line. Text is buffered
+              until flushBytes of text is pending or flushSeconds have elapsed since the last
+              write to the file. Optionally the file writes are performed in a background
+              thread. Any buffered text is written when the program exits.
+
+              The log file maybe rotated on size and/or age. Rotated log files are compressed
+              and removed once more than backupCount exist in a background thread."""
+
+    COMPRESSION_GZIP        = "gzip"
+    COMPRESSION_ZSTD        = "zstd"
+    COMPRESSION_SUFFIX_DICT = {COMPRESSION_GZIP: ".gz", COMPRESSION_ZSTD: ".zst"}
+    ROTATED_TIME_FORMAT     = "%Y%m%d-%H%M%S-%f"
+
+    @staticmethod
+    def CheckCompression(compression):
+        """@brief Check that a log file compression type is valid and available.
+           @param compression None, LogFileWriter.COMPRESSION_GZIP or LogFileWriter.COMPRESSION_ZSTD."""
+        if compression is None or compression == LogFileWriter.COMPRESSION_GZIP:
+            return
+
+        if compression == LogFileWriter.COMPRESSION_ZSTD:
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception("The zstandard python module must be installed to use zstd log file compression.")
+            return
+
+        raise Exception("{} is an invalid log file compression type.".format(compression))
+
+    @staticmethod
+    def CompressFile(srcFile, compression):
+        """@brief Compress a file. The compressed file has the compression suffix added to the
+                  file name and the source file is removed.
+           @param srcFile The file to compress.
+           @param compression LogFileWriter.COMPRESSION_GZIP or LogFileWriter.COMPRESSION_ZSTD.
+           @return The compressed file."""
+        dstFile = srcFile + LogFileWriter.COMPRESSION_SUFFIX_DICT[compression]
+        # Compress to a tmp file so that an interrupted compression does not leave a truncated file.
+        tmpFile = dstFile + ".tmp"
+        with open(srcFile, 'rb') as srcFd:
+            if compression == LogFileWriter.COMPRESSION_ZSTD:
+                import zstandard
+                with open(tmpFile, 'wb') as dstFd:
+                    zstandard.ZstdCompressor().copy_stream(srcFd, dstFd)
+            else:
+                with gzip.open(tmpFile, 'wb') as dstFd:
+                    shutil.copyfileobj(srcFd, dstFd)
+        os.rename(tmpFile, dstFile)
+        os.remove(srcFile)
+        return dstFile
+
+    def __init__(self, logFile, symLink=None, flushBytes=0, flushSeconds=0, background=False,
+                 maxBytes=0, rotateSeconds=0, backupCount=0, compression=None):
+        """@brief Constructor
+           @param logFile The log file to append text to.
+           @param symLink If defined then when the log file is created a symlink of this name
+                          is created pointing to it.
+           @param flushBytes Buffered text is written to the log file once at least this many
+                             bytes are pending (0 = not used).
+           @param flushSeconds Buffered text is written to the log file if this many seconds have
+                               elapsed since it was last written (0 = not used).
+                               If flushBytes and flushSeconds are both 0 (default) all text is written immediately.
+                               Unless background is True this is only checked by write(), so text written
+                               before a quiet period stays buffered until the next write(), flush() or close().
+           @param background If True a background thread performs the log file writes.
+           @param maxBytes Rotate the log file when it reaches this size in bytes (0 = not used).
+           @param rotateSeconds Rotate the log file when it has been open for this many seconds (0 = not used).
+           @param backupCount The number of rotated log files to keep (0 = keep all).
+           @param compression None (default) = rotated files are not compressed,
+                              LogFileWriter.COMPRESSION_GZIP or LogFileWriter.COMPRESSION_ZSTD."""
+        LogFileWriter.CheckCompression(compression)
+        self._logFile           = logFile
+        self._symLink           = symLink
+        self._flushBytes        = flushBytes
+        self._flushSeconds      = flushSeconds
+        self._background        = background
+        self._lock              = Lock()    # Protects the pending text list
+        self._ioLock            = Lock()    # Serialises writes to the log file
+        self._pendingList       = []
+        self._pendingBytes      = 0
+        self._lastFlushTime     = time()
+        self._fd                = None
+        self._closed            = False
+        self._wakeEvent         = Event()
+        self._thread            = None
+        self._maxBytes          = maxBytes
+        self._rotateSeconds     = rotateSeconds
+        self._backupCount       = backupCount
+        self._compression       = compression
+        self._fileBytes         = 0
+        self._openTime          = None
+        self._housekeepingThread= None
+        rotatedFilePattern      = re.escape(os.path.basename(logFile)) + r"\.\d{8}-\d{6}-\d{6}"
+        if compression:
+            rotatedFilePattern += re.escape(LogFileWriter.COMPRESSION_SUFFIX_DICT[compression]) + "?"
+        self._rotatedFileRegex  = re.compile(rotatedFilePattern + "$")
+        if self._background:
+            self._thread = Thread(target=self._writeThread, daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def getLogFile(self):
+        """@return The log file."""
+        return self._logFile
+
+    def write(self, text):
+        """@brief Write text to the log file.
+           @param text The text to write."""
+        with self._lock:
+            self._pendingList.append(text)
+            self._pendingBytes += len(text)
+            if self._flushBytes <= 0 and self._flushSeconds <= 0:
+                flushNow = True
+            else:
+                flushNow = (self._flushBytes > 0 and self._pendingBytes >= self._flushBytes) or \
+                           (self._flushSeconds > 0 and time() - self._lastFlushTime >= self._flushSeconds)
+
+        if flushNow:
+            if self._thread:
+                self._wakeEvent.set()
+            else:
+                self.flush()
+
+    def flush(self):
+        """@brief Write all pending text to the log file."""
+        with self._ioLock:
+            with self._lock:
+                pendingList = self._pendingList
+                self._pendingList = []
+                self._pendingBytes = 0
+                self._lastFlushTime = time()
+
+            if pendingList:
+                if self._fd is None:
+                    self._open()
+                data = "".join(pendingList)
+                self._fd.write(data)
+                self._fd.flush()
+                self._fileBytes += len(data)
+
+                if self._rotateDue():
+                    self._rotate()
+
+    def close(self):
+        """@brief Write all pending text to the log file and close it."""
+        self._closed = True
+        self._wakeEvent.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._ioLock:
+            if self._fd:
+                self._fd.close()
+                self._fd = None
+        housekeepingThread = self._housekeepingThread
+        if housekeepingThread:
+            housekeepingThread.join()
+        atexit.unregister(self.close)
+
+    def _open(self):
+        """@brief Open the log file for appending. If the log file does not exist the
+                  symlink (if defined) is updated to point to it."""
+        createSymLink = self._symLink and not os.path.isfile(self._logFile)
+
+        self._fd = open(self._logFile, 'a')
+        self._fileBytes = os.fstat(self._fd.fileno()).st_size
+        self._openTime = time()
+
+        if createSymLink:
+            #This is helpful as the link will point to the latest log file
+            #which can be useful when debugging. I.E  no need to find the
+            #name of the latest file.
+            if os.path.lexists(self._symLink):
+                os.remove(self._symLink)
+            os.symlink(self._logFile, self._symLink)
+
+    def _rotateDue(self):
+        """@return True if the log file should be rotated."""
+        if self._maxBytes > 0 and self._fileBytes >= self._maxBytes:
+            return True
+
+        if self._rotateSeconds > 0 and time() - self._openTime >= self._rotateSeconds:
+            return True
+
+        return False
+
+    def _rotate(self):
+        """@brief Rotate the log file. The caller must hold the io lock. The next write
+                  creates a new log file and updates the symlink to point to it."""
+        self._fd.close()
+        self._fd = None
+        rotatedFile = "{}.{}".format(self._logFile, datetime.now().strftime(LogFileWriter.ROTATED_TIME_FORMAT))
+        os.rename(self._logFile, rotatedFile)
+
+        if self._compression or self._backupCount > 0:
+            # Compress and remove old log files in the background so that the caller does not wait.
+            previousThread = self._housekeepingThread
+            self._housekeepingThread = Thread(target=self._housekeeping, args=(rotatedFile, previousThread), daemon=True)
+            self._housekeepingThread.start()
+
+    def _housekeeping(self, rotatedFile, previousThread):
+        """@brief Compress a rotated log file and remove the oldest rotated log files.
+           @param rotatedFile The log file that has just been rotated.
+           @param previousThread The previous housekeeping thread or None. We wait for this
+                                 to complete so that rotated files are processed in order."""
+        if previousThread:
+            previousThread.join()
+
+        try:
+            if self._compression:
+                LogFileWriter.CompressFile(rotatedFile, self._compression)
+
+            if self._backupCount > 0:
+                logDir = os.path.dirname(self._logFile)
+                # The date/time suffix ensures the names sort oldest first.
+                rotatedFileList = sorted(fileName for fileName in os.listdir(logDir if logDir else ".") if self._rotatedFileRegex.match(fileName))
+                for fileName in rotatedFileList[:-self._backupCount]:
+                    os.remove(os.path.join(logDir, fileName))
+
+        # Don't let a housekeeping error stop logging.
+        except Exception:
+            pass
+
+    def _writeThread(self):
+        """@brief Write pending text to the log file when it is due until closed."""
+        while not self._closed:
+            if self._flushSeconds > 0:
+                self._wakeEvent.wait(self._flushSeconds)
+            else:
+                self._wakeEvent.wait()
+            self._wakeEvent.clear()
+            try:
+                self.flush()
+            # Don't let a log file write error kill the thread. We try again next time.
+            except Exception:
+                pass
 
 class ConsoleMenu(object):
     """@brief Responsible for presenting a list of options to the user on a
@@ -631,3 +1575,215 @@ def syslog(priority, message, facility=FACILITY.LOCAL0, host='localhost', port=5
 
     finally:
         lock.release()
+
+class SyslogHandler(object):
+    """@brief Responsible for sending messages to a syslog server without delaying the caller.
+              Messages are queued and a background thread sends them in batches over a
+              persistent socket. The source IP address, PID and identity string are
+              determined once and refreshed periodically (or after a send error or fork)
+              rather than for every message."""
+
+    TRANSPORT_UDP               = "udp"
+    TRANSPORT_TCP               = "tcp"
+    TRANSPORT_UNIX              = "unix"
+    UNIX_SOCKET_PATH            = "/dev/log"
+    LOCAL_IDENT                 = "PJA"
+    MAX_QUEUE_SIZE              = 10000
+    MAX_BATCH_SIZE              = 100
+    IDENTITY_REFRESH_SECONDS    = 60
+    RFC5424_MAX_APP_NAME_LENGTH = 48
+
+    def __init__(self, host="localhost", port=514, username="unknown_user", programName=None, transport=None,
+                 rfc5424=False, facility=FACILITY.LOCAL0, maxQueueSize=MAX_QUEUE_SIZE):
+        """@brief Constructor
+           @param host The syslog server address.
+           @param port The syslog server port.
+           @param username The username under which the program is being executed.
+           @param programName The name of the program that is being logged.
+           @param transport TRANSPORT_UDP, TRANSPORT_TCP or TRANSPORT_UNIX. If None (default) the local
+                            syslog socket is used for localhost if available, else UDP.
+           @param rfc5424 If True messages are sent in RFC 5424 format (octet counted over TCP).
+           @param facility The syslog facility.
+           @param maxQueueSize The maximum number of messages waiting to be sent. Messages sent
+                               while the queue is full are dropped."""
+        if transport is None:
+            transport = SyslogHandler.TRANSPORT_UDP
+            if host in ("localhost", "127.0.0.1", None) and os.path.exists(SyslogHandler.UNIX_SOCKET_PATH):
+                transport = SyslogHandler.TRANSPORT_UNIX
+
+        if transport not in (SyslogHandler.TRANSPORT_UDP, SyslogHandler.TRANSPORT_TCP, SyslogHandler.TRANSPORT_UNIX):
+            raise Exception("{} is an invalid syslog transport.".format(transport))
+
+        self._host              = host if host else "localhost"
+        self._port              = port
+        self._transport         = transport
+        self._rfc5424           = rfc5424
+        self._facility          = facility
+        self._maxQueueSize      = maxQueueSize
+        if programName:
+            self._idString      = str(username) + "-" + programName
+        else:
+            self._idString      = str(username)
+        self._appName           = "".join(c if 33 <= ord(c) <= 126 else "_" for c in self._idString)[:SyslogHandler.RFC5424_MAX_APP_NAME_LENGTH]
+        self._srcIP             = ""
+        self._hostname          = "-"
+        self._identityTime      = None
+        self._sock              = None
+        self._droppedCount      = 0
+        self._errorCount        = 0
+        self._pid               = None
+        self._queue             = None
+        self._thread            = None
+        self._start()
+        atexit.register(self.close)
+
+    def _start(self):
+        """@brief Start the thread that sends queued messages. This is also called if we find
+                  we are running in a forked process as the thread does not survive the fork."""
+        self._pid               = os.getpid()
+        self._queue             = Queue(self._maxQueueSize)
+        self._sock              = None
+        self._identityTime      = None
+        self._thread            = Thread(target=self._sendThread, daemon=True)
+        self._thread.start()
+
+    def send(self, priority, message):
+        """@brief Queue a message to be sent to the syslog server. This never blocks.
+           @param priority The syslog priority level.
+           @param message The text message to be sent."""
+        if os.getpid() != self._pid:
+            self._start()
+        try:
+            self._queue.put_nowait( (priority, message, time()) )
+        except Full:
+            self._droppedCount += 1
+
+    def close(self, timeout=5):
+        """@brief Send any queued messages and stop the send thread.
+           @param timeout The maximum time in seconds to wait for queued messages to be sent."""
+        if self._thread and self._pid == os.getpid():
+            try:
+                self._queue.put(None, timeout=timeout)
+                self._thread.join(timeout)
+            except Full:
+                pass
+        self._thread = None
+        self._closeSocket()
+        atexit.unregister(self.close)
+
+    def getDroppedCount(self):
+        """@return The number of messages dropped because the queue was full."""
+        return self._droppedCount
+
+    def getErrorCount(self):
+        """@return The number of batches of messages that could not be sent."""
+        return self._errorCount
+
+    def _refreshIdentity(self):
+        """@brief Determine the source IP address and hostname used in syslog messages."""
+        try:
+            self._srcIP = NetIF().getLocalNetworkAddress()
+        except Exception:
+            self._srcIP = ""
+        self._hostname = self._srcIP if self._srcIP else gethostname()
+        if not self._hostname:
+            self._hostname = "-"
+        self._identityTime = time()
+
+    def _getSocket(self):
+        """@return The socket connected to the syslog server, created if required."""
+        if self._sock is None:
+            if self._transport == SyslogHandler.TRANSPORT_UNIX:
+                sock = socket(AF_UNIX, SOCK_DGRAM)
+                sock.connect(SyslogHandler.UNIX_SOCKET_PATH)
+
+            elif self._transport == SyslogHandler.TRANSPORT_TCP:
+                sock = socket(AF_INET, SOCK_STREAM)
+                sock.connect((self._host, self._port))
+
+            else:
+                sock = socket(AF_INET, SOCK_DGRAM)
+            self._sock = sock
+        return self._sock
+
+    def _closeSocket(self):
+        """@brief Close the socket to the syslog server if open."""
+        if self._sock:
+            try:
+                self._sock.close()
+            except Exception:
+                pass
+            self._sock = None
+
+    def _frame(self, priority, message, timeStamp):
+        """@brief Build the bytes to be sent for a syslog message.
+           @param priority The syslog priority level.
+           @param message The text message to be sent.
+           @param timeStamp The time the message was generated (seconds since the epoch).
+           @return The message bytes."""
+        #Ensure we have no 0x00 characters in the message.
+        # syslog will throw an error if it finds any
+        if "\x00" in message:
+            message = message.replace("\x00", "")
+        pri = priority + self._facility*8
+
+        if self._rfc5424:
+            isoTime = datetime.fromtimestamp(timeStamp).astimezone().isoformat(timespec="microseconds")
+            return ("<%d>1 %s %s %s %d - - %s" % (pri, isoTime, self._hostname, self._appName, self._pid, message)).encode("utf-8", "replace")
+
+        text = "%s %d %s: %s" % (self._srcIP, self._pid, self._idString, message)
+        if self._transport == SyslogHandler.TRANSPORT_UNIX:
+            return ("<%d>%s: %s" % (pri, SyslogHandler.LOCAL_IDENT, text)).encode("utf-8", "replace")
+        return ('<%05d>%s' % (pri, text)).encode('ascii', 'ignore')
+
+    def _sendBatch(self, recordList):
+        """@brief Send a batch of messages to the syslog server.
+           @param recordList A list of (priority, message, timeStamp) tuples."""
+        if self._identityTime is None or time() - self._identityTime >= SyslogHandler.IDENTITY_REFRESH_SECONDS:
+            self._refreshIdentity()
+
+        msgList = [self._frame(priority, message, timeStamp) for priority, message, timeStamp in recordList]
+        try:
+            sock = self._getSocket()
+            if self._transport == SyslogHandler.TRANSPORT_TCP:
+                if self._rfc5424:
+                    # RFC 6587 octet counting
+                    sock.sendall(b"".join(b"%d %s" % (len(msg), msg) for msg in msgList))
+                else:
+                    sock.sendall(b"".join(msg + b"\n" for msg in msgList))
+
+            elif self._transport == SyslogHandler.TRANSPORT_UNIX:
+                for msg in msgList:
+                    sock.send(msg)
+
+            else:
+                address = (self._host, self._port)
+                for msg in msgList:
+                    sock.sendto(msg, address)
+
+        # We don't want syslog errors to stop the user interface. The socket is rebuilt and the
+        # source identity refreshed (E.G the network address may have changed) on the next batch.
+        except Exception:
+            self._errorCount += 1
+            self._closeSocket()
+            self._identityTime = None
+
+    def _sendThread(self):
+        """@brief Send queued messages in batches until a None message is read from the queue."""
+        msgQueue = self._queue
+        running = True
+        while running:
+            record = msgQueue.get()
+            if record is None:
+                break
+            recordList = [record]
+            while len(recordList) < SyslogHandler.MAX_BATCH_SIZE:
+                try:
+                    record = msgQueue.get_nowait()
+                except Empty:
+                    break
+                if record is None:
+                    running = False
+                    break
+                recordList.append(record)
+            self._sendBatch(recordList)
@@ -37,5 +37,8 @@ echo "!!! Check the contents of this file for details of how to run example code
 # to add username/password access to a bokeh server.
 # python3 -m poetry run python3 bokeh_credentials_manager_test.py
 
+# Measure the throughput and latency of ssh tunnels through a local ssh server.
+# python3 -m poetry run python3 ssh_tunnel_benchmark.py
+
 # A nicegui example
 # python3 -m poetry run python3 ngt_examples.py
\ No newline at end of file
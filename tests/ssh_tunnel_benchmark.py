@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+import os
+import socket
+import select
+import threading
+import tempfile
+
+from   optparse import OptionParser
+from   time import time, perf_counter
+
+import paramiko
+
+from   p3lib.uio import UIO
+from   p3lib.ssh import SSH, SSHTunnelManager
+
+class StandInSSHServer(paramiko.ServerInterface):
+    """@brief A local ssh server that accepts any login and supports the port forwarding
+              (direct-tcpip) and reverse port forwarding (tcpip-forward) requests used by
+              SSHTunnelManager. It allows the tunnel code to be measured without the network
+              and server at the far end affecting the results."""
+
+    def __init__(self, transport):
+        self._transport = transport
+        self._destDict = {}
+        self._serverSockList = []
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "publickey,password"
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self._destDict[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_port_forward_request(self, address, port):
+        serverSock = socket.socket()
+        serverSock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        serverSock.bind((address or "127.0.0.1", port))
+        serverSock.listen(100)
+        self._serverSockList.append(serverSock)
+        port = serverSock.getsockname()[1]
+        threading.Thread(target=self._acceptReverse, args=(serverSock, address, port), daemon=True).start()
+        return port
+
+    def check_global_request(self, kind, msg):
+        return True
+
+    def _acceptReverse(self, serverSock, address, port):
+        """@brief Forward connections to a reverse tunnel server port back over the ssh connection."""
+        while True:
+            try:
+                sock, origin = serverSock.accept()
+            except OSError:
+                return
+            chan = self._transport.open_forwarded_tcpip_channel(origin, (address, port))
+            threading.Thread(target=Pump, args=(sock, chan), daemon=True).start()
+
+    def getDestination(self, chanid):
+        """@return The (host, port) that a direct-tcpip channel should be connected to or None."""
+        return self._destDict.pop(chanid, None)
+
+def Pump(sock, chan):
+    """@brief Copy data between a socket and a channel until both have reached EOF."""
+    sockEOF = chanEOF = False
+    try:
+        while not (sockEOF and chanEOF):
+            readList = []
+            if not sockEOF:
+                readList.append(sock)
+            if not chanEOF:
+                readList.append(chan)
+            readableList = select.select(readList, [], [])[0]
+            if sock in readableList:
+                data = sock.recv(65536)
+                if data:
+                    chan.sendall(data)
+                else:
+                    sockEOF = True
+                    chan.shutdown_write()
+            if chan in readableList:
+                data = chan.recv(65536)
+                if data:
+                    sock.sendall(data)
+                else:
+                    chanEOF = True
+                    sock.shutdown(socket.SHUT_WR)
+    except Exception:
+        pass
+    chan.close()
+    sock.close()
+
+def StartStandInServer(hostKey):
+    """@brief Start the stand in ssh server on a free local port.
+       @param hostKey The paramiko key used as the server host key.
+       @return The TCP port the server is listening on."""
+    serverSock = socket.socket()
+    serverSock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    serverSock.bind(("127.0.0.1", 0))
+    serverSock.listen(100)
+
+    def handle(sock):
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(hostKey)
+        server = StandInSSHServer(transport)
+        transport.start_server(server=server)
+        chanList = []
+        while transport.is_active():
+            chan = transport.accept(1)
+            if chan is None:
+                continue
+            # Hold a reference to each channel so that it is not closed when garbage collected.
+            chanList = [c for c in chanList if not c.closed]
+            chanList.append(chan)
+            destination = server.getDestination(chan.get_id())
+            if destination:
+                try:
+                    destSock = socket.create_connection(destination)
+                except OSError:
+                    chan.close()
+                    continue
+                threading.Thread(target=Pump, args=(destSock, chan), daemon=True).start()
+
+    def accept():
+        while True:
+            sock, _ = serverSock.accept()
+            threading.Thread(target=handle, args=(sock,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return serverSock.getsockname()[1]
+
+def StartEchoServer():
+    """@brief Start a TCP server that sends back all the data it receives.
+       @return The TCP port the server is listening on."""
+    serverSock = socket.socket()
+    serverSock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    serverSock.bind(("127.0.0.1", 0))
+    serverSock.listen(100)
+
+    def echo(sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            sock.sendall(data)
+        sock.close()
+
+    def accept():
+        while True:
+            sock, _ = serverSock.accept()
+            threading.Thread(target=echo, args=(sock,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return serverSock.getsockname()[1]
+
+class SSHTunnelBenchmark(object):
+    """@brief Responsible for measuring the throughput and latency of SSHTunnelManager tunnels."""
+
+    def __init__(self, uio, options):
+        self._uio = uio
+        self._options = options
+
+    def _throughput(self, port, byteCount):
+        """@brief Send data through a tunnel to the echo server and read it back.
+           @param port The local TCP port to connect to.
+           @param byteCount The number of bytes to send.
+           @return The throughput in MB/s (each way)."""
+        data = os.urandom(1024*1024)
+        sock = socket.create_connection(("127.0.0.1", port))
+
+        def send():
+            sentBytes = 0
+            while sentBytes < byteCount:
+                sock.sendall(data[:byteCount-sentBytes])
+                sentBytes += min(len(data), byteCount-sentBytes)
+            sock.shutdown(socket.SHUT_WR)
+
+        startTime = time()
+        sendThread = threading.Thread(target=send)
+        sendThread.start()
+        rxBytes = 0
+        while True:
+            rxData = sock.recv(65536)
+            if not rxData:
+                break
+            rxBytes += len(rxData)
+        sendThread.join()
+        elapsedSeconds = time()-startTime
+        sock.close()
+        if rxBytes != byteCount:
+            raise Exception("Sent {} bytes but received {} bytes.".format(byteCount, rxBytes))
+        return byteCount/elapsedSeconds/1E6
+
+    def _latency(self, name, port, count):
+        """@brief Measure the round trip time of small messages sent to the echo server.
+           @param name The span name used to record the round trip times.
+           @param port The local TCP port to connect to.
+           @param count The number of messages to send."""
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for _ in range(count):
+            startTime = perf_counter()
+            sock.sendall(b"x")
+            if not sock.recv(1):
+                raise Exception("The connection closed.")
+            self._uio.recordSpan(name, perf_counter()-startTime)
+        sock.close()
+
+    def run(self):
+        """@brief Run the benchmark."""
+        keyFolder = tempfile.mkdtemp(prefix="p3lib_tunnel_benchmark_")
+        paramiko.RSAKey.generate(2048).write_private_key_file(os.path.join(keyFolder, "id_rsa"))
+        SSH.LOCAL_SSH_CONFIG_PATH = keyFolder
+
+        sshPort = StartStandInServer(paramiko.RSAKey.generate(2048))
+        echoPort = StartEchoServer()
+        ssh = SSH("127.0.0.1", "benchmark", port=sshPort)
+        ssh.connect()
+        sshTunnelManager = SSHTunnelManager(None,
+                                            ssh,
+                                            False,
+                                            maxBufferedBytes=self._options.buffer*1024,
+                                            loopCount=self._options.loops)
+        try:
+            sshTunnelManager.startFwdSSHTunnel(self._options.fwd_port, "127.0.0.1", echoPort, serverBindAddress="127.0.0.1")
+            sshTunnelManager.startRevSSHTunnel(self._options.rev_port, "127.0.0.1", echoPort, serverBindAddress="127.0.0.1")
+
+            byteCount = self._options.mb*1024*1024
+            portDict = {"direct": echoPort, "forward": self._options.fwd_port, "reverse": self._options.rev_port}
+            for name in ("direct", "forward", "reverse"):
+                mbPerSecond = self._throughput(portDict[name], byteCount)
+                self._uio.info("{} throughput: {:.1f} MB/s".format(name, mbPerSecond))
+                self._latency(name + " round trip", portDict[name], self._options.count)
+
+            self._uio.showSpanStats()
+
+            table = [["Tunnel", "Server port", "Connections", "Active", "Failures", "To remote", "From remote", "Avg setup ms", "Max setup ms"]]
+            for tunnelStats in sshTunnelManager.getTunnelStats():
+                table.append([tunnelStats["direction"],
+                              str(tunnelStats["serverPort"]),
+                              str(tunnelStats["connectionCount"]),
+                              str(tunnelStats["activeConnectionCount"]),
+                              str(tunnelStats["openFailureCount"]),
+                              str(tunnelStats["bytesToRemote"]),
+                              str(tunnelStats["bytesFromRemote"]),
+                              "{:.3f}".format(tunnelStats["setupSecondsAvg"]*1000),
+                              "{:.3f}".format(tunnelStats["setupSecondsMax"]*1000)])
+            self._uio.showTable(table)
+
+        finally:
+            sshTunnelManager.close()
+            ssh.close()
+
+def main():
+    uio = UIO()
+
+    opts = OptionParser(version="1.0", description="Measure the throughput and latency of SSHTunnelManager tunnels through a local ssh server.")
+    opts.add_option("--mb",       help="The number of MB sent through each tunnel when measuring throughput (default=64).", type="int", default=64)
+    opts.add_option("--count",    help="The number of round trips when measuring latency (default=1000).", type="int", default=1000)
+    opts.add_option("--loops",    help="The number of tunnel engine threads (default=1).", type="int", default=1)
+    opts.add_option("--buffer",   help="The maximum KB buffered in each direction of a tunnel connection (default=1024).", type="int", default=1024)
+    opts.add_option("--fwd_port", help="The local forward tunnel server port (default=23001).", type="int", default=23001)
+    opts.add_option("--rev_port", help="The reverse tunnel server port (default=23002).", type="int", default=23002)
+    opts.add_option("--debug",    help="Enable debugging.", action="store_true", default=False)
+
+    try:
+        (options, args) = opts.parse_args()
+        uio.enableDebug(options.debug)
+        sshTunnelBenchmark = SSHTunnelBenchmark(uio, options)
+        sshTunnelBenchmark.run()
+
+    # If the program throws a system exit exception
+    except SystemExit:
+        pass
+    # Don't print error information if CTRL C pressed
+    except KeyboardInterrupt:
+        pass
+    except Exception as error:
+        if options.debug:
+            raise
+
+        else:
+            uio.error(error)
+
+
+if __name__ == '__main__':
+    main()
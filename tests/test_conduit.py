@@ -3,7 +3,9 @@
 import unittest
 
 import  sys
-from    p3lib.conduit import Conduit
+from    threading import Thread
+from    time import sleep, time
+from    p3lib.conduit import Conduit, ConduitSelector
 
 class ConduitTester(unittest.TestCase):
     """@brief Test cases for the Conduit class"""
@@ -31,7 +33,108 @@ class ConduitTester(unittest.TestCase):
         
         rxMsg = self.conduit.getA()
         self.assertTrue( msg == rxMsg)
-        
+
+    def test2_selectorReady(self):
+        otherConduit = Conduit()
+        selector = ConduitSelector()
+        selector.register(self.conduit, Conduit.B_END)
+        selector.register(otherConduit, Conduit.A_END)
+
+        otherConduit.putB("test2_selectorReady_Message")
+        readyList = selector.select(timeoutSeconds=1)
+        self.assertTrue( readyList == [(otherConduit, Conduit.A_END)] )
+
+    def test2_selectorTimeout(self):
+        selector = ConduitSelector()
+        selector.register(self.conduit, Conduit.A_END)
+        selector.register(self.conduit, Conduit.B_END)
+
+        startTime = time()
+        readyList = selector.select(timeoutSeconds=0.2)
+        self.assertTrue( readyList == [] )
+        self.assertTrue( time()-startTime >= 0.2 )
+
+    def test2_selectorWake(self):
+        selector = ConduitSelector()
+        selector.register(self.conduit, Conduit.B_END)
+
+        def putLater():
+            sleep(0.1)
+            self.conduit.putA("test2_selectorWake_Message")
+
+        Thread(target=putLater, daemon=True).start()
+        readyList = selector.select(timeoutSeconds=5)
+        self.assertTrue( readyList == [(self.conduit, Conduit.B_END)] )
+        self.assertTrue( self.conduit.getB() == "test2_selectorWake_Message" )
+
+        selector.unregister(self.conduit)
+        self.conduit.putA("test2_selectorWake_Message")
+        self.assertTrue( selector.select(timeoutSeconds=0) == [] )
+
+    def test3_overflowRaise(self):
+        conduit = Conduit(maxSize=2)
+        conduit.putA(1)
+        conduit.putA(2)
+        # The B -> A direction is not full so this must not raise
+        conduit.putB(3)
+        with self.assertRaises(Exception):
+            conduit.putA(3)
+
+    def test3_overflowDropNewest(self):
+        conduit = Conduit(maxSize=2, aToBOverflowPolicy=Conduit.OVERFLOW_DROP_NEWEST)
+        for value in range(5):
+            conduit.putA(value)
+        self.assertTrue( conduit.getB() == 0 )
+        self.assertTrue( conduit.getB() == 1 )
+        stats = conduit.getAToBStats()
+        self.assertTrue( stats.putCount == 2 )
+        self.assertTrue( stats.droppedCount == 3 )
+        self.assertTrue( stats.takenCount == 2 )
+        self.assertTrue( stats.highWaterMark == 2 )
+
+    def test3_overflowDropOldest(self):
+        conduit = Conduit(maxSize=2, bToAOverflowPolicy=Conduit.OVERFLOW_DROP_OLDEST)
+        for value in range(5):
+            conduit.putB(value)
+        self.assertTrue( conduit.getA() == 3 )
+        self.assertTrue( conduit.getA() == 4 )
+        stats = conduit.getBToAStats()
+        self.assertTrue( stats.putCount == 5 )
+        self.assertTrue( stats.droppedCount == 3 )
+
+    def test3_overflowCoalesce(self):
+        conduit = Conduit(maxSize=2, aToBOverflowPolicy=Conduit.OVERFLOW_COALESCE, coalesceKey=lambda data: data[0])
+        conduit.putA(("temp", 1))
+        conduit.putA(("humidity", 50))
+        conduit.putA(("temp", 2))
+        self.assertTrue( conduit.getB() == ("temp", 2) )
+        self.assertTrue( conduit.getB() == ("humidity", 50) )
+        self.assertTrue( conduit.getAToBStats().coalescedCount == 1 )
+
+    def test3_overflowBlock(self):
+        conduit = Conduit(maxSize=1, aToBOverflowPolicy=Conduit.OVERFLOW_BLOCK, overflowTimeoutSeconds=0.1)
+        conduit.putA(1)
+        with self.assertRaises(Exception):
+            conduit.putA(2)
+
+    def test4_nonBlockingGet(self):
+        # The conduit blocks on reads by default but a single call may choose not to.
+        startTime = time()
+        self.assertTrue( self.conduit.getA(block=False) is None )
+        self.assertTrue( self.conduit.getB(block=True, timeoutSeconds=0.1) is None )
+        self.assertTrue( time()-startTime < 1 )
+
+        self.conduit.putA("test4_nonBlockingGet_Message")
+        self.assertTrue( self.conduit.getB(block=False) == "test4_nonBlockingGet_Message" )
+
+    def test4_tryGet(self):
+        self.assertTrue( self.conduit.tryGetA() is None )
+        self.assertTrue( self.conduit.tryGetB(default=-1) == -1 )
+
+        self.conduit.putB("test4_tryGet_Message")
+        self.assertTrue( self.conduit.tryGetA() == "test4_tryGet_Message" )
+        self.assertTrue( self.conduit.getBToAStats().takenCount == 1 )
+
 def main():
     """@brief Unit tests for the UIO class"""
     suite = unittest.TestLoader().loadTestsFromTestCase(ConduitTester)
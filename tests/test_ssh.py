@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
+import os
+import socket
+import hashlib
+import asyncio
 import unittest
-from    time import sleep
+from    time import sleep, time
 
 # Supress the following warning
 # CryptographyDeprecationWarning: TripleDES has been moved to cryptography.hazmat.decrepit.ciphers.algorithms.TripleDES and will be removed from this module in 48.0.0.
@@ -11,7 +15,7 @@ with warnings.catch_warnings(action="ignore", category=CryptographyDeprecationWa
     import paramiko
 
 from    p3lib.uio import UIO
-from    p3lib.ssh import SSH, SSHTunnelManager
+from    p3lib.ssh import SSH, SSHTunnelManager, SSHConnectionPool, SSHFleet, SSHCmdStream, SSHError, AsyncSSH, SFTPTransfer, TunnelLoop, TunnelConnection
 
 #An ssh login on an ssh server must be available for these test to run.
 USERNAME="pja"
@@ -64,10 +68,315 @@ class SSHTester(unittest.TestCase):
         sshTunnelManager = SSHTunnelManager(self._uio, self.ssh, True)
         sshTunnelManager.startRevSSHTunnel(30000, SERVER, 22)
 
+    def test6_pool(self):
+        for _ in range(3):
+            ssh = SSH(SERVER, USERNAME, usePool=True)
+            ssh.connect(connectSFTPSession=True)
+            rc, stdoutLines, _ = ssh.runCmd("echo 1234")
+            self.assertTrue(rc == 0)
+            self.assertTrue(stdoutLines[0] == "1234")
+            ssh.close()
+        pool = SSHConnectionPool.GetDefault()
+        self.assertTrue(pool.getConnectionCount() == 1)
+        pooledConnection = pool.acquire(SERVER, USERNAME)
+        self.assertTrue(pooledConnection.getConnectCount() == 1)
+        pool.release(pooledConnection)
+        pool.closeAll()
+
+        # Idle connections are closed in the background.
+        pool = SSHConnectionPool(idleCloseSeconds=0.5, reapSeconds=0.25)
+        pooledConnection = pool.acquire(SERVER, USERNAME)
+        pool.release(pooledConnection)
+        self.assertTrue(pool.getConnectionCount() == 1)
+        sleep(2)
+        self.assertTrue(pool.getConnectionCount() == 0)
+        self.assertFalse(pooledConnection.isConnected())
+
+    def test7_fleet(self):
+        sshFleet = SSHFleet([SERVER, "127.0.0.1"], USERNAME, uio=self._uio)
+        resultList = sshFleet.runCmdAll({SERVER: "echo 1234", "127.0.0.1": "sleep 10"}, timeout=2)
+        self.assertTrue(resultList[0].isSuccess())
+        self.assertTrue(resultList[0].stdoutLines[0] == "1234")
+        self.assertFalse(resultList[1].isSuccess())
+        self.assertTrue(resultList[1].error is not None)
+        summary = SSHFleet.GetSummary(resultList)
+        self.assertTrue(summary["successCount"] == 1)
+        self.assertTrue(summary["errorCount"] == 1)
+        with self.assertRaises(SSHError):
+            SSHFleet([SERVER, SERVER], USERNAME)
+
+    def test8_runCmdStream(self):
+        self.ssh.connect()
+        cmdStream = self.ssh.runCmdStream("seq 100000; echo error >&2")
+        stdoutLineCount = 0
+        stderrLines = []
+        for stream, line in cmdStream:
+            if stream == SSHCmdStream.STDOUT:
+                stdoutLineCount += 1
+            else:
+                stderrLines.append(line)
+        self.assertTrue(stdoutLineCount == 100000)
+        self.assertTrue(stderrLines == ["error"])
+        self.assertTrue(cmdStream.exitStatus == 0)
+
+        with self.assertRaises(SSHError):
+            for _ in self.ssh.runCmdStream("sleep 10", timeout=1):
+                pass
+
+    def test9_authKeys(self):
+        self.ssh.connect()
+        authKeysFile = self.ssh.getRemoteAuthorisedKeyFile()
+        backupFile = self.ssh.getAuthKeyBackupFile()
+        self.assertTrue(backupFile.startswith(authKeysFile + ".backup"))
+        self.assertTrue(len(self.ssh.getRemoteAuthorisedKeys()) > 0)
+
+    def test10_sftpTransfer(self):
+        localFile = "/tmp/pushFile.bin"
+        remoteFile = "/tmp/pushedFile.bin"
+        pulledFile = "/tmp/pulledFile.bin"
+        data = os.urandom(1024*1024+123)
+        with open(localFile, 'wb') as fd:
+            fd.write(data)
+
+        progressList = []
+        def progress(path, transferredBytes, fileSize):
+            progressList.append( (path, transferredBytes, fileSize) )
+
+        self.ssh.connect()
+        with self.ssh.getSFTPTransfer(channelCount=4, rangeThreshold=256*1024, progressCallback=progress) as sftpTransfer:
+            sftpTransfer.put(localFile, remoteFile)
+            sftpTransfer.get(remoteFile, pulledFile, resume=True)
+
+        with open(pulledFile, 'rb') as fd:
+            self.assertTrue(fd.read() == data)
+        self.assertTrue(progressList[-1][1] == len(data))
+
+    def test11_syncDir(self):
+        localDir = "/tmp/syncDirTest"
+        remoteDir = "/tmp/syncedDirTest"
+        os.makedirs(os.path.join(localDir, "subdir"), exist_ok=True)
+        for fileName in ("a.txt", os.path.join("subdir", "b.txt")):
+            with open(os.path.join(localDir, fileName), 'w') as fd:
+                fd.write(fileName)
+
+        self.ssh.connect()
+        self.ssh.syncDir(localDir, remoteDir, delete=True)
+        result = self.ssh.syncDir(localDir, remoteDir, delete=True)
+        self.assertTrue(result["sent"] == [])
+        self.assertTrue(result["unchanged"] == 2)
+
+        with open(os.path.join(localDir, "a.txt"), 'w') as fd:
+            fd.write("changed")
+        result = self.ssh.syncDir(localDir, remoteDir, delete=True)
+        self.assertTrue(result["sent"] == ["a.txt"])
+
+    def test12_tunnelEngine(self):
+        self.ssh.connect()
+        sshTunnelManager = SSHTunnelManager(self._uio, self.ssh, False, maxBufferedBytes=64*1024, loopCount=2)
+        sshTunnelManager.startFwdSSHTunnel(30001, SERVER, 22)
+        sleep(0.25)
+        sock = socket.create_connection(("localhost", 30001))
+        # The ssh server sends its banner as soon as the connection is made.
+        banner = sock.recv(256)
+        self.assertTrue(banner.startswith(b"SSH-"))
+        self.assertTrue(sshTunnelManager.getTunnelCount() == 1)
+        sock.close()
+        sleep(0.25)
+        sshTunnelManager.close()
+        self.assertTrue(sshTunnelManager.getTunnelCount() == 0)
+
+    def test13_tunnelStats(self):
+        self.ssh.connect()
+        sshTunnelManager = SSHTunnelManager(self._uio, self.ssh, False)
+        sshTunnelManager.startFwdSSHTunnel(30002, SERVER, 22)
+        sleep(0.25)
+        sock = socket.create_connection(("localhost", 30002))
+        banner = sock.recv(256)
+        sock.close()
+        sleep(0.25)
+        tunnelStatsList = sshTunnelManager.getTunnelStats()
+        sshTunnelManager.close()
+        self.assertTrue(len(tunnelStatsList) == 1)
+        tunnelStats = tunnelStatsList[0]
+        self.assertTrue(tunnelStats["direction"] == "forward")
+        self.assertTrue(tunnelStats["connectionCount"] == 1)
+        self.assertTrue(tunnelStats["openFailureCount"] == 0)
+        self.assertTrue(tunnelStats["bytesFromRemote"] >= len(banner))
+
+    def test14_keyCache(self):
+        self.ssh.connect()
+        self.ssh.close()
+        cachedKeyFile = SSH.GetCachedPrivateKeyFile(SERVER, 22, USERNAME)
+        self.assertTrue(cachedKeyFile in SSH.GetPrivateKeyFileList())
+
+        ssh = SSH(SERVER, USERNAME, multiKeyAuth=True)
+        ssh.connect()
+        self.assertTrue(ssh.isConnected())
+        ssh.close()
+        self.assertTrue(SSH.GetCachedPrivateKeyFile(SERVER, 22, USERNAME) == cachedKeyFile)
+
+    def test15_runBatch(self):
+        self.ssh.connect()
+        resultList = self.ssh.runBatch(["cd /tmp", "pwd", "echo error >&2; false", "printf 'line'"], throwError=False)
+        self.assertTrue(len(resultList) == 4)
+        self.assertTrue(resultList[1][1][0] == "/tmp")
+        self.assertTrue(resultList[2][0] == 1)
+        self.assertTrue(resultList[2][2][0] == "error")
+        self.assertTrue(resultList[3] == self.ssh.runCmd("printf 'line'"))
+        with self.assertRaises(SSHError):
+            self.ssh.runBatch(["rm -f /tmp/runBatchTest", "false", "touch /tmp/runBatchTest"])
+        # The command after the failed command should not have run.
+        self.assertTrue(self.ssh.runCmd("test -e /tmp/runBatchTest", throwError=False)[0] != 0)
+
+    def test16_asyncSSH(self):
+        async def runCmds():
+            async with AsyncSSH(SERVER, USERNAME) as asyncSSH:
+                return await asyncio.gather(*[asyncSSH.run("echo {}".format(index)) for index in range(4)])
+
+        resultList = asyncio.run(runCmds())
+        self.assertTrue([result[1][0] for result in resultList] == ["0", "1", "2", "3"])
+
+    def test17_adaptiveCompression(self):
+        ssh = SSH(SERVER, USERNAME, useCompression=SSH.ADAPTIVE)
+        ssh.connect()
+        sessionStats = ssh.getSessionStats()
+        ssh.close()
+        self.assertTrue(sessionStats["adaptive"])
+        linkProfile = sessionStats["linkProfile"]
+        self.assertTrue(linkProfile is not None)
+        self.assertTrue(linkProfile["cipher"] in SSH.ADAPTIVE_CIPHER_LIST)
+        self.assertTrue((sessionStats["compression"] != "none") == linkProfile["compression"])
+
+    def test18_reconnect(self):
+        ssh = SSH(SERVER, USERNAME, keepAliveSeconds=1, autoReconnect=True)
+        ssh.connect()
+        self.assertTrue(ssh.checkConnection())
+        sshTunnelManager = SSHTunnelManager(self._uio, ssh, False)
+        sshTunnelManager.startFwdSSHTunnel(30003, SERVER, 22)
+        # Drop the connection. The next command reconnects.
+        ssh.getSSHClient().get_transport().close()
+        self.assertTrue(ssh.runCmd("echo 1")[1][0] == "1")
+        self.assertTrue(ssh.getReconnectCount() == 1)
+        sleep(0.25)
+        # The tunnel now uses the new connection.
+        sock = socket.create_connection(("localhost", 30003))
+        banner = sock.recv(256)
+        sock.close()
+        self.assertTrue(banner.startswith(b"SSH-"))
+        sshTunnelManager.close()
+        ssh.close()
+
+    def test19_resumeUpload(self):
+        localFile = "/tmp/resumeFile.bin"
+        remoteFile = "/tmp/resumedFile.bin"
+        data = os.urandom(8*1024*1024+123)
+        with open(localFile, 'wb') as fd:
+            fd.write(data)
+
+        def progress(path, transferredBytes, fileSize):
+            # Drop the connection part way through the transfer.
+            if transferredBytes > fileSize//2:
+                self.ssh.getSSHClient().get_transport().close()
+
+        stateSaveBytes = SFTPTransfer.STATE_SAVE_BYTES
+        SFTPTransfer.STATE_SAVE_BYTES = 256*1024
+        try:
+            self.ssh.connect()
+            with self.ssh.getSFTPTransfer(channelCount=4, rangeThreshold=256*1024, progressCallback=progress) as sftpTransfer:
+                with self.assertRaises(Exception):
+                    sftpTransfer.put(localFile, remoteFile)
+            self.ssh.close()
+
+            self.ssh.connect()
+            with self.ssh.getSFTPTransfer(channelCount=4, rangeThreshold=256*1024) as sftpTransfer:
+                sftpTransfer.put(localFile, remoteFile, resume=True)
+        finally:
+            SFTPTransfer.STATE_SAVE_BYTES = stateSaveBytes
+
+        remoteHash = self.ssh.runCmd("sha256sum {}".format(remoteFile))[1][0].split()[0]
+        self.assertTrue(remoteHash == hashlib.sha256(data).hexdigest())
+
+class FakeChannel(object):
+    """@brief Stands in for a paramiko Channel so that TunnelLoop can be tested without an ssh server."""
+
+    def __init__(self, failSend=False):
+        """@param failSend If True send_ready() returns False the first time it is called and then raises an exception."""
+        # The selector waits on this socket. Nothing is written to it so the channel never has data to read.
+        self._readSock, self._writeSock = socket.socketpair()
+        self._failSend = failSend
+        self._sendReadyCount = 0
+        self.sentData = bytearray()
+        self.closed = False
+
+    def fileno(self):
+        return self._readSock.fileno()
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, size):
+        raise socket.timeout()
+
+    def send_ready(self):
+        self._sendReadyCount += 1
+        if self._failSend:
+            if self._sendReadyCount == 1:
+                return False
+            raise EOFError("The channel has closed.")
+        return True
+
+    def send(self, data):
+        self.sentData += data
+        return len(data)
+
+    def shutdown_write(self):
+        pass
+
+    def close(self):
+        self.closed = True
+        self._readSock.close()
+        self._writeSock.close()
+
+class TunnelLoopTester(unittest.TestCase):
+    """@brief Unit tests for the TunnelLoop class. These do not need an ssh server."""
+
+    def _waitFor(self, condition, timeout=5):
+        """@brief Wait for a condition to become True.
+           @return The result of the last check of the condition."""
+        deadline = time() + timeout
+        while not condition() and time() < deadline:
+            sleep(0.01)
+        return condition()
+
+    def test1_channelSendFailure(self):
+        tunnelLoop = TunnelLoop(65536, 1024*1024)
+        try:
+            # The data is held up (send_ready() returns False) so the loop retries the send and the channel fails.
+            localSock, remoteSock = socket.socketpair()
+            failChan = FakeChannel(failSend=True)
+            failConnection = TunnelConnection(localSock, failChan, "fail")
+            tunnelLoop.add(failConnection)
+            remoteSock.sendall(b"data")
+            self.assertTrue(self._waitFor(lambda: failConnection.closed))
+            remoteSock.close()
+
+            # The loop thread should still be running and move the data of new connections.
+            localSock, remoteSock = socket.socketpair()
+            chan = FakeChannel()
+            connection = TunnelConnection(localSock, chan, "ok")
+            tunnelLoop.add(connection)
+            remoteSock.sendall(b"data")
+            self.assertTrue(self._waitFor(lambda: chan.sentData == b"data"))
+            self.assertTrue(tunnelLoop.getConnectionCount() == 1)
+            remoteSock.close()
+        finally:
+            tunnelLoop.stop()
+
 def main():
     """@brief Unit tests for the UIO class"""
-    suite = unittest.TestLoader().loadTestsFromTestCase(SSHTester)
-    unittest.TextTestRunner(verbosity=2).run(suite)
+    for testCase in (SSHTester, TunnelLoopTester):
+        suite = unittest.TestLoader().loadTestsFromTestCase(testCase)
+        unittest.TextTestRunner(verbosity=2).run(suite)
 
 if __name__ == '__main__':
     main()
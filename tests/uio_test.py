@@ -3,7 +3,14 @@
 import unittest
 
 import  sys
-from    p3lib.uio import UIO
+import  os
+import  tempfile
+import  gzip
+import  socket
+import  json
+import  signal
+from    time import sleep
+from    p3lib.uio import UIO, LogFileWriter, SyslogHandler, PRIORITY, MessageLimiter
 
 SYSLOG_SERVER = "192.168.0.8"
 
@@ -179,6 +186,432 @@ class UIOTester(unittest.TestCase):
         table.append(["AAA", "BBB", "CCC"])
         self._uio.showTable(table)
         
+    def _getLogLines(self, logFile):
+        with open(logFile, 'r') as fd:
+            return fd.readlines()
+
+    def test11_logFile(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            logFile = os.path.join(tmpDir, "test11.txt")
+            uio = UIO(colour=False)
+            uio.setLogFile(logFile)
+            self._grabStdOut()
+            uio.info("Line 1")
+            uio.warn("Line 2")
+            self._restoreStdout()
+
+            lines = self._getLogLines(logFile)
+            self.assertTrue(len(lines) == 2)
+            self.assertTrue(lines[0].endswith("INFO:  Line 1\n"))
+            self.assertTrue(lines[1].endswith("WARN:  Line 2\n"))
+            self.assertTrue(os.path.realpath(os.path.join(tmpDir, UIO.USER_LOG_SYM_LINK)) == os.path.realpath(logFile))
+            uio.closeLogs()
+
+    def test12_bufferedLogFile(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            logFile = os.path.join(tmpDir, "test12.txt")
+            uio = UIO(colour=False)
+            uio.setLogFile(logFile)
+            uio.setLogBuffering(flushBytes=1024*1024, flushSeconds=3600)
+            self._grabStdOut()
+            for lineIndex in range(100):
+                uio.info("Line {}".format(lineIndex))
+            self._restoreStdout()
+
+            self.assertFalse(os.path.isfile(logFile))
+            uio.flushLogs()
+            self.assertTrue(len(self._getLogLines(logFile)) == 100)
+            uio.closeLogs()
+
+    def test13_backgroundLogFile(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            logFile = os.path.join(tmpDir, "test13.txt")
+            uio = UIO(colour=False)
+            uio.setLogFile(logFile)
+            uio.setLogBuffering(flushSeconds=0.1, background=True)
+            self._grabStdOut()
+            for lineIndex in range(100):
+                uio.info("Line {}".format(lineIndex))
+            self._restoreStdout()
+
+            uio.closeLogs()
+            lines = self._getLogLines(logFile)
+            self.assertTrue(len(lines) == 100)
+            self.assertTrue(lines[99].endswith("INFO:  Line 99\n"))
+
+    def test14_logRotation(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            logFile = os.path.join(tmpDir, "test14.txt")
+            uio = UIO(colour=False)
+            uio.setLogFile(logFile)
+            uio.setLogRotation(maxBytes=1000, backupCount=2, compression=LogFileWriter.COMPRESSION_GZIP)
+            self._grabStdOut()
+            for lineIndex in range(200):
+                uio.info("Line {}".format(lineIndex))
+            self._restoreStdout()
+            uio.closeLogs()
+
+            rotatedFileList = sorted(fileName for fileName in os.listdir(tmpDir) if fileName.startswith("test14.txt."))
+            self.assertTrue(len(rotatedFileList) == 2)
+            for fileName in rotatedFileList:
+                self.assertTrue(fileName.endswith(".gz"))
+            self.assertTrue(os.path.getsize(logFile) < 1000)
+            self.assertTrue(os.path.realpath(os.path.join(tmpDir, UIO.USER_LOG_SYM_LINK)) == os.path.realpath(logFile))
+
+            with gzip.open(os.path.join(tmpDir, rotatedFileList[-1]), 'rt') as fd:
+                rotatedLines = fd.readlines()
+            lastLine = self._getLogLines(logFile)[-1]
+            self.assertTrue(lastLine.endswith("INFO:  Line 199\n"))
+            firstLineIndex = int(self._getLogLines(logFile)[0].split()[-1])
+            self.assertTrue(rotatedLines[-1].endswith("INFO:  Line {}\n".format(firstLineIndex-1)))
+
+    def _getSyslogMessages(self, rfc5424, msgCount):
+        serverSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        serverSock.bind(("127.0.0.1", 0))
+        serverSock.settimeout(5)
+        try:
+            uio = UIO(colour=False)
+            uio.enableSyslog(True, host="127.0.0.1", port=serverSock.getsockname()[1], programName="uio_test",
+                             transport=SyslogHandler.TRANSPORT_UDP, rfc5424=rfc5424)
+            self._grabStdOut()
+            for msgIndex in range(msgCount):
+                uio.info("Syslog message {}".format(msgIndex))
+            self._restoreStdout()
+            uio.enableSyslog(False)
+            return [serverSock.recv(65535).decode() for _ in range(msgCount)]
+        finally:
+            serverSock.close()
+
+    def test15_syslog(self):
+        msgList = self._getSyslogMessages(False, 10)
+        self.assertTrue(msgList[0].startswith("<00134>"))
+        self.assertTrue(msgList[0].endswith(" {} {}-uio_test: INFO:  Syslog message 0".format(os.getpid(), UIO().getCurrentUsername())))
+        self.assertTrue(msgList[9].endswith("INFO:  Syslog message 9"))
+
+    def test16_syslogRFC5424(self):
+        msgList = self._getSyslogMessages(True, 1)
+        elems = msgList[0].split(" ", 7)
+        self.assertTrue(elems[0] == "<134>1")
+        self.assertTrue(elems[3] == "{}-uio_test".format(UIO().getCurrentUsername()))
+        self.assertTrue(elems[4] == str(os.getpid()))
+        self.assertTrue(elems[7] == "INFO:  Syslog message 0")
+
+    def test17_lazyDebug(self):
+        def getText():
+            raise Exception("Debug text built with debugging off")
+
+        self._uio.enableDebug(False)
+        self.assertFalse(self._uio.isEnabledFor(PRIORITY.DEBUG))
+        self.assertTrue(self._uio.isEnabledFor(PRIORITY.INFO))
+        self._grabStdOut()
+        self._uio.debug(getText)
+        self._uio.debug("%d", "not an int")
+        self._uio.enableDebug(True)
+        self._uio.debug("Queue size = %d", 10)
+        self._uio.debug(lambda: "Lazy message")
+        self._uio.warn("%s: %d", "Count", 3)
+        self._restoreStdout()
+
+        lines = UIOTester.GetStdoutLines()
+        self.assertTrue(self._uio.isEnabledFor(PRIORITY.DEBUG))
+        self.assertTrue(lines == ["DEBUG: Queue size = 10\n", "DEBUG: Lazy message\n", "WARN:  Count: 3\n"])
+
+    def test18_jsonLogFile(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            logFile = os.path.join(tmpDir, "test18.txt")
+            uio = UIO(colour=True)
+            uio.setLogFile(logFile)
+            uio.setLogFormat(UIO.LOG_FORMAT_JSON)
+            uio.logAll(True)
+            self._grabStdOut()
+            uio.info("An info message", fields={"host": "unit1", "port": 22})
+            uio.debug("A debug message %d", 1)
+            uio.error("An error message")
+            self._restoreStdout()
+            uio.closeLogs()
+
+            recordList = [json.loads(line) for line in self._getLogLines(logFile)]
+            self.assertTrue(len(recordList) == 2)
+            self.assertTrue(recordList[0]["level"] == UIO.LEVEL_INFO)
+            self.assertTrue(recordList[0]["message"] == "An info message")
+            self.assertTrue(recordList[0]["host"] == "unit1")
+            self.assertTrue(recordList[0]["port"] == 22)
+            self.assertTrue(recordList[0]["thread"] == "MainThread")
+            self.assertTrue("timestamp" in recordList[0])
+            self.assertTrue(recordList[1]["level"] == UIO.LEVEL_ERROR)
+
+            debugRecordList = [json.loads(line) for line in self._getLogLines(uio.getDebugLogFile())]
+            self.assertTrue([record["message"] for record in debugRecordList] == ["An info message", "A debug message 1", "An error message"])
+
+    def test19_tableOutput(self):
+        table = [["Col 1", "Col 2"], ["awfdasdfgsd", "B"], ["1", "22"]]
+        self._grabStdOut()
+        self._uio.showTable(table, rowSeparatorChar="~", colSeparatorChar="!")
+        self._restoreStdout()
+
+        lines = UIOTester.GetStdoutLines()
+        self.assertTrue(lines == ["INFO:  ~~~~~~~~~~~~~~~~~~~~~~~\n",
+                                  "INFO:  !       Col 1 ! Col 2 !\n",
+                                  "INFO:  ~~~~~~~~~~~~~~~~~~~~~~~\n",
+                                  "INFO:  ! awfdasdfgsd !     B !\n",
+                                  "INFO:  ~~~~~~~~~~~~~~~~~~~~~~~\n",
+                                  "INFO:  !           1 !    22 !\n",
+                                  "INFO:  ~~~~~~~~~~~~~~~~~~~~~~~\n"])
+
+    def test20_tableStreamed(self):
+        def getRows():
+            yield ["Index", "Square"]
+            for index in range(1000):
+                yield [str(index), str(index*index)]
+
+        self._grabStdOut()
+        self._uio.showTable(getRows(), sampleRowCount=10, pageRowCount=100)
+        self._restoreStdout()
+
+        lines = UIOTester.GetStdoutLines()
+        self.assertTrue(len(lines) == 1 + 1001*2)
+        self.assertTrue(lines[1] == "INFO:  | Index | Square |\n")
+        # Rows after the sample that are wider than the sampled column width are widened.
+        self.assertTrue(lines[-2] == "INFO:  |   999 | 998001 |\n")
+
+    def test21_tableErrors(self):
+        with self.assertRaises(Exception):
+            self._uio.showTable([])
+        with self.assertRaises(Exception):
+            self._uio.showTable([["A", "B"], ["C"]])
+        with self.assertRaises(Exception):
+            self._uio.showTable([["A", "B"], ["C", 1]])
+
+    def test22_rateLimit(self):
+        uio = UIO(colour=False)
+        uio.setMessageLimits(maxMessages=2, periodSeconds=60)
+        self._grabStdOut()
+        for index in range(100):
+            uio.warn("Device %s offline, attempt %d", "dev1", index)
+        uio.info("Other message")
+        uio.flushSuppressed()
+        self._restoreStdout()
+
+        lines = UIOTester.GetStdoutLines()
+        self.assertTrue(len(lines) == 4)
+        self.assertTrue(lines[0] == "WARN:  Device dev1 offline, attempt 0\n")
+        self.assertTrue(lines[1] == "WARN:  Device dev1 offline, attempt 1\n")
+        self.assertTrue(lines[2] == "INFO:  Other message\n")
+        self.assertTrue(lines[3].startswith("WARN:  98 messages like 'Device %s offline, attempt %d' suppressed"))
+
+    def test23_collapseDuplicates(self):
+        uio = UIO(colour=False)
+        uio.setMessageLimits(collapseDuplicates=True)
+        self._grabStdOut()
+        for _ in range(10):
+            uio.error("Link down")
+        uio.info("Link up")
+        uio.info("Link up")
+        uio.flushSuppressed()
+        self._restoreStdout()
+
+        lines = UIOTester.GetStdoutLines()
+        self.assertTrue(lines == ["ERROR: Link down\n",
+                                  "ERROR: Last message repeated 9 times.\n",
+                                  "INFO:  Link up\n",
+                                  "INFO:  Last message repeated 1 times.\n"])
+
+    def test24_ringBuffer(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            dumpFile = os.path.join(tmpDir, "test24.txt")
+            uio = UIO(colour=False)
+            uio.enableRingBuffer(3, dumpFile)
+            self.assertTrue(uio.isEnabledFor(PRIORITY.DEBUG))
+            self._grabStdOut()
+            uio.info("Line 1")
+            uio.debug("Line %d", 2)
+            uio.debug("Line %d", 3)
+            self.assertFalse(os.path.isfile(dumpFile))
+            uio.error("Line 4")
+            self._restoreStdout()
+
+            # Debug messages are not displayed but are held in the ring buffer.
+            lines = UIOTester.GetStdoutLines()
+            self.assertTrue(lines == ["INFO:  Line 1\n", "ERROR: Line 4\n"])
+
+            # The error caused the last 3 messages to be written to the dump file.
+            lines = self._getLogLines(dumpFile)
+            self.assertTrue(len(lines) == 3)
+            self.assertTrue(lines[0].endswith("DEBUG: Line 2\n"))
+            self.assertTrue(lines[1].endswith("DEBUG: Line 3\n"))
+            self.assertTrue(lines[2].endswith("ERROR: Line 4\n"))
+
+            # The ring buffer is emptied when dumped.
+            self.assertTrue(uio.dumpRingBuffer() == 0)
+            uio.debug("Line 5")
+            self.assertTrue(uio.dumpRingBuffer() == 1)
+            self.assertTrue(self._getLogLines(dumpFile)[-1].endswith("DEBUG: Line 5\n"))
+
+    def test25_spans(self):
+        uio = UIO(colour=False)
+        for duration in range(1, 101):
+            uio.recordSpan("query", duration/1000.0)
+
+        with uio.span("block"):
+            pass
+
+        @uio.span("method")
+        def method(value):
+            return value*2
+
+        self.assertTrue(method(2) == 4)
+        self.assertTrue(method(3) == 6)
+
+        statsDict = uio.getSpanStats()
+        self.assertTrue(statsDict["block"]["count"] == 1)
+        self.assertTrue(statsDict["method"]["count"] == 2)
+        stats = statsDict["query"]
+        self.assertTrue(stats["count"] == 100)
+        self.assertAlmostEqual(stats["total"], 5.05)
+        self.assertTrue(stats["max"] == 0.1)
+        self.assertTrue(0.050 <= stats["p50"] <= 0.050*1.02)
+        self.assertTrue(0.095 <= stats["p95"] <= 0.095*1.02)
+        self.assertTrue(0.099 <= stats["p99"] <= 0.1)
+
+        self._grabStdOut()
+        uio.showSpanStats()
+        self._restoreStdout()
+        lines = UIOTester.GetStdoutLines()
+        self.assertTrue(len(lines) == 9)
+        self.assertTrue("query" in lines[7])
+
+        uio.resetSpanStats()
+        self.assertTrue(uio.getSpanStats() == {})
+
+    def test26_rateLimitNotice(self):
+        uio = UIO(colour=False)
+        uio.setMessageLimits(maxMessages=1, periodSeconds=0.1)
+        self._grabStdOut()
+        for index in range(10):
+            uio.warn("Device %s offline, attempt %d", "dev1", index)
+        sleep(0.2)
+        # The summary is output before the next message once the period has ended, whatever its key.
+        uio.info("Other message")
+        self._restoreStdout()
+        uio.setMessageLimits()
+
+        lines = UIOTester.GetStdoutLines()
+        self.assertTrue(len(lines) == 3)
+        self.assertTrue(lines[0] == "WARN:  Device dev1 offline, attempt 0\n")
+        self.assertTrue(lines[1].startswith("WARN:  9 messages like 'Device %s offline, attempt %d' suppressed"))
+        self.assertTrue(lines[2] == "INFO:  Other message\n")
+
+    def test27_lazyAllLevels(self):
+        uio = UIO(colour=False)
+        uio.enableDebug(True)
+        self._grabStdOut()
+        uio.info("Info %d", 1)
+        uio.info(lambda: "Lazy info")
+        uio.success("Success %s", "two")
+        uio.success(lambda: "Lazy success")
+        uio.debug("Debug %d", 3)
+        uio.debug(lambda: "Lazy debug")
+        uio.warn("Warn %d", 4)
+        uio.warn(lambda: "Lazy warn")
+        uio.error("Error %d", 5)
+        uio.error(lambda: "Lazy error")
+        uio.failure("Failure %d", 6)
+        uio.failure(lambda: "Lazy failure")
+        uio.info("100%")
+        self._restoreStdout()
+
+        lines = UIOTester.GetStdoutLines()
+        self.assertTrue(lines == ["INFO:  Info 1\n",
+                                  "INFO:  Lazy info\n",
+                                  "INFO:  Success two\n",
+                                  "INFO:  Lazy success\n",
+                                  "DEBUG: Debug 3\n",
+                                  "DEBUG: Lazy debug\n",
+                                  "WARN:  Warn 4\n",
+                                  "WARN:  Lazy warn\n",
+                                  "ERROR: Error 5\n",
+                                  "ERROR: Lazy error\n",
+                                  "ERROR: Failure 6\n",
+                                  "ERROR: Lazy failure\n",
+                                  "INFO:  100%\n"])
+
+    def test28_rateLimitPurge(self):
+        uio = UIO(colour=False)
+        uio.setMessageLimits(maxMessages=1, periodSeconds=60)
+        orgMaxKeys = MessageLimiter.MAX_KEYS
+        MessageLimiter.MAX_KEYS = 2
+        try:
+            self._grabStdOut()
+            uio.warn("Device %s offline", "dev1")
+            uio.warn("Device %s offline", "dev1")
+            uio.info("Second key")
+            # All the keys are removed to make room for this one but the suppressed count is not lost.
+            uio.info("Third key")
+            self._restoreStdout()
+        finally:
+            MessageLimiter.MAX_KEYS = orgMaxKeys
+            uio.setMessageLimits()
+
+        lines = UIOTester.GetStdoutLines()
+        self.assertTrue(len(lines) == 4)
+        self.assertTrue(lines[0] == "WARN:  Device dev1 offline\n")
+        self.assertTrue(lines[1] == "INFO:  Second key\n")
+        self.assertTrue(lines[2].startswith("WARN:  1 messages like 'Device %s offline' suppressed"))
+        self.assertTrue(lines[3] == "INFO:  Third key\n")
+
+    @unittest.skipUnless(hasattr(signal, "SIGUSR1"), "SIGUSR1 is not available on this platform.")
+    def test29_ringBufferSignal(self):
+        signalList = []
+        def prevHandler(signum, frame):
+            signalList.append(signum)
+
+        orgHandler = signal.signal(signal.SIGUSR1, prevHandler)
+        try:
+            with tempfile.TemporaryDirectory() as tmpDir:
+                dumpFile = os.path.join(tmpDir, "test29.txt")
+                uio = UIO(colour=False)
+                uio.enableRingBuffer(3, dumpFile, dumpSignal=signal.SIGUSR1)
+                uio.debug("Line 1")
+                os.kill(os.getpid(), signal.SIGUSR1)
+                # The ring buffer is dumped by another thread.
+                for _ in range(100):
+                    if os.path.isfile(dumpFile):
+                        break
+                    sleep(0.05)
+                sleep(0.1)
+                lines = self._getLogLines(dumpFile)
+                self.assertTrue(len(lines) == 1)
+                self.assertTrue(lines[0].endswith("DEBUG: Line 1\n"))
+                # The handler that was installed before is called and reinstalled when the ring buffer is disabled.
+                self.assertTrue(signalList == [signal.SIGUSR1])
+                uio.enableRingBuffer(0, None)
+                self.assertTrue(signal.getsignal(signal.SIGUSR1) is prevHandler)
+        finally:
+            signal.signal(signal.SIGUSR1, orgHandler)
+
+    def test30_flushSeconds(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            # Without a background thread flushSeconds is only checked when text is written.
+            logFile = os.path.join(tmpDir, "test30a.txt")
+            logFileWriter = LogFileWriter(logFile, flushSeconds=0.1)
+            logFileWriter.write("Line 1\n")
+            sleep(0.3)
+            self.assertFalse(os.path.isfile(logFile))
+            logFileWriter.write("Line 2\n")
+            self.assertTrue(self._getLogLines(logFile) == ["Line 1\n", "Line 2\n"])
+            logFileWriter.close()
+
+            # The background thread writes buffered text once flushSeconds have elapsed.
+            logFile = os.path.join(tmpDir, "test30b.txt")
+            logFileWriter = LogFileWriter(logFile, flushSeconds=0.1, background=True)
+            logFileWriter.write("Line 1\n")
+            for _ in range(40):
+                if os.path.isfile(logFile):
+                    break
+                sleep(0.05)
+            self.assertTrue(self._getLogLines(logFile) == ["Line 1\n"])
+            logFileWriter.close()
+
     #!!! getPassword() not tested as redirect does not work.
 
 def main():